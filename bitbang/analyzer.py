@@ -0,0 +1,280 @@
+"""
+Timing analysis of the generated shift byte functions.
+
+The scheduler only writes the time between clock edges into the code
+(/* \\_ (N cycles) */). analyze() times everything a device sees from a
+function called back to back, each call's clock edges following on from
+the last:
+
+  transitions  the cycle each data out change and data in sample happens
+               at, as an offset from the clock edge before it
+  setup / hold of data out against the edge the device samples it on, and
+               of the data in sample against the device changing it
+  duty         the low and high time of the clock in each bit
+  boundary     the clock across the end of one byte and the start of the
+               next, with the code before the first edge and after the
+               last (the Before / After rotates, the set up and the
+               calling glue) and the call in it
+
+The code runs straight through the same way whatever the data, so one run
+in the simulator gives the time of every edge. The data is chosen to change
+data out every bit, a change being the write of the bit.
+
+  python3 analyzer.py            The mpsse.py ShiftByte functions
+  python3 analyzer.py --json     The same as JSON
+  python3 analyzer.py NAME ...   Only the functions named
+"""
+
+import sys
+import json
+import collections
+
+import simulator
+import calling
+import software as sw
+
+# Changes data out every bit whichever end goes first
+DATA_OUT = 0x55
+
+EDGES = {0: "\\_", 1: "_/"}
+
+
+class Tracer(simulator.Simulator):
+	"""A Simulator keeping (cycle, text) of every instruction as it finishes."""
+
+	def __init__(self, program, symbols=None):
+		simulator.Simulator.__init__(self, program, symbols=symbols)
+		self.trace = []
+
+	def step(self):
+		s = self.program.statements[self.pc]
+		more = simulator.Simulator.step(self)
+		self.trace.append((self.cycle, s.text))
+		return more
+
+
+def _text(line):
+	return " ".join(simulator.ir.text(line).split()).lower()
+
+
+def samples(sim, lines):
+	"""The cycles the first of lines finished at, everywhere they ran in a row."""
+	want = [_text(l) for l in lines]
+	texts = [" ".join(t.split()).lower() for c, t in sim.trace]
+	return [sim.trace[i][0] for i in range(len(texts) - len(want) + 1)
+		if texts[i:i + len(want)] == want]
+
+
+def run(name, source, shifter, direction, read_on, write_on):
+	"""(simulator, cycles) of a call of name() from source."""
+	msb = direction == sw.ShiftOp.FirstBit.MSB
+	sim = Tracer(simulator.Program.from_c(source), symbols=shifter.symbols())
+	clk = simulator.pin_key(shifter.clk_pin.pin)
+	sim.sfr[simulator.OES[clk[0]] - 0x80] |= 1 << clk[1]
+	sim.sfr[simulator.PORTS[clk[0]] - 0x80] |= 1 << clk[1]
+	if write_on != sw.ShiftOp.ClockMode.none:
+		# Starting on the other level, so the first bit is a change too
+		dout = simulator.pin_key(shifter.dout_pin.pin)
+		sim.sfr[simulator.OES[dout[0]] - 0x80] |= 1 << dout[1]
+		if not simulator.byte_bits(DATA_OUT, msb)[0]:
+			sim.sfr[simulator.PORTS[dout[0]] - 0x80] |= 1 << dout[1]
+	if read_on != sw.ShiftOp.ClockMode.none:
+		sim.drive(shifter.din_pin.pin, simulator.serial_source(clk,
+			simulator.byte_bits(DATA_OUT, msb), int(read_on == sw.ShiftOp.ClockMode.positive)))
+	sim.write_direct(simulator.SFRS['DPL'], DATA_OUT)
+	return sim, sim.run("_" + name)
+
+
+def _before(edges, cycle):
+	"""The last of edges (cycle, level) at or before cycle, None if there isn't one."""
+	before = [e for e in edges if e[0] <= cycle]
+	return before[-1] if before else None
+
+
+def _after(edges, cycle, level):
+	"""The cycle of the first edge to level at or after cycle."""
+	return min(c for c, v in edges if v == level and c >= cycle)
+
+
+def _transition(edges, cycle):
+	"""The edge before cycle ("\\_" / "_/") and how long before it was."""
+	edge = _before(edges, cycle)
+	return EDGES[edge[1]], cycle - edge[0]
+
+
+def analyze(name, shifter, direction, read_on, write_on, body, count=8):
+	"""
+	The timing of name(), made by calling.generate() from a body shifting a
+	byte on shifter's pins, as a dict (see the module docstring). Cycles
+	are from the start of a call with one before it and one after.
+	"""
+	reading = read_on != sw.ShiftOp.ClockMode.none
+	writing = write_on != sw.ShiftOp.ClockMode.none
+	source = calling.generate(name, read_on, write_on, body)
+	sim, function = run(name, source, shifter, direction, read_on, write_on)
+	overhead = calling.call_cycles(source, int(writing), reading) - calling.function_cost(source)[0]
+	every = function + overhead
+
+	clk = simulator.pin_key(shifter.clk_pin.pin)
+	edges = sim.transitions(clk)
+	if len(edges) != 2 * count:
+		raise ValueError("%s makes %i clock edges, not %i" % (name, len(edges), 2 * count))
+
+	def calls(cycles):
+		"""cycles of one call as they fall in the call before, it and the one after."""
+		return [c + n * every for n in (-1, 0, 1) for c in cycles]
+
+	timeline = [(c + n * every, v) for n in (-1, 0, 1) for c, v in edges]
+	middle = timeline[2 * count:4 * count]
+
+	bits = []
+	for k in range(count):
+		first, second, following = timeline[2 * count + 2 * k:2 * count + 2 * k + 3]
+		phases = {first[1]: second[0] - first[0], second[1]: following[0] - second[0]}
+		bits.append({
+			'bit': k,
+			'edges': [first[0], second[0]],
+			'low': phases[0],
+			'high': phases[1],
+			'duty': phases[1] / float(phases[0] + phases[1]),
+		})
+
+	result = {
+		'name': name,
+		'cycles': function,
+		'every': every,
+		'bits': bits,
+	}
+
+	if writing:
+		dout = simulator.pin_key(shifter.dout_pin.pin)
+		changes = [c for c, v in sim.transitions(dout)]
+		if len(changes) != count:
+			raise ValueError("%s changes data out %i times, not %i" % (name, len(changes), count))
+		changes = calls(changes)
+		sample_level = int(write_on == sw.ShiftOp.ClockMode.negative)
+		for k, bit in enumerate(bits):
+			change = changes[count + k]
+			sample = _after(timeline, change, sample_level)
+			edge, offset = _transition(timeline, change)
+			bit['out'] = {
+				'cycle': change,
+				'edge': edge,
+				'offset': offset,
+				'sampled': sample,
+				'setup': sample - change,
+				'hold': changes[count + k + 1] - sample,
+			}
+
+	if reading:
+		read_level = int(read_on == sw.ShiftOp.ClockMode.positive)
+		# The pin access of the read, the rest can be scheduled apart from it
+		access = sw.ShiftByte.split(shifter.din_pin.bit_to_carry(), shifter.symbols())[0]
+		read = calls(samples(sim, access))
+		reads = [c for c, v in middle if v == read_level]
+		for k, bit in enumerate(bits):
+			sample = min(c for c in read if c >= reads[k])
+			# The device moves on to its next bit on the other edges
+			changed = _before([e for e in timeline if e[1] != read_level], sample)
+			moves = _after(timeline, sample + 1, 1 - read_level)
+			edge, offset = _transition(timeline, sample)
+			bit['in'] = {
+				'cycle': sample,
+				'edge': edge,
+				'offset': offset,
+				'setup': sample - changed[0],
+				'hold': moves - sample,
+			}
+
+	# The clock phase across the end of the byte, against the same phase
+	# inside it
+	last, following = timeline[4 * count - 1], timeline[4 * count]
+	inside = [b[0] - a[0] for a, b in zip(middle, middle[1:]) if a[1] == last[1]]
+	nominal = collections.Counter(inside).most_common(1)[0][0]
+	across = following[0] - last[0]
+	result['boundary'] = {
+		'level': last[1],
+		'cycles': across,
+		'inside': nominal,
+		'extra': across - nominal,
+		'lead_in': edges[0][0],
+		'tail': function - edges[-1][0],
+		'call': overhead,
+	}
+
+	for pin in ('out', 'in'):
+		if pin in bits[0]:
+			result[pin] = {
+				'setup_min': min(b[pin]['setup'] for b in bits),
+				'hold_min': min(b[pin]['hold'] for b in bits),
+			}
+	return result
+
+
+def report(result):
+	"""A result of analyze() as text."""
+	boundary = result['boundary']
+	lines = ["%s: %i cycles, called every %i back to back" % (
+		result['name'], result['cycles'], result['every'])]
+	header = "  bit  low high   duty"
+	for pin, label in (('out', 'dout change'), ('in', 'din sample')):
+		if pin in result:
+			header += "  %-11s %5s %4s" % (label, "setup", "hold")
+	lines.append(header)
+	for bit in result['bits']:
+		line = "  %3i %4i %4i %5.1f%%" % (bit['bit'], bit['low'], bit['high'], bit['duty'] * 100)
+		for pin in ('out', 'in'):
+			if pin in bit:
+				t = bit[pin]
+				line += "  %-11s %5i %4i" % ("%s +%i" % (t['edge'], t['offset']), t['setup'], t['hold'])
+		lines.append(line)
+	lines.append("  byte boundary: clock %s %i cycles, %i inside the byte (%+i), "
+		"%i before the first edge, %i after the last, %i calling" % (
+		"high" if boundary['level'] else "low", boundary['cycles'], boundary['inside'],
+		boundary['extra'], boundary['lead_in'], boundary['tail'], boundary['call']))
+	for pin, label in (('out', 'dout'), ('in', 'din')):
+		if pin in result:
+			lines.append("  %s worst: setup %i, hold %i" % (
+				label, result[pin]['setup_min'], result[pin]['hold_min']))
+	return "\n".join(lines)
+
+
+def functions():
+	"""(name, shifter, direction, read_on, write_on, body) of every ShiftByte function of mpsse.py."""
+	import mpsse
+
+	result = []
+	for d, read_on, write_on in mpsse.combos:
+		result.append((mpsse.function_name(d, read_on, write_on), mpsse.byte_shifter,
+			d, read_on, write_on, mpsse.byte_shifter.generate(d, read_on, write_on)))
+	for d, read_on, write_on in mpsse.combos:
+		shifter = mpsse.port_e_fastest(d, read_on, write_on)
+		result.append((mpsse.function_name(d, read_on, write_on, "PortE_ShiftByte"), shifter,
+			d, read_on, write_on, shifter.generate(d, read_on, write_on)))
+	jtag = (sw.ShiftOp.FirstBit.LSB, sw.ShiftOp.ClockMode.positive, sw.ShiftOp.ClockMode.negative)
+	for divisor in mpsse.RATE_DIVISORS:
+		result.append(("%s_Div%i" % (mpsse.function_name(*jtag), divisor), mpsse.byte_shifter)
+			+ jtag + (mpsse.byte_shifter.generate(*jtag, rate=mpsse.divisor_rate(divisor)),))
+	return result
+
+
+def main(args):
+	names = [a for a in args if not a.startswith("--")]
+	results = []
+	for name, shifter, d, read_on, write_on, body in functions():
+		if names and name not in names:
+			continue
+		results.append(analyze(name, shifter, d, read_on, write_on, body))
+	if names and len(results) != len(names):
+		sys.stderr.write("Unknown function in %s\n" % ", ".join(names))
+		return 1
+
+	if "--json" in args:
+		print(json.dumps(results, indent=2, sort_keys=True))
+	else:
+		print("\n\n".join(report(r) for r in results))
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,275 @@
+"""
+Throughput benchmark for the generated bit banging functions.
+
+Every ShiftByte_* variant from mpsse.py (on port A and on port E, through
+the proxy byte or the registers as mpsse.port_e_fastest() picks), the
+ShiftBytes_* / ShiftBytesAuto_* buffer functions, the ClockOnly functions
+and the i2cTest function from i2c.py is wrapped with the calling glue
+and run in the simulator. For each one the clock period (cycles per bit),
+the cycles for a whole call (including the calling convention glue, the
+lcall and the ret) and the resulting SCK frequency and effective Mbit/s at
+each CPU clock are reported.
+
+The cycle figures are compared against benchmark.json, so a generator change
+which makes any edge even one cycle slower fails "--check". So does a
+ShiftBytes_* or ClockBytes* loop which doesn't take the cycles per byte its
+model says.
+
+  python3 benchmark.py            Print the table
+  python3 benchmark.py --json     Print the results as JSON
+  python3 benchmark.py --check    Compare with the stored baseline
+  python3 benchmark.py --update   Rewrite the stored baseline
+"""
+
+import os
+import sys
+import json
+
+import cycles
+import calling
+import simulator
+import software as sw
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark.json")
+
+# Figures stored in the baseline, none of them may grow.
+CHECKED = ('call_cycles', 'period_max', 'high_max', 'low_max')
+
+# Data shifted out / in while benchmarking.
+DATA_OUT = 0xA5
+DATA_IN = 0x3C
+
+# Length of the buffers for the ShiftBytes functions
+BULK_BYTES = 16
+
+
+def call_overhead():
+	"""Cycles the caller spends getting into and out of the function."""
+	return cycles.parse_line("lcall\t_f")[0].cycles
+
+
+def run_function(name, read_on, write_on, body, clk, outputs, din=None,
+		read_edge=1, msb_first=True, symbols=None):
+	"""Run name() made from body and return the simulator."""
+	source = calling.generate(name=name, read_on=read_on, write_on=write_on, body=body)
+	sim = simulator.Simulator(simulator.Program.from_c(source), symbols=symbols)
+	clk = simulator.pin_key(clk)
+	for pin in [clk] + [simulator.pin_key(p) for p in outputs]:
+		sim.sfr[simulator.OES[pin[0]] - 0x80] |= 1 << pin[1]
+	sim.sfr[simulator.PORTS[clk[0]] - 0x80] |= 1 << clk[1]
+	sim.write_direct(simulator.SFRS['DPL'], DATA_OUT)
+	if din is not None:
+		sim.drive(din, simulator.serial_source(
+			clk, simulator.byte_bits(DATA_IN, msb_first), read_edge))
+	sim.run("_" + name)
+	return sim
+
+
+def measure(sim, clk):
+	stats = simulator.clock_stats(sim, clk)
+	call_cycles = sim.cycle + call_overhead()
+	period = stats.get('period_mean', 0)
+	result = {
+		'bits': stats['pulses'],
+		'call_cycles': call_cycles,
+		'cycles_per_bit': period,
+		'period_max': stats.get('period_max', 0),
+		'high_max': max(stats['high'] or [0]),
+		'low_max': max(stats['low'] or [0]),
+		'duty': stats.get('duty', 0),
+		'speeds': {},
+	}
+	for speed in cycles.CPUSpeed:
+		per_second = speed.cycles_per_second
+		result['speeds'][str(speed)] = {
+			'sck_hz': per_second / period if period else 0,
+			'mbit': stats['pulses'] * per_second / call_cycles / 1e6,
+		}
+	return result
+
+
+def run_bytes(shifter, name, d, read_on, write_on, count):
+	"""Run name() from shifter over count bytes and return the simulator."""
+	source = calling.generate_bytes(name, read_on, write_on,
+		shifter.generate(d, read_on, write_on, name))
+	reading = read_on != sw.ShiftOp.ClockMode.none
+	writing = write_on != sw.ShiftOp.ClockMode.none
+	return simulator.run_bytes(source, name, shifter.clk_pin.pin,
+		din=shifter.din_pin.pin if reading else None,
+		dout=shifter.dout_pin.pin if writing else None,
+		data=[DATA_OUT] * count if writing else (),
+		read_data=[DATA_IN] * count if reading else (),
+		msb_first=d == sw.ShiftOp.FirstBit.MSB,
+		read_edge=int(read_on == sw.ShiftOp.ClockMode.positive),
+		symbols=shifter.symbols())
+
+
+def bulk(shifter, name, d, read_on, write_on):
+	"""
+	Measure a ShiftBytes function over BULK_BYTES bytes. The cycles per byte
+	of the main loop come from the difference to a run unroll bytes longer.
+	"""
+	sim = run_bytes(shifter, name, d, read_on, write_on, BULK_BYTES)
+	longer = run_bytes(shifter, name, d, read_on, write_on, BULK_BYTES + shifter.unroll)
+	result = measure(sim, shifter.clk_pin.pin)
+	result['cycles_per_byte'] = (longer.cycle - sim.cycle) / float(shifter.unroll)
+	result['model_cycles_per_byte'] = shifter.cycles_per_byte(d, read_on, write_on)
+	return result
+
+
+def clocks(clocker, name, counted, body, count=None, gpio_bits=None):
+	"""Run a ClockOnly function, name(count) if counted, and return the simulator."""
+	if counted is None:
+		none = sw.ShiftOp.ClockMode.none
+		source = calling.generate_bits(name, none, none, body)
+	else:
+		source = calling.generate_clocks(name, counted, body)
+	gpio = clocker.din_pin.pin if gpio_bits else None
+	return simulator.run_clocks(source, name, clocker.clk_pin.pin,
+		[] if count is None else [count], gpio, gpio_bits, symbols=clocker.symbols())
+
+
+def clock_only(clocker):
+	"""
+	Measure the ClockOnly functions. The byte counted ones are checked
+	against ClockOnly.cycles() like bulk().
+	"""
+	model = clocker.cycles()
+	clk = clocker.clk_pin.pin
+	results = []
+
+	sim = clocks(clocker, "ClockBits", None, clocker.bits("ClockBits"), 7)
+	results.append(("ClockBits", measure(sim, clk)))
+
+	for name, body, kind in (
+			("ClockBytes", clocker.bytes("ClockBytes"), 'bytes'),
+			("ClockBytesUntilHigh", clocker.until("ClockBytesUntilHigh", 1, counted=True), 'until')):
+		# gpio stays low, so the until function runs to the end of the count
+		gpio_bits = (0,) if kind == 'until' else None
+		sim = clocks(clocker, name, True, body, BULK_BYTES - 1, gpio_bits)
+		longer = clocks(clocker, name, True, body, BULK_BYTES, gpio_bits)
+		result = measure(sim, clk)
+		result['cycles_per_byte'] = float(longer.cycle - sim.cycle)
+		per_clock, per_byte = model[kind]
+		result['model_cycles_per_byte'] = 8 * per_clock + per_byte
+		results.append((name, result))
+
+	sim = clocks(clocker, "ClockUntilHigh", False, clocker.until("ClockUntilHigh", 1),
+		gpio_bits=(0,) * (8 * BULK_BYTES - 1) + (1,))
+	results.append(("ClockUntilHigh", measure(sim, clk)))
+	return results
+
+
+def benchmark():
+	"""Returns an ordered list of (name, result) for every function."""
+	import mpsse
+	import i2c
+
+	results = []
+	for prefix, shifter in (("", mpsse.byte_shifter), ("PortE_", None)):
+		for d, read_on, write_on in mpsse.combos:
+			if prefix:
+				# Through the proxy byte or the registers, whichever is quicker
+				shifter = mpsse.port_e_fastest(d, read_on, write_on)
+			clk = shifter.clk_pin.pin
+			name = prefix + mpsse.function_name(d, read_on, write_on)
+			body = shifter.generate(d, read_on, write_on)
+			outputs = []
+			if write_on != sw.ShiftOp.ClockMode.none:
+				outputs.append(shifter.dout_pin.pin)
+			din = None
+			if read_on != sw.ShiftOp.ClockMode.none:
+				din = shifter.din_pin.pin
+			sim = run_function(name, read_on, write_on, body, clk, outputs,
+				din=din,
+				read_edge=int(read_on == sw.ShiftOp.ClockMode.positive),
+				msb_first=d == sw.ShiftOp.FirstBit.MSB,
+				symbols=shifter.symbols())
+			results.append((name, measure(sim, clk)))
+
+	for prefix, shifter in (("ShiftBytes", mpsse.bytes_shifter), ("ShiftBytesAuto", mpsse.auto_shifter)):
+		for d, read_on, write_on in mpsse.combos:
+			name = mpsse.function_name(d, read_on, write_on, prefix)
+			results.append((name, bulk(shifter, name, d, read_on, write_on)))
+
+	results += clock_only(mpsse.clocker)
+
+	source = calling.generate(name="i2cTest", read_on=i2c.read_on, write_on=i2c.write_on, body=i2c.body)
+	sim = simulator.run_i2c(source, "i2cTest", args=[DATA_OUT], symbols=i2c.master.symbols())
+	results.append(("i2cTest", measure(sim, i2c.clock.pin)))
+	return results
+
+
+def table(results):
+	speeds = [str(s) for s in cycles.CPUSpeed]
+	lines = []
+	header = "%-45s %4s %6s %6s %5s %6s" % ("function", "bits", "c/bit", "c/call", "hi/lo", "duty")
+	for s in speeds:
+		header += " %17s" % ("SCK, Mbit/s @%s" % s)
+	lines.append(header)
+	for name, r in results:
+		line = "%-45s %4i %6.2f %6i %2i/%-2i %5.1f%%" % (
+			name, r['bits'], r['cycles_per_bit'], r['call_cycles'],
+			r['high_max'], r['low_max'], r['duty'] * 100)
+		for s in speeds:
+			line += " %7.3fMHz %6.3f" % (
+				r['speeds'][s]['sck_hz'] / 1e6, r['speeds'][s]['mbit'])
+		lines.append(line)
+	return "\n".join(lines)
+
+
+def baseline(results):
+	return dict((name, dict((k, r[k]) for k in CHECKED)) for name, r in results)
+
+
+def check(results, stored):
+	"""Returns a list of problems compared to the stored baseline."""
+	problems = []
+	for name, r in results:
+		if 'cycles_per_byte' in r and r['cycles_per_byte'] != r['model_cycles_per_byte']:
+			problems.append("%s: %.2f cycles per byte, the model says %.2f" % (
+				name, r['cycles_per_byte'], r['model_cycles_per_byte']))
+	current = baseline(results)
+	for name in sorted(set(stored) | set(current)):
+		if name not in current:
+			problems.append("%s: missing" % name)
+			continue
+		if name not in stored:
+			problems.append("%s: not in baseline" % name)
+			continue
+		for k in CHECKED:
+			if current[name][k] > stored[name][k]:
+				problems.append("%s: %s went from %i to %i cycles" % (
+					name, k, stored[name][k], current[name][k]))
+			elif current[name][k] < stored[name][k]:
+				sys.stderr.write("%s: %s improved from %i to %i cycles, run --update\n" % (
+					name, k, stored[name][k], current[name][k]))
+	return problems
+
+
+def main(args):
+	results = benchmark()
+
+	if "--json" in args:
+		print(json.dumps([dict(r, name=name) for name, r in results], indent=2, sort_keys=True))
+	else:
+		print(table(results))
+
+	if "--update" in args:
+		with open(BASELINE, "w") as f:
+			json.dump(baseline(results), f, indent=1, sort_keys=True)
+			f.write("\n")
+
+	if "--check" in args:
+		with open(BASELINE) as f:
+			stored = json.load(f)
+		problems = check(results, stored)
+		for p in problems:
+			sys.stderr.write("REGRESSION %s\n" % p)
+		if problems:
+			return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
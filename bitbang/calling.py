@@ -2,9 +2,30 @@
 Generate functions for the sdcc calling convention.
 """
 
+import re
+
+import cycles
 import software
+import sfr
+import ir
+
+def entry(read_on, write_on):
+	"""
+	The instructions generate() starts a function with, getting A ready,
+	for passing in with the body when generate() is told to leave them out.
+	"""
+	if write_on != software.ShiftOp.ClockMode.none:
+		return [software.asm("mov", "a", "dpl", comment="Move arg0->a")]
+	if read_on != software.ShiftOp.ClockMode.none:
+		return [software.asm("clr", "a", comment="Get accumulator ready")]
+	return []
+
 
-def generate(name, read_on, write_on, body):
+def generate(name, read_on, write_on, body, entry=True):
+	"""
+	A function shifting the byte in A. Without entry the instructions of
+	entry() are taken to be in the body already.
+	"""
 
 	defs = ''
 	args = ''
@@ -13,13 +34,16 @@ def generate(name, read_on, write_on, body):
 		args = 'BYTE data'
 		defs = """
 	(data);
+"""
+		if entry:
+			defs += """\
 	__asm__("mov	a,dpl");	/* Move arg0->a */
 """
 	else:
 		args = ''
 
 	if read_on != software.ShiftOp.ClockMode.none:
-		if write_on == software.ShiftOp.ClockMode.none:
+		if write_on == software.ShiftOp.ClockMode.none and entry:
 			defs += """
 	__asm__("clr	a");		/* Get accumulator ready */
 """
@@ -33,7 +57,7 @@ def generate(name, read_on, write_on, body):
 		rettype = 'void'
 		ret = 'return;'
 
-	output = "\n	".join(body)
+	output = ir.render_c(body, "\n\t")
 
 	return """\
 /* ---------------------------- */
@@ -45,3 +69,216 @@ def generate(name, read_on, write_on, body):
 /* ---------------------------- */
 """ % locals()
 
+
+def generate_bytes(name, read_on, write_on, body):
+	"""
+	A function shifting a buffer, with the arguments given by
+	software.ShiftBytes.parameters() (the first in dptr, the others in
+	_name_PARM_n).
+	"""
+	params = software.ShiftBytes.parameters(read_on, write_on)
+	args = ', '.join(
+		'WORD length' if p == 'length' else '__xdata BYTE *%s' % p for p in params)
+	defs = "\n	".join('(%s);' % p for p in params)
+
+	output = ir.render_c(body, "\n\t")
+
+	return """\
+/* ---------------------------- */
+void %(name)s(%(args)s) {
+	%(defs)s
+	%(output)s
+	return;
+}
+/* ---------------------------- */
+""" % locals()
+
+def generate_bits(name, read_on, write_on, body):
+	"""
+	A function shifting 1 to 8 bits, with the arguments given by
+	software.ShiftBits.parameters() and returning the data read.
+	"""
+	params = software.ShiftBits.parameters(read_on, write_on)
+	args = ', '.join('BYTE %s' % p for p in params)
+	defs = "\n	".join('(%s);' % p for p in params)
+
+	if read_on != software.ShiftOp.ClockMode.none:
+		rettype = 'BYTE'
+		ret = """
+	__asm__("mov	dpl,a");	/* Move a->retvalue */
+	return;				/* return */
+"""
+	else:
+		rettype = 'void'
+		ret = 'return;'
+
+	output = ir.render_c(body, "\n\t")
+
+	return """\
+/* ---------------------------- */
+%(rettype)s %(name)s(%(args)s) {
+	%(defs)s
+	%(output)s
+	%(ret)s
+}
+/* ---------------------------- */
+""" % locals()
+
+def generate_clocks(name, counted, body):
+	"""
+	A function only clocking, name(WORD length) if counted else name(),
+	for the software.ClockOnly bodies taking a 16 bit length.
+	"""
+	args = 'WORD length' if counted else ''
+	defs = '(length);' if counted else ''
+
+	output = ir.render_c(body, "\n\t")
+
+	return """\
+/* ---------------------------- */
+void %(name)s(%(args)s) {
+	%(defs)s
+	%(output)s
+	return;
+}
+/* ---------------------------- */
+""" % locals()
+
+def reversed_body(read_on, write_on, core, table=software.REVERSE_TABLE):
+	"""
+	The body of an MSB first shift byte function going through core(), the
+	LSB first one, with the byte reversed on the way in and on the way out
+	(see software.reverse_lookup()). A write only one jumps to core() to
+	finish, saving a ret.
+	"""
+	body = []
+	if write_on != software.ShiftOp.ClockMode.none:
+		body += software.reverse_lookup(table) + [software.asm("mov", "dpl", "a")]
+	if read_on == software.ShiftOp.ClockMode.none:
+		return body + [software.asm("ljmp", "_%s" % core)]
+	return body + [
+		software.asm("lcall", "_%s" % core),
+		software.asm("mov", "a", "dpl"),
+	] + software.reverse_lookup(table)
+
+
+def function_cost(source):
+	"""
+	(cycles, bytes) of a function from generate() running straight through
+	its inline assembler, the ret sdcc adds included.
+	"""
+	texts = [cycles.asm_text(l).split(';', 1)[0].strip() for l in source.splitlines() if '__asm__' in l]
+	parsed = [cycles.parse_line(t) for t in texts if t and not t.endswith(':')]
+	ret = cycles.parse_line("ret")[0]
+	return (sum(i.cycles for i, operands in parsed) + ret.cycles,
+		sum(i.size for i, operands in parsed) + ret.size)
+
+
+# How the naked functions (generate_naked(), asm_module()) take their
+# arguments, for callers in assembler or inline assembler
+REGISTERS = """\
+A         the byte to write on the way in, the byte read on the way out
+R7        the length (number of bits - 1) of ShiftBits / ShiftTMS
+R6:R7     the length (number of bytes - 1) of ShiftBytes, high:low
+AUTOPTR1  the source of ShiftBytes
+AUTOPTR2  the destination of ShiftBytes
+They can change R0 - R7, DPTR, B, the carry and AUTOPTRSETUP, as sdcc
+functions can."""
+
+
+def generate_naked(name, contract, body):
+	"""
+	A __naked function taking its arguments in the registers REGISTERS
+	gives, contract saying which, so none of the sdcc glue generate() adds.
+	"""
+	output = ir.render_c(body, "\n\t")
+
+	return """\
+/* ---------------------------- */
+/* %(contract)s */
+void %(name)s(void) __naked {
+	%(output)s
+	__asm__ ("ret");
+}
+/* ---------------------------- */
+""" % locals()
+
+
+def prototype(name, contract):
+	"""The C prototype of a naked function."""
+	return "void %s(void);\t/* %s */" % (name, contract)
+
+
+_SYMBOL = re.compile(r'(?<![\w$])_[A-Za-z]\w*')
+
+
+def equates(lines, symbols=None):
+	"""
+	(name, value) of the SFRs, bits and proxy bytes lines use, from symbols
+	(a shifter's symbols()) and the sfr.py tables, for a module
+	without the C headers. Names it doesn't know are left out.
+	"""
+	symbols = symbols or {}
+	names = []
+	for l in lines:
+		for name in _SYMBOL.findall(" ".join(l.operands)):
+			if name not in names:
+				names.append(name)
+	result = []
+	for name in names:
+		bare = name.lstrip('_').upper()
+		for table in (symbols, sfr.BITS, sfr.SFRS):
+			key = name if table is symbols else bare
+			if key in table:
+				result.append((name, table[key]))
+				break
+	return result
+
+
+def asm_module(module, functions, symbols=None):
+	"""
+	A standalone sdas8051 .asm module of naked functions, given as (name,
+	contract, body), to link in rather than the C of generate_naked().
+	"""
+	lines = sum((list(body) for name, contract, body in functions), [])
+	out = [";--------------------------------------------------------"]
+	out += ["; %s" % l for l in ("Generated by mpsse.py, registers:\n" + REGISTERS).splitlines()]
+	out += [
+		";--------------------------------------------------------",
+		"\t.module %s" % module,
+	]
+	out += ["\t.globl _%s" % name for name, contract, body in functions]
+	out += ["%s\t= %#06x" % (name, value) for name, value in equates(lines, symbols)]
+	out.append("\t.area CSEG    (CODE)")
+	for name, contract, body in functions:
+		out += [
+			"; %s" % contract,
+			"_%s:" % name,
+			ir.render_asm(body),
+			"\tret",
+		]
+	return "\n".join(out) + "\n"
+
+
+def call_cycles(source, argument_bytes, reading):
+	"""
+	Cycles of a call to a function from generate(), generate_bits() or
+	generate_bytes() running straight through: moving argument_bytes in
+	(to dpl / dph / _name_PARM_n), the lcall, the function and fetching the
+	byte read back from dpl.
+	"""
+	move = software.asm("mov", "dpl", "r7").cycles
+	fetch = software.asm("mov", "a", "dpl").cycles if reading else 0
+	return argument_bytes * move + software.asm("lcall", "_f").cycles + function_cost(source)[0] + fetch
+
+
+def naked_overhead(registers=0, autopointer_bytes=0):
+	"""
+	Cycles of getting in and out of a naked function, A taken to be loaded
+	already: moving the other registers (R7, R6) and autopointer bytes in,
+	the lcall and the ret.
+	"""
+	move = software.asm("mov", "r7", "a").cycles
+	autopointer = software.asm("mov", "_AUTOPTRL1", "r7").cycles
+	return (registers * move + autopointer_bytes * autopointer
+		+ software.asm("lcall", "_f").cycles + software.asm("ret").cycles)
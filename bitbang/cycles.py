@@ -1,10 +1,15 @@
 """
 Tools for calculating the cycles ASM instructions need.
 
-Reads the information from the cycles.md file.
+Reads the information from the cycles.md file, or from the frozen copy in
+cycles_table.py generated by `python3 cycles.py --freeze cycles_table.py`.
 """
 
+import os
 import re
+import sys
+import hashlib
+import functools
 from collections import namedtuple
 from collections import OrderedDict
 from enum import Enum
@@ -43,7 +48,7 @@ class ArgType(Enum):
 
 	def regex(self):
 		a = "\s,\"'"
-		not_reg = '(?:[^{0}][^{0}][^{0}]+)|(?:[^{0}Rr][^{0}])|(?:[Rr][^0-7])|(?:[^{0}AaCcBb])'.format(a)
+		not_reg = '(?![#@/])(?![Dd][Pp][Tt][Rr](?:[{0}]|$))(?:(?:[^{0}][^{0}][^{0}]+)|(?:[^{0}Rr][^{0}])|(?:[Rr][^0-7])|(?:[^{0}AaCcBb]))'.format(a)
 		if self == ArgType.accumulator:
 			return '[Aa]'
 		elif self == ArgType.b:
@@ -67,16 +72,22 @@ class ArgType(Enum):
 		elif self == ArgType.immediate_word:
 			return '#[^\s,]+'
 		elif self == ArgType.address_full:
-			return ''
+			return not_reg
 		elif self == ArgType.address_small:
-			return ''
+			return not_reg
 		elif self == ArgType.program_counter:
-			return 'PC'
+			return '[Pp][Cc]'
 		elif self == ArgType.data_pointer:
-			return 'DPTR'
+			return '[Dd][Pp][Tt][Rr]'
 		elif self == ArgType.indirect_data_pointer:
-			return '@DPTR'
-	
+			return '@[Dd][Pp][Tt][Rr]'
+
+def arg_regex(arg):
+	"""Regex for an argument, including the @A+DPTR / @A+PC pairs."""
+	if isinstance(arg, tuple):
+		return r'@%s\s*\+\s*%s' % (arg[0].regex(), arg[1].regex())
+	return arg.regex()
+
 # ----------------------
 
 ArgsNone = namedtuple('ArgsNone', [])
@@ -96,7 +107,7 @@ class ArgsSingle(ArgsSingle):
 			return self.arg.value
 
 	def regex(self):
-		return "(?P<arg0>%s)" % self.arg.regex()
+		return "(?P<arg0>%s)" % arg_regex(self.arg)
 
 ArgsSimple = namedtuple('ArgsSimple', ['dst', 'src'])
 class ArgsSimple(ArgsSimple):
@@ -108,7 +119,7 @@ class ArgsSimple(ArgsSimple):
 		return "%s<-%s" % (self.dst.value, src)
 
 	def regex(self):
-		return r"(?P<arg0>%s)\s*,\s*(?P<arg1>%s)" % (self[0].regex(), self[1].regex())
+		return r"(?P<arg0>%s)\s*,\s*(?P<arg1>%s)" % (arg_regex(self[0]), arg_regex(self[1]))
 
 ArgsCompare = namedtuple('ArgsCompare', ['a', 'b', 'jump'])
 class ArgsCompare(ArgsCompare):
@@ -123,9 +134,12 @@ class ArgsMul(ArgsMul):
 	def __repr__(self):
 		return "AB"
 
+	def regex(self):
+		return "(?P<arg0>[Aa][Bb])"
+
 # ----------------------
 
-Instruction = namedtuple('Instruction', ['mneomic', 'args', 'description', 'size', 'cycles', 'flags']) #, 'opcodes'])
+Instruction = namedtuple('Instruction', ['mneomic', 'args', 'description', 'size', 'cycles', 'flags', 'opcodes'])
 class Instruction(Instruction):
 	def __repr__(self):
 		flags = " ".join(self.flags)
@@ -149,82 +163,273 @@ class Instruction(Instruction):
 	def regex(self):
 		return r"(?:[\s'\"]|^)(%s|%s)\s*%s(?:[\s'\"]|$)" % (self.mneomic.upper(), self.mneomic.lower(), self.args.regex())
 
-instructions = {}
-for line in open('cycles.md').readlines():
-	if not line.strip():
-		continue
-
-	_, mnemoic, desc, size, cycles, flags, opcode, _ = (x.strip() for x in line.split('|'))
-	if mnemoic.lower() == "mnemoic" or mnemoic.startswith("-"):
-		continue
-
-	if ' ' in mnemoic:
-		mnemoic_code, args = (x.strip() for x in mnemoic.split(' ', 1))
-		if args == 'AB':
-			args = ArgsMul(ArgType.accumulator, ArgType.b)
-		elif ',' in args:
-			arg0, arg1 = args.split(', ', 1)
-			arg0 = ArgType.convert(arg0)
-			if ',' in arg1:
-				arg1, arg2 = arg1.split(', ', 1)
-				arg1 = ArgType.convert(arg1)
-				arg2 = ArgType.convert(arg2)
-				args = ArgsCompare(arg0, arg1, arg2)
+# ----------------------
+
+# The FX2 takes 4 CPU clocks per instruction cycle
+CLOCKS_PER_CYCLE = 4
+
+class CPUSpeed(Enum):
+	"""CPU clock speeds the FX2 can run at (CPUCS.CLKSPD)."""
+	MHz12 = 12000000
+	MHz24 = 24000000
+	MHz48 = 48000000
+
+	@property
+	def cycles_per_second(self):
+		return self.value // CLOCKS_PER_CYCLE
+
+	@property
+	def cpucs(self):
+		"""The CLKSPD bits of CPUCS for this speed."""
+		return {12000000: 0x00, 24000000: 0x08, 48000000: 0x10}[self.value]
+
+	def __str__(self):
+		return "%iMHz" % (self.value // 1000000)
+
+CYCLES_MD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cycles.md')
+
+
+def read_table(f):
+	"""
+	Read the markdown table into rows of plain values.
+
+	(mnemoic, (args class, arg strings), description, size, cycles, flags, (first opcode, last opcode))
+	"""
+	rows = []
+	for line in f:
+		if not line.strip():
+			continue
+
+		_, mnemoic, desc, size, cycles, flags, opcode, _ = (x.strip() for x in line.split('|'))
+		if mnemoic.lower() == "mnemoic" or mnemoic.startswith("-"):
+			continue
+
+		if ' ' in mnemoic:
+			mnemoic_code, args = (x.strip() for x in mnemoic.split(' ', 1))
+			if args == 'AB':
+				args = ('ArgsMul', ('A', 'B'))
 			else:
-				arg1 = ArgType.convert(arg1)
-				args = ArgsSimple(arg0, arg1)
+				args = tuple(x.strip() for x in args.split(','))
+				args = ({1: 'ArgsSingle', 2: 'ArgsSimple', 3: 'ArgsCompare'}[len(args)], args)
 		else:
-			args = ArgsSingle(ArgType.convert(args))
-	else:
-		mnemoic_code = mnemoic
-		args = ArgsNone()
+			mnemoic_code = mnemoic
+			args = ('ArgsNone', ())
 
-	flags = list(x.strip() for x in flags.split())
-	
-	if '-' in opcode:
-		bopcode, topcode = (int(x, 16) for x in opcode.split('-'))
-	else:
-		bopcode = topcode = int(opcode, 16)
-	opcodes = [hex(x) for x in range(bopcode, topcode+1)]
+		if '-' in opcode:
+			bopcode, topcode = (int(x, 16) for x in opcode.split('-'))
+		else:
+			bopcode = topcode = int(opcode, 16)
 
-	size = int(size)
-	cycles = int(cycles)
+		rows.append((mnemoic_code, args, desc, int(size), int(cycles), tuple(flags.split()), (bopcode, topcode)))
+	return rows
 
-	instructions.setdefault(mnemoic_code, []).append(
-		Instruction(mnemoic_code, args, desc, size, cycles, flags)) #, opcodes))
 
+def build(rows):
+	"""Build the instruction dictionary from rows made by read_table."""
+	instructions = {}
+	for mnemoic_code, (args_class, args), desc, size, cycles, flags, (bopcode, topcode) in rows:
+		args = globals()[args_class](*(ArgType.convert(a) for a in args))
 
+		# The 11 bit address ops encode the top address bits in the opcode
+		step = 1
+		if ArgType.address_small in args:
+			step = 0x20
+		opcodes = range(bopcode, topcode+1, step)
 
-def parse(s):
+		instructions.setdefault(mnemoic_code, []).append(
+			Instruction(mnemoic_code, args, desc, size, cycles, flags, opcodes))
+	return instructions
+
+
+def table_hash(filename=CYCLES_MD):
+	with open(filename, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+
+def freeze(output, filename=CYCLES_MD):
+	"""Write the table as a Python module which load() can use instead of cycles.md."""
+	with open(filename) as f:
+		rows = read_table(f)
+	output.write('''\
+"""
+Generated from cycles.md by `python3 cycles.py --freeze`, do not edit.
+"""
+
+SOURCE_HASH = %r
+
+TABLE = (
+''' % table_hash(filename))
+	for mnemoic, args, desc, size, cycles, flags, opcodes in rows:
+		output.write("\t(%r, %r, %r, %i, %i, %r, (0x%02X, 0x%02X)),\n" % (
+			(mnemoic, args, desc, size, cycles, flags) + opcodes))
+	output.write(")\n")
+
+
+_instructions = None
+
+def load():
 	"""
+	Get the instruction table, loading it on first use.
+
+	The frozen table in cycles_table.py is used when it was generated from
+	the current cycles.md, otherwise cycles.md is parsed.
 	"""
+	global _instructions
+	if _instructions is not None:
+		return _instructions
 
-	output = []
-	for line in s.splitlines():
-		if not line.strip():
-			output.append(None)
+	rows = None
+	try:
+		import cycles_table
+	except ImportError:
+		cycles_table = None
+	if cycles_table is not None:
+		if not os.path.exists(CYCLES_MD) or cycles_table.SOURCE_HASH == table_hash():
+			rows = cycles_table.TABLE
+
+	if rows is None:
+		with open(CYCLES_MD) as f:
+			rows = read_table(f)
+
+	_instructions = build(rows)
+	return _instructions
+
+
+def __getattr__(name):
+	if name == 'instructions':
+		return load()
+	raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+_ASM_STRING = re.compile(r'__asm__\s*\(\s*([\'"])(.*?)\1')
+_MATCHERS = {}
+
+
+def asm_text(line):
+	"""Return the assembler text of a line, unwrapping __asm__ ("...")."""
+	m = _ASM_STRING.search(line)
+	if m:
+		return m.group(2)
+	return line
+
+
+def _matchers(mnemoic):
+	"""Compiled (Instruction, regex) pairs for a mnemonic, built once."""
+	try:
+		return _MATCHERS[mnemoic]
+	except KeyError:
+		pass
+	m = [(i, re.compile(i.regex())) for i in load().get(mnemoic, [])]
+	_MATCHERS[mnemoic] = m
+	return m
+
+
+@functools.lru_cache(maxsize=None)
+def parse_line(line):
+	"""
+	Match a single line against the instruction table.
+
+	Returns None for a blank line, otherwise (Instruction, operands). The
+	mnemonic is looked up by the first token of the assembler text so only
+	the patterns for that mnemonic are tried.
+	"""
+	if not line.strip():
+		return None
+
+	text = asm_text(line)
+	tokens = text.split(None, 1)
+	matches = []
+	if tokens:
+		for i, regex in _matchers(tokens[0].upper()):
+			r = regex.search(text)
+			if r:
+				matches.append((i, r.groups()[1:]))
+
+	assert len(matches) == 1, "%s\n%s" % (line, "\n".join(repr(x) for x in matches))
+	return matches[0]
+
+
+_REGISTER = re.compile(r'^[Rr][0-7]$')
+_INDIRECT = re.compile(r'^@[Rr][01]$')
+# Operands which can be any of these, the instruction decides
+_ADDRESSES = (ArgType.direct_byte, ArgType.relative, ArgType.direct_bit,
+	ArgType.address_full, ArgType.address_small)
+
+
+def operand_types(operand):
+	"""The ArgTypes (or @A+DPTR / @A+PC pairs) an operand can be."""
+	o = operand.strip().lower()
+	fixed = {
+		'a': ArgType.accumulator,
+		'c': ArgType.carry,
+		'dptr': ArgType.data_pointer,
+		'@dptr': ArgType.indirect_data_pointer,
+		'@a+dptr': (ArgType.accumulator, ArgType.data_pointer),
+		'@a+pc': (ArgType.accumulator, ArgType.program_counter),
+	}
+	if o in fixed:
+		return (fixed[o],)
+	if _REGISTER.match(o):
+		return (ArgType.register,)
+	if _INDIRECT.match(o):
+		return (ArgType.indirect_byte,)
+	if o.startswith('#'):
+		return (ArgType.immediate_byte, ArgType.immediate_word)
+	if o.startswith('/'):
+		return (ArgType.inverse_direct_bit,)
+	return _ADDRESSES
+
+
+@functools.lru_cache(maxsize=None)
+def lookup(mnemonic, operands):
+	"""
+	The Instruction for a mnemonic and its operands (a tuple of strings),
+	picked by the kind of each operand. ValueError if there isn't exactly
+	one.
+	"""
+	matches = []
+	for i in load().get(mnemonic.upper(), []):
+		if isinstance(i.args, ArgsMul):
+			if [o.lower() for o in operands] == ['ab']:
+				matches.append(i)
 			continue
+		args = tuple(i.args)
+		if len(args) == len(operands) and all(a in operand_types(o) for a, o in zip(args, operands)):
+			matches.append(i)
+	if len(matches) != 1:
+		raise ValueError("%s %s matches %s" % (mnemonic, ",".join(operands),
+			", ".join(repr(m) for m in matches) or "no instruction"))
+	return matches[0]
 
-		lline = line.lower()
 
-		matches = []
-		for op in instructions:
-			if op.lower() not in lline:
-				continue
+def parse(s):
+	"""
+	Parse a block of text, one result per line (see parse_line).
+	"""
+	return [parse_line(line) for line in s.splitlines()]
 
-			for i in instructions[op]:
-				r = re.search(i.regex(), line)
-				if r:
-					matches.append((i, r.groups()[1:]))
 
-		assert len(matches) == 1, "%s\n%s" % (line, "\n".join(repr(x) for x in matches))
-		output.append(matches[0])
+def parse_many(lines):
+	"""
+	Parse an iterable of lines (each possibly multi-line) as one block.
+	"""
+	output = []
+	for l in lines:
+		output += [parse_line(x) for x in (l.splitlines() or [l])]
 	return output
 
 
 if __name__ == "__main__":
+	if len(sys.argv) > 1 and sys.argv[1] == '--freeze':
+		if len(sys.argv) > 2:
+			with open(sys.argv[2], 'w') as f:
+				freeze(f)
+		else:
+			freeze(sys.stdout)
+		sys.exit(0)
+
 	import pprint
-	pprint.pprint(instructions)
+	pprint.pprint(load())
 
 	def parse_and_print(s):
 		instructions = parse(s)
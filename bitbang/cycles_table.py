@@ -0,0 +1,119 @@
+"""
+Generated from cycles.md by `python3 cycles.py --freeze`, do not edit.
+"""
+
+SOURCE_HASH = '93c6e4f90e91f01854c7ee7484f569f980aef623'
+
+TABLE = (
+	('ADD', ('ArgsSimple', ('A', 'Rn')), 'Add register to A', 1, 1, ('CY', 'OV', 'AC'), (0x28, 0x2F)),
+	('ADD', ('ArgsSimple', ('A', 'direct')), 'Add direct byte to A', 2, 2, ('CY', 'OV', 'AC'), (0x25, 0x25)),
+	('ADD', ('ArgsSimple', ('A', '@Ri')), 'Add data memory to A', 1, 1, ('CY', 'OV', 'AC'), (0x26, 0x27)),
+	('ADD', ('ArgsSimple', ('A', '#data')), 'Add immediate to A', 2, 2, ('CY', 'OV', 'AC'), (0x24, 0x24)),
+	('ADDC', ('ArgsSimple', ('A', 'Rn')), 'Add register to A with carry', 1, 1, ('CY', 'OV', 'AC'), (0x38, 0x3F)),
+	('ADDC', ('ArgsSimple', ('A', 'direct')), 'Add direct byte to A with carry', 2, 2, ('CY', 'OV', 'AC'), (0x35, 0x35)),
+	('ADDC', ('ArgsSimple', ('A', '@Ri')), 'Add data memory to A with carry', 1, 1, ('CY', 'OV', 'AC'), (0x36, 0x37)),
+	('ADDC', ('ArgsSimple', ('A', '#data')), 'Add immediate to A with carry', 2, 2, ('CY', 'OV', 'AC'), (0x34, 0x34)),
+	('SUBB', ('ArgsSimple', ('A', 'Rn')), 'Subtract register from A with borrow', 1, 1, ('CY', 'OV', 'AC'), (0x98, 0x9F)),
+	('SUBB', ('ArgsSimple', ('A', 'direct')), 'Subtract direct byte from A with borrow', 2, 2, ('CY', 'OV', 'AC'), (0x95, 0x95)),
+	('SUBB', ('ArgsSimple', ('A', '@Ri')), 'Subtract data memory from A with borrow', 1, 1, ('CY', 'OV', 'AC'), (0x96, 0x97)),
+	('SUBB', ('ArgsSimple', ('A', '#data')), 'Subtract immediate from A with borrow', 2, 2, ('CY', 'OV', 'AC'), (0x94, 0x94)),
+	('INC', ('ArgsSingle', ('A',)), 'Increment A', 1, 1, (), (0x04, 0x04)),
+	('INC', ('ArgsSingle', ('Rn',)), 'Increment register', 1, 1, (), (0x08, 0x0F)),
+	('INC', ('ArgsSingle', ('direct',)), 'Increment direct byte', 2, 2, (), (0x05, 0x05)),
+	('INC', ('ArgsSingle', ('@Ri',)), 'Increment data memory', 1, 1, (), (0x06, 0x07)),
+	('DEC', ('ArgsSingle', ('A',)), 'Decrement A', 1, 1, (), (0x14, 0x14)),
+	('DEC', ('ArgsSingle', ('Rn',)), 'Decrement Register', 1, 1, (), (0x18, 0x1F)),
+	('DEC', ('ArgsSingle', ('direct',)), 'Decrement direct byte', 2, 2, (), (0x15, 0x15)),
+	('DEC', ('ArgsSingle', ('@Ri',)), 'Decrement data memory', 1, 1, (), (0x16, 0x17)),
+	('INC', ('ArgsSingle', ('DPTR',)), 'Increment data pointer', 1, 3, (), (0xA3, 0xA3)),
+	('MUL', ('ArgsMul', ('A', 'B')), 'Multiply A and B (unsigned; product in B:A)', 1, 5, ('CY=0', 'OV'), (0xA4, 0xA4)),
+	('DIV', ('ArgsMul', ('A', 'B')), 'Divide A by B (unsigned; quotient in A, remainder in B)', 1, 5, ('CY=0', 'OV'), (0x84, 0x84)),
+	('DA', ('ArgsSingle', ('A',)), 'Decimal adjust A', 1, 1, ('CY',), (0xD4, 0xD4)),
+	('ANL', ('ArgsSimple', ('A', 'Rn')), 'AND register to A', 1, 1, (), (0x58, 0x5F)),
+	('ANL', ('ArgsSimple', ('A', 'direct')), 'AND direct byte to A', 2, 2, (), (0x55, 0x55)),
+	('ANL', ('ArgsSimple', ('A', '@Ri')), 'AND data memory to A', 1, 1, (), (0x56, 0x57)),
+	('ANL', ('ArgsSimple', ('A', '#data')), 'AND immediate to A', 2, 2, (), (0x54, 0x54)),
+	('ANL', ('ArgsSimple', ('direct', 'A')), 'AND A to direct byte', 2, 2, (), (0x52, 0x52)),
+	('ANL', ('ArgsSimple', ('direct', '#data')), 'AND immediate data to direct byte', 3, 3, (), (0x53, 0x53)),
+	('ORL', ('ArgsSimple', ('A', 'Rn')), 'OR register to A', 1, 1, (), (0x48, 0x4F)),
+	('ORL', ('ArgsSimple', ('A', 'direct')), 'OR direct byte to A', 2, 2, (), (0x45, 0x45)),
+	('ORL', ('ArgsSimple', ('A', '@Ri')), 'OR data memory to A', 1, 1, (), (0x46, 0x47)),
+	('ORL', ('ArgsSimple', ('A', '#data')), 'OR immediate to A', 2, 2, (), (0x44, 0x44)),
+	('ORL', ('ArgsSimple', ('direct', 'A')), 'OR A to direct byte', 2, 2, (), (0x42, 0x42)),
+	('ORL', ('ArgsSimple', ('direct', '#data')), 'OR immediate data to direct byte', 3, 3, (), (0x43, 0x43)),
+	('XRL', ('ArgsSimple', ('A', 'Rn')), 'Exclusive-OR register to A', 1, 1, (), (0x68, 0x6F)),
+	('XRL', ('ArgsSimple', ('A', 'direct')), 'Exclusive-OR direct byte to A', 2, 2, (), (0x65, 0x65)),
+	('XRL', ('ArgsSimple', ('A', '@Ri')), 'Exclusive-OR data memory to A', 1, 1, (), (0x66, 0x67)),
+	('XRL', ('ArgsSimple', ('A', '#data')), 'Exclusive-OR immediate to A', 2, 2, (), (0x64, 0x64)),
+	('XRL', ('ArgsSimple', ('direct', 'A')), 'Exclusive-OR A to direct byte', 2, 2, (), (0x62, 0x62)),
+	('XRL', ('ArgsSimple', ('direct', '#data')), 'Exclusive-OR immediate to direct byte', 3, 3, (), (0x63, 0x63)),
+	('CLR', ('ArgsSingle', ('A',)), 'Clear A', 1, 1, (), (0xE4, 0xE4)),
+	('CPL', ('ArgsSingle', ('A',)), 'Complement A', 1, 1, (), (0xF4, 0xF4)),
+	('SWAP', ('ArgsSingle', ('A',)), 'Swap nibbles of a', 1, 1, (), (0xC4, 0xC4)),
+	('RL', ('ArgsSingle', ('A',)), 'Rotate A left', 1, 1, (), (0x23, 0x23)),
+	('RLC', ('ArgsSingle', ('A',)), 'Rotate A left through carry', 1, 1, ('CY',), (0x33, 0x33)),
+	('RR', ('ArgsSingle', ('A',)), 'Rotate A right', 1, 1, (), (0x03, 0x03)),
+	('RRC', ('ArgsSingle', ('A',)), 'Rotate A right through carry', 1, 1, ('CY',), (0x13, 0x13)),
+	('MOV', ('ArgsSimple', ('A', 'Rn')), 'Move register to A', 1, 1, (), (0xE8, 0xEF)),
+	('MOV', ('ArgsSimple', ('A', 'direct')), 'Move direct byte to A', 2, 2, (), (0xE5, 0xE5)),
+	('MOV', ('ArgsSimple', ('A', '@Ri')), 'Move data byte at Ri to A', 1, 1, (), (0xE6, 0xE7)),
+	('MOV', ('ArgsSimple', ('A', '#data')), 'Move immediate to A', 2, 2, (), (0x74, 0x74)),
+	('MOV', ('ArgsSimple', ('Rn', 'A')), 'Move A to register', 1, 1, (), (0xF8, 0xFF)),
+	('MOV', ('ArgsSimple', ('Rn', 'direct')), 'Move direct byte to register', 2, 2, (), (0xA8, 0xAF)),
+	('MOV', ('ArgsSimple', ('Rn', '#data')), 'Move immediate to register', 2, 2, (), (0x78, 0x7F)),
+	('MOV', ('ArgsSimple', ('direct', 'A')), 'Move A to direct byte', 2, 2, (), (0xF5, 0xF5)),
+	('MOV', ('ArgsSimple', ('direct', 'Rn')), 'Move register to direct byte', 2, 2, (), (0x88, 0x8F)),
+	('MOV', ('ArgsSimple', ('direct', 'direct')), 'Move direct byte to direct byte', 3, 3, (), (0x85, 0x85)),
+	('MOV', ('ArgsSimple', ('direct', '@Ri')), 'Move data byte at Ri to direct byte', 2, 2, (), (0x86, 0x87)),
+	('MOV', ('ArgsSimple', ('direct', '#data')), 'Move immediate to direct byte', 3, 3, (), (0x75, 0x75)),
+	('MOV', ('ArgsSimple', ('@Ri', 'A')), 'Move A to data memory at address Ri', 1, 1, (), (0xF6, 0xF7)),
+	('MOV', ('ArgsSimple', ('@Ri', 'direct')), 'Move direct byte to data memory at address Ri', 2, 2, (), (0xA6, 0xA7)),
+	('MOV', ('ArgsSimple', ('@Ri', '#data')), 'Move immediate to data memory at address Ri', 2, 2, (), (0x76, 0x77)),
+	('MOV', ('ArgsSimple', ('DPTR', '#data16')), 'Move 16-bit immediate to data pointer', 3, 3, (), (0x90, 0x90)),
+	('MOVC', ('ArgsSimple', ('A', '@A+DPTR')), 'Move code byte at address DPTR+A to A', 1, 3, (), (0x93, 0x93)),
+	('MOVC', ('ArgsSimple', ('A', '@A+PC')), 'Move code byte at address PC+A to A', 1, 3, (), (0x83, 0x83)),
+	('MOVX', ('ArgsSimple', ('A', '@Ri')), 'Move external data at address Ri to A', 1, 2, (), (0xE2, 0xE3)),
+	('MOVX', ('ArgsSimple', ('A', '@DPTR')), 'Move external data at address DPTR to A', 1, 2, (), (0xE0, 0xE0)),
+	('MOVX', ('ArgsSimple', ('@Ri', 'A')), 'Move A to external data at address Ri', 1, 2, (), (0xF2, 0xF3)),
+	('MOVX', ('ArgsSimple', ('@DPTR', 'A')), 'Move A to external data at address DPTR', 1, 2, (), (0xF0, 0xF0)),
+	('PUSH', ('ArgsSingle', ('direct',)), 'Push direct byte onto stack', 2, 2, (), (0xC0, 0xC0)),
+	('POP', ('ArgsSingle', ('direct',)), 'Pop direct byte from stack', 2, 2, (), (0xD0, 0xD0)),
+	('XCH', ('ArgsSimple', ('A', 'Rn')), 'Exchange A and register', 1, 1, (), (0xC8, 0xCF)),
+	('XCH', ('ArgsSimple', ('A', 'direct')), 'Exchange A and direct byte', 2, 2, (), (0xC5, 0xC5)),
+	('XCH', ('ArgsSimple', ('A', '@Ri')), 'Exchange A and data memory at address Ri', 1, 1, (), (0xC6, 0xC7)),
+	('XCHD', ('ArgsSimple', ('A', '@Ri')), 'Exchange the low-order nibbles of A and data memory at address Ri', 1, 1, (), (0xD6, 0xD7)),
+	('CLR', ('ArgsSingle', ('C',)), 'Clear carry', 1, 1, ('CY=0',), (0xC3, 0xC3)),
+	('CLR', ('ArgsSingle', ('bit',)), 'Clear direct bit', 2, 2, (), (0xC2, 0xC2)),
+	('SETB', ('ArgsSingle', ('C',)), 'Set carry', 1, 1, ('CY=1',), (0xD3, 0xD3)),
+	('SETB', ('ArgsSingle', ('bit',)), 'Set direct bit', 2, 2, (), (0xD2, 0xD2)),
+	('CPL', ('ArgsSingle', ('C',)), 'Complement carry', 1, 1, ('CY',), (0xB3, 0xB3)),
+	('CPL', ('ArgsSingle', ('bit',)), 'Complement direct bit', 2, 2, (), (0xB2, 0xB2)),
+	('ANL', ('ArgsSimple', ('C', 'bit')), 'AND direct bit to carry', 2, 2, ('CY',), (0x82, 0x82)),
+	('ANL', ('ArgsSimple', ('C', '/bit')), 'AND inverse of direct bit to carry', 2, 2, ('CY',), (0xB0, 0xB0)),
+	('ORL', ('ArgsSimple', ('C', 'bit')), 'OR direct bit to carry', 2, 2, ('CY',), (0x72, 0x72)),
+	('ORL', ('ArgsSimple', ('C', '/bit')), 'OR inverse of direct bit to carry', 2, 2, ('CY',), (0xA0, 0xA0)),
+	('MOV', ('ArgsSimple', ('C', 'bit')), 'Move direct bit to carry', 2, 2, ('CY',), (0xA2, 0xA2)),
+	('MOV', ('ArgsSimple', ('bit', 'C')), 'Move carry to direct bit', 2, 2, (), (0x92, 0x92)),
+	('ACALL', ('ArgsSingle', ('addr11',)), 'Absolute call to subroutine', 2, 3, (), (0x11, 0xF1)),
+	('LCALL', ('ArgsSingle', ('addr16',)), 'Long call to subroutine', 3, 4, (), (0x12, 0x12)),
+	('RET', ('ArgsNone', ()), 'Return from subroutine', 1, 4, (), (0x22, 0x22)),
+	('RETI', ('ArgsNone', ()), 'Return from interrupt', 1, 4, (), (0x32, 0x32)),
+	('AJMP', ('ArgsSingle', ('addr11',)), 'Absolute jump unconditional', 2, 3, (), (0x01, 0xE1)),
+	('LJMP', ('ArgsSingle', ('addr16',)), 'Long jump unconditional', 3, 4, (), (0x02, 0x02)),
+	('SJMP', ('ArgsSingle', ('rel',)), 'Short jump (relative address)', 2, 3, (), (0x80, 0x80)),
+	('JC', ('ArgsSingle', ('rel',)), 'Jump if carry = 1', 2, 3, (), (0x40, 0x40)),
+	('JNC', ('ArgsSingle', ('rel',)), 'Jump if carry = 0', 2, 3, (), (0x50, 0x50)),
+	('JB', ('ArgsSimple', ('bit', 'rel')), 'Jump if direct bit = 1', 3, 4, (), (0x20, 0x20)),
+	('JNB', ('ArgsSimple', ('bit', 'rel')), 'Jump if direct bit = 0', 3, 4, (), (0x30, 0x30)),
+	('JBC', ('ArgsSimple', ('bit', 'rel')), 'Jump if direct bit = 1, then clear the bit', 3, 4, (), (0x10, 0x10)),
+	('JMP', ('ArgsSingle', ('@A+DPTR',)), 'Jump indirect to address DPTR+A', 1, 3, (), (0x73, 0x73)),
+	('JZ', ('ArgsSingle', ('rel',)), 'Jump if accumulator = 0', 2, 3, (), (0x60, 0x60)),
+	('JNZ', ('ArgsSingle', ('rel',)), 'Jump if accumulator is non-zero', 2, 3, (), (0x70, 0x70)),
+	('CJNE', ('ArgsCompare', ('A', 'direct', 'rel')), 'Compare A to direct byte; jump if not equal', 3, 4, ('CY',), (0xB5, 0xB5)),
+	('CJNE', ('ArgsCompare', ('A', '#data', 'rel')), 'Compare A to immediate; jump if not equal', 3, 4, ('CY',), (0xB4, 0xB4)),
+	('CJNE', ('ArgsCompare', ('Rn', '#data', 'rel')), 'Compare register to immediate; jump if not equal', 3, 4, ('CY',), (0xB8, 0xBF)),
+	('CJNE', ('ArgsCompare', ('@Ri', '#data', 'rel')), 'Compare data memory to immediate; jump if not equal', 3, 4, ('CY',), (0xB6, 0xB7)),
+	('DJNZ', ('ArgsSimple', ('Rn', 'rel')), 'Decrement register; jump if not zero', 2, 3, (), (0xD8, 0xDF)),
+	('DJNZ', ('ArgsSimple', ('direct', 'rel')), 'Decrement direct byte; jump if not zero', 3, 4, (), (0xD5, 0xD5)),
+	('NOP', ('ArgsNone', ()), 'No operation', 1, 1, (), (0x00, 0x00)),
+)
@@ -0,0 +1,314 @@
+"""
+Jump table dispatch of the MPSSE data shifting commands.
+
+The opcode of an MPSSE data shifting command is a set of flags,
+
+  bit 0  -ve CLK on write
+  bit 1  bit mode (else byte mode)
+  bit 2  -ve CLK on read
+  bit 3  LSB first
+  bit 4  write TDI
+  bit 5  read TDO
+  bit 6  write TMS (a different set of commands)
+
+so rather than testing the flags (or comparing against each opcode) in turn,
+the opcode indexes a table of LJMPs with JMP @A+DPTR. Opcodes with bit 6 or
+7 set (the TMS and the other MPSSE commands) are turned away before that.
+Every entry jumps to a stub moving the arguments to where the shift function
+wants them, which then calls the function. The time from the call to the
+first instruction of the function only depends on the arguments the
+function takes (see latency()).
+
+  BYTE ShiftDispatch(BYTE opcode, __xdata BYTE *src, __xdata BYTE *dst, WORD length)
+
+returns DISPATCH_OK, or DISPATCH_BAD for an opcode there's no function for.
+In bit mode length is the number of bits less one, the data comes from *src
+and the data read goes to *dst.
+"""
+
+import cycles
+import ir
+import software as sw
+from software import asm
+
+MASK = 0x3f
+
+# What ShiftDispatch() returns
+DISPATCH_OK = 0x00
+DISPATCH_BAD = 0x01
+
+WRITE_NEG = 0x01
+BIT_MODE = 0x02
+READ_NEG = 0x04
+LSB_FIRST = 0x08
+WRITE = 0x10
+READ = 0x20
+
+# Arguments of the dispatch function, the first comes in dpl
+PARAMETERS = ["opcode", "src", "dst", "length"]
+
+# Where the arguments are kept while the table is walked. sdcc can't see the
+# LCALL in the inline assembler, so it may overlay the parameters of the
+# dispatcher with those of the shift function; they're all read before any
+# of the shift function's are written, whichever way they're laid out.
+REGISTERS = {
+	"src": ("r2", "r3"),
+	"dst": ("r4", "r5"),
+	"length": ("r6", "r7"),
+}
+
+
+def decode(opcode):
+	"""
+	(FirstBit, read_on, write_on, bit mode) for an opcode, None if it
+	doesn't shift any data.
+	"""
+	ClockMode = sw.ShiftOp.ClockMode
+	if opcode & ~MASK or not opcode & (READ | WRITE):
+		return None
+
+	write_on = ClockMode.none
+	if opcode & WRITE:
+		write_on = ClockMode.negative if opcode & WRITE_NEG else ClockMode.positive
+	read_on = ClockMode.none
+	if opcode & READ:
+		read_on = ClockMode.negative if opcode & READ_NEG else ClockMode.positive
+	d = sw.ShiftOp.FirstBit.LSB if opcode & LSB_FIRST else sw.ShiftOp.FirstBit.MSB
+	return d, read_on, write_on, bool(opcode & BIT_MODE)
+
+
+def targets(function):
+	"""
+	The table, one entry for each opcode & MASK. function(d, read_on,
+	write_on, bits) gives the (name, parameters) of the function for a
+	command, or None if it isn't supported.
+	"""
+	table = []
+	for opcode in range(MASK + 1):
+		flags = decode(opcode)
+		table.append(function(*flags) if flags else None)
+	return table
+
+
+def _parm(name, i):
+	return "_%s_PARM_%i" % (name, i + 1)
+
+
+def stub(function, params, flags):
+	"""
+	The code moving the arguments (kept in REGISTERS) to the parameters of
+	function, a shift function for a command with decode() flags, calling
+	it and, for a bit mode read, storing the data read at dst.
+	"""
+	d, read_on, write_on, bits = flags
+	cmds = []
+	for i, p in enumerate(params):
+		if bits:
+			# A byte of data from src and the low byte of length
+			if p == "data":
+				low, high = REGISTERS["src"]
+				cmds += [
+					asm("mov", "dpl", low),
+					asm("mov", "dph", high),
+					asm("movx", "a", "@dptr", comment="data = *src"),
+				]
+				value = "a"
+			else:
+				value = REGISTERS["length"][0]
+			cmds.append(asm("mov", "dpl" if i == 0 else _parm(function, i), value))
+		elif i == 0:
+			low, high = REGISTERS[p]
+			cmds += [asm("mov", "dpl", low), asm("mov", "dph", high)]
+		else:
+			low, high = REGISTERS[p]
+			cmds += [
+				asm("mov", _parm(function, i), low),
+				asm("mov", "(%s+1)" % _parm(function, i), high),
+			]
+	storing = bits and read_on != sw.ShiftOp.ClockMode.none
+	if storing:
+		# The function can use any register
+		low, high = REGISTERS["dst"]
+		cmds += [asm("push", "a%s" % low), asm("push", "a%s" % high)]
+	cmds.append(asm("lcall", "_%s" % function))
+	if storing:
+		cmds += [
+			asm("mov", "a", "dpl", comment="data read"),
+			asm("pop", "dph"),
+			asm("pop", "dpl"),
+			asm("movx", "@dptr", "a", comment="*dst = data read"),
+		]
+	return cmds
+
+
+def body(name, table):
+	"""The inline assembler of the dispatch function name()."""
+	assert len(table) == MASK + 1
+	labels = sw.Labels()
+	start, done, bad, index = labels(), labels(), labels(), labels()
+
+	cmds = [
+		asm("mov", "a", "dpl", comment="opcode"),
+		asm("cjne", "a", "#0x%02x" % (MASK + 1), index, comment="carry if it's in the table"),
+		ir.Label(index),
+		asm("jnc", bad),
+		asm("rl", "a"),
+		asm("rl", "a", comment="4 bytes an entry"),
+	]
+	for i, p in enumerate(PARAMETERS[1:], 1):
+		low, high = REGISTERS[p]
+		cmds += [
+			asm("mov", low, _parm(name, i), comment=p),
+			asm("mov", high, "(%s+1)" % _parm(name, i)),
+		]
+	cmds += [
+		asm("mov", "dptr", "#%s" % start),
+		asm("jmp", "@a+dptr"),
+		ir.Label(done),
+		asm("mov", "dpl", "#0x%02x" % DISPATCH_OK),
+		asm("ret"),
+		# Commands which aren't supported
+		ir.Label(bad),
+		asm("mov", "dpl", "#0x%02x" % DISPATCH_BAD),
+		asm("ret"),
+		ir.Label(start),
+	]
+
+	stubs = []
+	for opcode, target in enumerate(table):
+		if target is None:
+			label = bad
+		else:
+			for label, t, flags in stubs:
+				if t == target:
+					break
+			else:
+				label = labels()
+				stubs.append((label, target, decode(opcode)))
+		cmds += [asm("ljmp", label, comment="0x%02x" % opcode), asm("nop")]
+
+	for label, (function, params), flags in stubs:
+		cmds.append(ir.Label(label))
+		cmds += stub(function, params, flags)
+		cmds.append(asm("ljmp", done))
+	return cmds
+
+
+def generate(name, table):
+	"""
+	The C dispatch function name(opcode, src, dst, length), see body().
+	It's __naked, every way through the body ends in a RET with the status
+	in dpl, so there's no epilogue for them to skip and no C return.
+	"""
+	args = "BYTE opcode, __xdata BYTE *src, __xdata BYTE *dst, WORD length"
+	defs = "\n	".join("(%s);" % p for p in PARAMETERS)
+	output = ir.render_c(body(name, table), "\n\t")
+	return """\
+/* ---------------------------- */
+BYTE %(name)s(%(args)s) __naked {
+	%(defs)s
+	%(output)s
+}
+/* ---------------------------- */
+""" % locals()
+
+
+def _cycles(lines):
+	return sw.cycle_count(lines)
+
+
+def latency(table, opcode):
+	"""
+	Cycles from the start of the dispatch function to the first instruction
+	of the shift function for opcode (or through the return for a bad one).
+	"""
+	lines = body("f", table)
+	jump = [i for i, l in enumerate(lines) if l.mnemonic == "jmp"][0]
+	rejected = _cycles([asm("mov", "dpl", "#0x%02x" % DISPATCH_BAD), asm("ret")])
+	if opcode & ~MASK:
+		# Up to the JNC turning it away
+		return _cycles(lines[:4]) + rejected
+	# Up to the JMP, then the table entry
+	total = _cycles(lines[:jump + 1]) + asm("ljmp", "00000$").cycles
+	target = table[opcode]
+	if target is None:
+		return total + rejected
+	function, params = target
+	lines = stub(function, params, decode(opcode))
+	call = [i for i, l in enumerate(lines) if l.mnemonic == "lcall"][0]
+	return total + _cycles(lines[:call + 1])
+
+
+if __name__ == "__main__":
+	import mpsse
+	import calling
+	import simulator
+
+	table = targets(mpsse.dispatch_target)
+	source = [generate("ShiftDispatch", table)]
+	symbols = dict(mpsse.auto_shifter.symbols())
+	symbols.update(mpsse.bits_shifter.symbols())
+	for name, params in sorted(set(t for t in table if t)):
+		flags = decode(table.index((name, params)))
+		if flags[3]:
+			source.append(calling.generate_bits(name, flags[1], flags[2],
+				mpsse.bits_shifter.generate(flags[0], flags[1], flags[2], name)))
+		else:
+			source.append(calling.generate_bytes(name, flags[1], flags[2],
+				mpsse.auto_shifter.generate(flags[0], flags[1], flags[2], name)))
+		# Overlaid with the parameters of the dispatcher, like sdcc can
+		for i in range(1, len(params)):
+			symbols[_parm(name, i)] = simulator.PARM_BASE + 2 * (i - 1)
+	program = simulator.Program.from_c("\n".join(source))
+
+	print("%-6s %-40s %7s %9s  %s" % ("opcode", "function", "latency", "simulated", "check"))
+	for opcode in list(range(MASK + 1)) + [0x40, 0x9c, 0xff]:
+		flags = decode(opcode)
+		target = table[opcode] if not opcode & ~MASK else None
+		bits = target and flags[3]
+		args = {"src": 0xF000, "dst": 0xE7C0, "length": 6 if bits else 0x102}
+		sim = simulator.Simulator(program, symbols=symbols)
+		sim.xdata[args["src"]] = 0xA5
+		clk = simulator.pin_key(mpsse.clock.pin)
+		sim.sfr[simulator.OES[clk[0]] - 0x80] |= 1 << clk[1]
+		sim.sfr[simulator.PORTS[clk[0]] - 0x80] |= 1 << clk[1]
+		if bits:
+			msb = flags[0] == sw.ShiftOp.FirstBit.MSB
+			sim.drive(mpsse.data_in.pin, simulator.serial_source(clk,
+				simulator.byte_bits(0x3C, msb), int(flags[1] == sw.ShiftOp.ClockMode.positive)))
+		simulator.c_arguments(sim, "ShiftDispatch", [opcode] + [args[p] for p in PARAMETERS[1:]])
+		sim.pc = sim.target("_ShiftDispatch")
+		sim.depth = 0
+		entry = sim.target("_" + target[0]) if target else None
+		while sim.pc != entry and sim.step():
+			pass
+		entered = sim.cycle
+
+		check = []
+		if target:
+			if bits:
+				# The byte at src and the bit count less one
+				passed = [sim.dptr & 0xff] + [sim.iram[symbols[_parm(target[0], i)]]
+					for i in range(1, len(target[1]))]
+				expected = [sim.xdata[args["src"]] if p == "data" else args[p] for p in target[1]]
+			else:
+				passed = [sim.dptr]
+				for i in range(1, len(target[1])):
+					addr = symbols[_parm(target[0], i)]
+					passed.append(sim.iram[addr] | sim.iram[addr + 1] << 8)
+				expected = [args[p] for p in target[1]]
+			if passed != expected:
+				check.append("arguments BAD %r" % passed)
+			while sim.step():
+				pass
+			if bits and flags[1] != sw.ShiftOp.ClockMode.none:
+				count = args["length"] + 1
+				got = simulator.byte_bits(sim.xdata[args["dst"]], msb)[-count:]
+				if got != simulator.byte_bits(0x3C, msb)[:count]:
+					check.append("*dst BAD %#04x" % sim.xdata[args["dst"]])
+		status = DISPATCH_OK if target else DISPATCH_BAD
+		if sim.dptr & 0xff != status:
+			check.append("status BAD %#04x" % (sim.dptr & 0xff))
+		print("0x%02x   %-40s %7i %9i  %s" % (
+			opcode, target[0] if target else "-", latency(table, opcode), entered,
+			", ".join(check) or ("ok" if target else "rejected ok")))
@@ -1,75 +1,758 @@
 """
 Efficient i2c operation in bitbanging software.
+
+I2CMaster generates the parts of an i2c transaction (start, repeated start,
+stop, writing a byte and checking the ACK, reading a byte and sending an
+ACK / NACK) for SCL and SDA emulating open drain pins, see
+software.OpenDrainInASM. Every half of the clock is padded to exactly the
+cycles the rate needs (see timing()) and never shorter than the minimum the
+i2c spec gives for the mode.
+
+After SCL is released the master waits for it to really go high, so a
+target can stretch the clock. When the wait fits in the bit period it is
+done on every bit, otherwise (1MHz at 48MHz, 400kHz at 24MHz) only on the
+first bit of a byte and the ACK bit, where targets stretch the clock in
+practice.
+
+I2CController does the same through the FX2's own i2c controller, which
+shifts the bytes by itself. backend() picks it when the board has the bus on
+the controller's dedicated SCL / SDA pins. Both have batched WriteBytes()
+and ReadBytes() for whole buffers, the controller also a queue which the
+main loop moves on with Poll() between other work.
 """
 
+import math
+
 import pins
+import cycles
+import ir
 import software as sw
 import calling
+from software import asm
+
+# i2c, you write on negative edge, read on the positive edge
+# sda ▔▔▔▔\___XXXX--b0--XXXX--b1-- ...
+# clk ▔▔▔▔▔▔▔\____/▔▔▔▔\____/▔▔▔▔\ ...
+read_on = sw.ShiftOp.ClockMode.positive
+write_on = sw.ShiftOp.ClockMode.negative
+
+
+class I2CMaster(object):
+	"""
+	i2c master on two OpenDrainInASM pins sharing the OE proxy.
+
+	SCL is only changed directly in the OE register. SDA is changed through
+	the proxy while SCL is low (the proxy has SCL pulled low then), so
+	shifting a bit out is a MOV to the proxy and a MOV of the proxy to the
+	OE register. The MOV to the proxy for the next bit is done while SCL is
+	high, leaving the low half as short as the high one.
+	"""
+
+	# Minimum times in us from the i2c spec for each mode (by its fastest
+	# rate), SCL low / high, hold after a (repeated) start, set up of a
+	# repeated start, set up of a stop and the bus free between a stop and
+	# a start.
+	MODES = {
+		100000: {'low': 4.7, 'high': 4.0, 'hd_sta': 4.0, 'su_sta': 4.7, 'su_sto': 4.0, 'buf': 4.7},
+		400000: {'low': 1.3, 'high': 0.6, 'hd_sta': 0.6, 'su_sta': 0.6, 'su_sto': 0.6, 'buf': 1.3},
+		1000000: {'low': 0.5, 'high': 0.26, 'hd_sta': 0.26, 'su_sta': 0.26, 'su_sto': 0.26, 'buf': 0.5},
+	}
+
+	def __init__(self, scl, sda, rate=100000, speed=cycles.CPUSpeed.MHz48):
+		"""
+		I2CMaster(clock, data, 400000)
+
+		Raises ValueError when a data bit can't be shifted at rate.
+		"""
+		assert isinstance(scl, sw.OpenDrainInASM), scl
+		assert isinstance(sda, sw.OpenDrainInASM), sda
+		assert sda.flushed_by(scl), "SCL and SDA have to share the OE proxy"
+		self.scl = scl
+		self.sda = sda
+		self.rate = rate
+		self.speed = speed
+
+		modes = [r for r in sorted(self.MODES) if r >= rate]
+		if not modes:
+			raise ValueError("%i Hz is faster than any i2c mode" % rate)
+		self.times = dict((k, self.cycles(us)) for k, us in self.MODES[modes[0]].items())
+		self.period, self.actual, self.error = self.timing()
+
+		fastest = max(self.pulse_cycles(*self.write_bit()), self.pulse_cycles(*self.read_bit()))
+		if fastest > self.period:
+			raise ValueError("%i Hz i2c is %i cycles a bit at %s, a bit takes %i" % (
+				rate, self.period, speed, fastest))
+		waits = max(self.pulse_cycles(*self.write_bit(), stretch=True),
+			self.pulse_cycles(*self.read_bit(), stretch=True))
+		self.stretch_bits = waits <= self.period
+
+	def cycles(self, us):
+		"""Cycles for at least us microseconds."""
+		return int(math.ceil(round(us * self.speed.cycles_per_second / 1e6, 6)))
+
+	def timing(self):
+		"""
+		(period in cycles, rate, error) of the clock, the nearest to the rate
+		asked for which isn't faster.
+		"""
+		per_second = self.speed.cycles_per_second
+		period = int(math.ceil(round(per_second / float(self.rate), 6)))
+		actual = per_second / float(period)
+		return period, actual, (actual - self.rate) / self.rate
+
+	# Building blocks ---------------------------------------------------
+	def used_pins(self):
+		return [self.scl, self.sda]
+
+	def symbols(self):
+		symbols = {}
+		for p in self.used_pins():
+			symbols.update(p.symbols())
+		return symbols
+
+	def prologue(self):
+		"""
+		The set up code of both pins, each line once. SDA is only written
+		through the proxy with SCL low, so the proxy always pulls SCL low.
+		"""
+		lines = []
+		for p in self.used_pins():
+			for l in p.prologue():
+				if l not in lines:
+					lines.append(l)
+		return lines + [asm("setb", "_%s" % self.scl.proxy_bit_name)]
+
+	def release(self):
+		return self.scl.set()
+
+	def pull_low(self):
+		return self.scl.clear()
+
+	def wait(self):
+		"""Wait for SCL to go high, the target can hold it low."""
+		return [asm("jnb", "_%s" % self.scl.bit_name, ".", comment="clock stretched")]
+
+	def sda_proxy(self, low):
+		return [asm("setb" if low else "clr", "_%s" % self.sda.proxy_bit_name)]
+
+	@staticmethod
+	def phase(lines, length, edge):
+		"""lines then edge, padded so edge ends at least length cycles from the start."""
+		return lines + sw.delay(max(0, length - sw.cycle_count(lines + edge))) + edge
+
+	def halves(self, low, high, stretch, after):
+		"""
+		(low, high) cycles of a clock running low then high, after a clock
+		high for after cycles. Each half is at least its minimum time, the
+		clock and the time between rising edges at least the period, and the
+		halves as even as that allows.
+		"""
+		if stretch:
+			high = self.wait() + high
+		low_min = max(sw.cycle_count(low + self.release()), self.times['low'], self.period - after)
+		high_min = max(sw.cycle_count(high + self.pull_low()), self.times['high'])
+		low_cycles = max(low_min, self.period - max(high_min, self.period // 2))
+		return low_cycles, max(high_min, self.period - low_cycles)
+
+	def pulse_cycles(self, low, high, stretch=False):
+		"""Cycles of a clock in a run of the same clocks."""
+		return sum(self.halves(low, high, stretch, self.period))
+
+	def clocks(self, pulses):
+		"""
+		SCL clocks from SCL low, one for each (low, high, stretch). low runs
+		before SCL is released and high (after the wait if stretch) before
+		it is pulled low again.
+		"""
+		lines = []
+		after = self.period
+		for low, high, stretch in pulses:
+			low_cycles, after = self.halves(low, high, stretch, after)
+			if stretch:
+				high = self.wait() + high
+			lines += (self.phase(low, low_cycles, self.release())
+				+ self.phase(high, after, self.pull_low()))
+		return lines
+
+	def write_bit(self):
+		"""
+		(low, high) of shifting out a bit of A, which is inverted. The low
+		half writes out the bit the high half before it (or next_bit() before
+		the first clock) put in the proxy, the high half puts in the next.
+		"""
+		return self.sda.flush(), self.next_bit()
+
+	def next_bit(self):
+		"""Move the top bit of A into the SDA proxy."""
+		return [asm("rlc", "a")] + self.sda.carry_to_proxy()
+
+	def read_bit(self):
+		"""(low, high) of shifting SDA into the bottom of A."""
+		return [], self.sda.bit_to_carry() + [asm("rlc", "a")]
+
+	# Transaction parts -------------------------------------------------
+	def start(self):
+		"""Start from an idle bus, leaves SCL low."""
+		return self.sda.clear() + self.phase([], self.times['hd_sta'], self.pull_low())
+
+	def restart(self):
+		"""Repeated start from SCL low, leaves SCL low."""
+		low = self.sda_proxy(False) + self.sda.flush()
+		return (self.phase(low, self.times['low'], self.release())
+			+ self.phase(self.wait(), self.times['su_sta'], self.sda.clear())
+			+ self.phase([], self.times['hd_sta'], self.pull_low()))
+
+	def stop(self):
+		"""Stop from SCL low, then wait for the bus to be free."""
+		low = self.sda_proxy(True) + self.sda.flush()
+		return (self.phase(low, self.times['low'], self.release())
+			+ self.phase(self.wait(), self.times['su_sto'], self.sda.set())
+			+ sw.delay(self.times['buf']))
+
+	def write(self):
+		"""
+		Write the byte in A from SCL low, leaves SCL low and A 1 if the
+		target NACKed it, 0 if it ACKed.
+		"""
+		low, high = self.write_bit()
+		first = [asm("cpl", "a", comment="a 1 releases SDA")] + self.next_bit()
+		# The last bit's high half releases SDA for the ACK
+		pulses = [([], high)] * 7 + [([], self.sda_proxy(False))]
+		pulses[0] = (first, high)
+		lines = self.clocks([(f + low, h, self.stretch_bits or i == 0) for i, (f, h) in enumerate(pulses)]
+			+ [(low, self.sda.bit_to_carry(), True)])
+		return lines + [asm("clr", "a"), asm("rlc", "a", comment="NACK")]
+
+	def read(self):
+		"""
+		Read a byte into A from SCL low, ACKing it if A isn't 0. Leaves SCL
+		low.
+		"""
+		low, high = self.read_bit()
+		lines = [asm("add", "a", "#0xff", comment="ACK?")] + self.sda.carry_to_proxy()
+		lines += self.clocks([(low, high, self.stretch_bits or i == 0) for i in range(8)]
+			+ [(self.sda.flush(), [], True)])
+		return lines + self.sda_proxy(False) + self.sda.flush()
+
+	def write_bytes(self, name):
+		"""
+		The body of name(src, length), writing length + 1 bytes from src
+		like write(). Stops at a NACK, with F0 set.
+		"""
+		labels = sw.Labels()
+		nacked, done = labels(), labels()
+		byte = [asm("movx", "a", "@dptr", comment="*src"), asm("inc", "dptr", comment="src++")] + self.write() + [
+			asm("jnz", nacked)]
+		return (self.prologue() + [asm("clr", "_%s" % NACK_FLAG)] + counters(name)
+			+ sw.ShiftBytes.loop(byte, ["r7", "r6"], labels) + [
+				asm("sjmp", done),
+				ir.Label(nacked),
+				asm("setb", "_%s" % NACK_FLAG, comment="NACKed"),
+				ir.Label(done),
+			])
+
+	def read_bytes(self, name):
+		"""
+		The body of name(dst, length), reading length + 1 bytes into dst
+		like read(), NACKing the last one, then the stop.
+		"""
+		labels = sw.Labels()
+		byte = [
+			# A is 0 for the last byte (r6 and r7 both 1)
+			asm("mov", "a", "r6"),
+			asm("dec", "a"),
+			asm("jnz", ".+4"),
+			asm("mov", "a", "r7"),
+			asm("dec", "a", comment="ACK?"),
+		] + self.read() + [asm("movx", "@dptr", "a", comment="*dst"), asm("inc", "dptr", comment="dst++")]
+		return (self.prologue() + counters(name)
+			+ sw.ShiftBytes.loop(byte, ["r7", "r6"], labels) + self.stop())
+
+	def generate(self, prefix="i2c"):
+		"""
+		The C functions Start(), Restart(), Stop(), BYTE Write(data),
+		BYTE Read(ack), WriteBytes(src, length) and ReadBytes(dst, length).
+		"""
+		none = sw.ShiftOp.ClockMode.none
+		comment = [sw.ShiftByte.rate_comment(self.rate, self.actual, self.error, self.speed)]
+		if not self.stretch_bits:
+			comment.append(sw.asm_comment("clock stretching only on the first bit and the ACK"))
+		source = []
+		for name, on, parts in (
+				("Start", (none, none), self.start()),
+				("Restart", (none, none), self.restart()),
+				("Stop", (none, none), self.stop()),
+				("Write", (read_on, write_on), self.write()),
+				("Read", (read_on, write_on), self.read())):
+			source.append(calling.generate(name=prefix + name, read_on=on[0], write_on=on[1],
+				body=comment + self.prologue() + parts))
+		source.append(calling.generate_bytes(prefix + "WriteBytes", none, write_on,
+			comment + self.write_bytes(prefix + "WriteBytes")))
+		source.append(calling.generate_bytes(prefix + "ReadBytes", read_on, none,
+			comment + self.read_bytes(prefix + "ReadBytes")))
+		return source
+
+
+class I2CController(object):
+	"""
+	i2c through the FX2's i2c controller on the dedicated SCL / SDA pins,
+	polling I2CS. The controller shifts each byte and its ACK by itself
+	(90us at 100kHz), the CPU only waits for DONE in between. The functions
+	like I2CMaster's spin on I2CS all that time, so the CPU is no freer than
+	bit banging, only the timing is the controller's.
+
+	QueueWrite(src, length) / QueueRead(dst, length) don't wait, they start
+	the first byte and leave the buffer in the queue (QUEUE in data memory).
+	Poll(), called from the main loop between other work, looks at I2CS once
+	and on DONE moves the queue on a byte, returning POLL_BUSY until the
+	buffer is done. A poll takes at most poll_cycles() (97 cycles, 8us at
+	48MHz), which is all the other work (another channel, like the JTAG
+	shifting) is held up by; a byte only starts as late as the poll after
+	its DONE.
+
+	Every wait gives up on a bus error (BERR) or after timeout times 256
+	spins round it (about 0.28ms each at 48MHz), setting ERROR_FLAG. The
+	byte loops stop there, the caller clears it.
+
+	It has the same functions as I2CMaster apart from Read(ack), as reading
+	I2DAT starts the next byte a read has to know where it ends, use
+	ReadBytes(). The registers are reached with movx @r1 and MPAGE, leaving
+	dptr to the buffers.
+	"""
+
+	I2CS = 0xE678
+	I2DAT = 0xE679
+	I2CTL = 0xE67A
+
+	# I2CS bits
+	START = 0x80
+	STOP = 0x40
+	LASTRD = 0x20
+	BERR = 0x04
+	ACK = 0x02
+	DONE = 0x01
+
+	# Set when the controller reports a bus error or a wait times out (F1)
+	ERROR_FLAG = "psw.1"
+	# Count the spins round a wait
+	COUNTERS = ("r5", "r4")
 
-# Create the shift byte commands
-clock = sw.BitAccessInASM("i2c_clk", pins.Pin("A", 5), pins.PinDirection.output)
-data = sw.BitAccessInASM("i2c_dat", pins.Pin("A", 3), pins.PinDirection.bidirectional)
+	# I2CTL for each rate the controller runs at
+	RATES = {100000: 0x00, 400000: 0x01}
 
-byte_shifter = sw.ShiftByte(clock, data, data)
+	# The queue, in data memory below the OE proxies: the buffer pointer,
+	# the bytes left after the one being shifted and the QUEUE_* state
+	QUEUE = sw.OpenDrainInASM.PROXY_TOP - 9
+	POINTER, LEFT, STATE = 0, 2, 4
+	QUEUE_IDLE, QUEUE_WRITE, QUEUE_READ = 0, 1, 2
 
-print("""\
-/* Generated file from mpsse.py */
+	# What Poll() returns
+	POLL_IDLE = 0x00
+	POLL_BUSY = 0x01
+	POLL_NACK = 0x02
+	POLL_ERROR = 0x04
+
+	def __init__(self, rate=100000, timeout=16):
+		"""
+		I2CController(400000)
+
+		The rate is the fastest the controller can do which isn't faster
+		than rate. A wait gives up after timeout (1 to 256) times 256 spins.
+		"""
+		rates = [r for r in sorted(self.RATES) if r <= rate]
+		if not rates:
+			raise ValueError("The i2c controller doesn't run as slow as %i Hz" % rate)
+		assert 1 <= timeout <= 256, timeout
+		self.rate = rates[-1]
+		self.timeout = timeout
+
+	def symbols(self):
+		return {"_i2c_queue": self.QUEUE}
+
+	@classmethod
+	def defines(cls):
+		return """\
+#ifndef I2C_QUEUE
+#define I2C_QUEUE %#04x
+__data __at (I2C_QUEUE) volatile BYTE i2c_queue[5];
+#endif
+""" % cls.QUEUE
+
+	def prologue(self):
+		return [
+			asm("push", "_MPAGE"),
+			asm("mov", "_MPAGE", "#0x%02x" % (self.I2CS >> 8)),
+			asm("mov", "r1", "#0x%02x" % (self.I2CS & 0xff), comment="I2CS"),
+		]
+
+	def epilogue(self):
+		return [asm("pop", "_MPAGE")]
+
+	@staticmethod
+	def bit(mask):
+		return "acc.%i" % (mask.bit_length() - 1)
+
+	def wait(self, mask, level):
+		"""
+		Wait for an I2CS bit to be level, setting ERROR_FLAG on a bus error
+		or a timeout.
+		"""
+		low, high = self.COUNTERS
+		return [
+			asm("mov", low, "#0"),
+			asm("mov", high, "#%i" % (self.timeout & 0xff)),
+			asm("movx", "a", "@r1", comment="I2CS"),
+			asm("jb", self.bit(self.BERR), ".+10", comment="bus error"),
+			asm("jb" if level else "jnb", self.bit(mask), ".+9"),
+			asm("djnz", low, ".-7"),
+			asm("djnz", high, ".-9"),
+			asm("setb", self.ERROR_FLAG, comment="bus error or timed out"),
+		]
+
+	def failed(self, label):
+		"""Jump to label if a wait has given up."""
+		return [asm("jb", self.ERROR_FLAG, label)]
+
+	def request(self, mask):
+		return [
+			asm("movx", "a", "@r1", comment="I2CS"),
+			asm("orl", "a", "#0x%02x" % mask),
+			asm("movx", "@r1", "a"),
+		]
+
+	def data(self, write):
+		"""Move A to / from I2DAT."""
+		return [
+			asm("inc", "r1", comment="I2DAT"),
+			asm("movx", "@r1", "a") if write else asm("movx", "a", "@r1"),
+			asm("dec", "r1", comment="I2CS"),
+		]
+
+	def start(self):
+		"""Start (with the next write) once the last stop is done."""
+		return [
+			asm("inc", "r1"),
+			asm("inc", "r1", comment="I2CTL"),
+			asm("mov", "a", "#0x%02x" % self.RATES[self.rate]),
+			asm("movx", "@r1", "a"),
+			asm("dec", "r1"),
+			asm("dec", "r1", comment="I2CS"),
+		] + self.wait(self.STOP, 0) + self.request(self.START)
+
+	def restart(self):
+		return self.request(self.START)
+
+	def stop(self):
+		return self.request(self.STOP) + self.wait(self.STOP, 0)
+
+	def write(self):
+		"""Write the byte in A, leaving A 1 if the target NACKed it, 0 if it ACKed."""
+		return self.data(True) + self.wait(self.DONE, 1) + [
+			asm("mov", "c", self.bit(self.ACK)),
+			asm("cpl", "c"),
+			asm("clr", "a"),
+			asm("rlc", "a", comment="NACK"),
+		]
+
+	def write_bytes(self, name):
+		"""As I2CMaster.write_bytes(), stopping at a wait giving up too."""
+		labels = sw.Labels()
+		nacked, done = labels(), labels()
+		byte = [asm("movx", "a", "@dptr", comment="*src"), asm("inc", "dptr", comment="src++")] + self.data(True) + self.wait(
+			self.DONE, 1) + self.failed(done) + [asm("jnb", self.bit(self.ACK), nacked)]
+		return ([asm("clr", "_%s" % NACK_FLAG)] + counters(name)
+			+ sw.ShiftBytes.loop(byte, ["r7", "r6"], labels) + [
+				asm("sjmp", done),
+				ir.Label(nacked),
+				asm("setb", "_%s" % NACK_FLAG, comment="NACKed"),
+				ir.Label(done),
+			])
+
+	def read_bytes(self, name):
+		"""
+		As I2CMaster.read_bytes(). Reading I2DAT hands over a byte and starts
+		the next, so LASTRD (NACK) goes in before the last byte is started
+		and STOP before the last is handed over. A wait giving up returns
+		straight away, without the STOP.
+		"""
+		labels = sw.Labels()
+		first, top, more, last = labels(), labels(), labels(), labels()
+		skip, failed = labels(), labels()
+		length = "_%s_PARM_2" % name
+		return [
+			asm("mov", "r7", length, comment="bytes after this one (low)"),
+			asm("mov", "r6", "(%s+1)" % length, comment="(high)"),
+			asm("mov", "a", "r7"),
+			asm("orl", "a", "r6"),
+			asm("jnz", first),
+		] + self.request(self.LASTRD) + [ir.Label(first)] + self.data(False) + [
+			ir.Label(top),
+		] + self.wait(self.DONE, 1) + self.failed(failed) + [
+			asm("mov", "a", "r7"),
+			asm("orl", "a", "r6"),
+			asm("jz", last),
+			asm("dec", "r7"),
+			asm("cjne", "r7", "#0xff", skip),
+			asm("dec", "r6"),
+			ir.Label(skip),
+			asm("mov", "a", "r7"),
+			asm("orl", "a", "r6"),
+			asm("jnz", more),
+		] + self.request(self.LASTRD) + [ir.Label(more)] + self.data(False) + [
+			asm("movx", "@dptr", "a", comment="*dst"),
+			asm("inc", "dptr", comment="dst++"),
+			asm("sjmp", top),
+			ir.Label(last),
+		] + self.request(self.STOP) + self.data(False) + [
+			asm("movx", "@dptr", "a", comment="*dst"),
+		] + self.wait(self.STOP, 0) + [ir.Label(failed)]
+
+	@staticmethod
+	def queued(offset):
+		"""A byte of the queue."""
+		return "(_i2c_queue+%i)" % offset if offset else "_i2c_queue"
+
+	def queue(self, name, write):
+		"""
+		The body of name(buffer, length), queueing length + 1 bytes to write
+		from buffer or read into it after a Start() and the address. It
+		starts the first byte and returns, Poll() does the rest.
+		"""
+		labels = sw.Labels()
+		length = "_%s_PARM_2" % name
+		lines = [
+			asm("mov", self.queued(self.LEFT), length, comment="bytes after this one (low)"),
+			asm("mov", self.queued(self.LEFT + 1), "(%s+1)" % length, comment="(high)"),
+		]
+		if write:
+			lines += [asm("movx", "a", "@dptr", comment="*src"), asm("inc", "dptr", comment="src++")]
+		lines += [
+			asm("mov", self.queued(self.POINTER), "dpl"),
+			asm("mov", self.queued(self.POINTER + 1), "dph"),
+			asm("mov", self.queued(self.STATE), "#%i" % (self.QUEUE_WRITE if write else self.QUEUE_READ)),
+		]
+		if write:
+			return lines + self.data(True)
+		first = labels()
+		return lines + [
+			asm("mov", "a", length),
+			asm("orl", "a", "(%s+1)" % length),
+			asm("jnz", first),
+		] + self.request(self.LASTRD) + [ir.Label(first)] + self.data(False)
+
+	def _left(self):
+		"""A 0 if the byte being shifted is the last."""
+		return [asm("mov", "a", self.queued(self.LEFT)), asm("orl", "a", self.queued(self.LEFT + 1))]
+
+	def _count(self, labels):
+		"""Count a byte off the queue."""
+		low, high = self.queued(self.LEFT), self.queued(self.LEFT + 1)
+		skip = labels()
+		return [
+			asm("mov", "a", low),
+			asm("dec", low),
+			asm("jnz", skip, comment="no borrow"),
+			asm("dec", high),
+			ir.Label(skip),
+		]
+
+	def _pointer(self, save):
+		"""Load dptr from the queue, or with save put it back."""
+		pairs = [(self.queued(self.POINTER), "dpl"), (self.queued(self.POINTER + 1), "dph")]
+		return [asm("mov", *(p if save else p[::-1])) for p in pairs]
+
+	def _finish(self, status, end):
+		"""Empty the queue and return status."""
+		return [
+			asm("mov", self.queued(self.STATE), "#%i" % self.QUEUE_IDLE),
+			asm("mov", "a", "#%i" % status),
+			asm("sjmp", end),
+		]
+
+	def poll(self):
+		"""
+		The body of Poll(), looking at I2CS once and, if the byte being
+		shifted is done, starting the next byte of the queue. Returns
+		POLL_BUSY while there's more to come, POLL_IDLE when the queue is
+		empty (after a read with the STOP sent, after a write without, like
+		WriteBytes()), POLL_NACK when a written byte wasn't ACKed and
+		POLL_ERROR on a bus error, emptying the queue for either.
+		"""
+		labels = sw.Labels()
+		out, error, done, writing, more, last, finished, nacked, end = [labels() for i in range(9)]
+		busy = [asm("mov", "a", "#%i" % self.POLL_BUSY), asm("sjmp", end)]
+		return [
+			asm("mov", "a", self.queued(self.STATE)),
+			asm("jz", out, comment="nothing queued"),
+			asm("movx", "a", "@r1", comment="I2CS"),
+			asm("jb", self.bit(self.BERR), error),
+			asm("jb", self.bit(self.DONE), done),
+			asm("mov", "a", "#%i" % self.POLL_BUSY),
+			ir.Label(out),
+			asm("ljmp", end),
+			ir.Label(error),
+			asm("mov", self.queued(self.STATE), "#%i" % self.QUEUE_IDLE),
+			asm("mov", "a", "#%i" % self.POLL_ERROR),
+			asm("ljmp", end),
+			ir.Label(done),
+			asm("mov", "r2", "a"),
+			asm("mov", "a", self.queued(self.STATE)),
+			asm("cjne", "a", "#%i" % self.QUEUE_READ, writing),
+			# Reading I2DAT hands over a byte and starts the next
+		] + self._left() + [
+			asm("jz", last),
+		] + self._count(labels) + self._left() + [
+			asm("jnz", more),
+		] + self.request(self.LASTRD) + [ir.Label(more)] + self.data(False) + self._pointer(False) + [
+			asm("movx", "@dptr", "a", comment="*dst"),
+			asm("inc", "dptr", comment="dst++"),
+		] + self._pointer(True) + busy + [
+			ir.Label(last),
+		] + self.request(self.STOP) + self.data(False) + self._pointer(False) + [
+			asm("movx", "@dptr", "a", comment="*dst"),
+		] + self._finish(self.POLL_IDLE, end) + [
+			ir.Label(writing),
+			asm("mov", "a", "r2"),
+			asm("jnb", self.bit(self.ACK), nacked),
+		] + self._left() + [
+			asm("jz", finished),
+		] + self._count(labels) + self._pointer(False) + [
+			asm("movx", "a", "@dptr", comment="*src"),
+			asm("inc", "dptr", comment="src++"),
+		] + self._pointer(True) + self.data(True) + busy + [
+			ir.Label(finished),
+		] + self._finish(self.POLL_IDLE, end) + [
+			ir.Label(nacked),
+			asm("mov", self.queued(self.STATE), "#%i" % self.QUEUE_IDLE),
+			asm("mov", "a", "#%i" % self.POLL_NACK),
+			ir.Label(end),
+		]
+
+	def poll_cycles(self):
+		"""The most cycles a call to Poll() takes, the lcall included."""
+		name = "i2cPoll"
+		body = self.prologue() + self.poll() + self.epilogue()
+		source = calling.generate(name=name, read_on=read_on, write_on=sw.ShiftOp.ClockMode.none, body=body)
+		glue = calling.function_cost(source)[0] - sw.cycle_count(body)
+		return asm("lcall", "_%s" % name).cycles + glue + longest(body)
+
+	def generate(self, prefix="i2c"):
+		"""As I2CMaster.generate(), without Read(ack), and the queue."""
+		none = sw.ShiftOp.ClockMode.none
+		comment = [sw.asm_comment("i2c controller at %i bit/s" % self.rate)]
+		source = []
+		for name, on, parts in (
+				("Start", (none, none), self.start()),
+				("Restart", (none, none), self.restart()),
+				("Stop", (none, none), self.stop()),
+				("Write", (read_on, write_on), self.write())):
+			source.append(calling.generate(name=prefix + name, read_on=on[0], write_on=on[1],
+				body=comment + self.prologue() + parts + self.epilogue()))
+		source.append(calling.generate_bytes(prefix + "WriteBytes", none, write_on,
+			comment + self.prologue() + self.write_bytes(prefix + "WriteBytes") + self.epilogue()))
+		source.append(calling.generate_bytes(prefix + "ReadBytes", read_on, none,
+			comment + self.prologue() + self.read_bytes(prefix + "ReadBytes") + self.epilogue()))
+		for name, on, write in (("QueueWrite", (none, write_on), True), ("QueueRead", (read_on, none), False)):
+			source.append(calling.generate_bytes(prefix + name, on[0], on[1],
+				comment + self.prologue() + self.queue(prefix + name, write) + self.epilogue()))
+		source.append(calling.generate(name=prefix + "Poll", read_on=read_on, write_on=none,
+			body=comment + self.prologue() + self.poll() + self.epilogue()))
+		return source
+
+
+def longest(lines):
+	"""
+	Cycles of the longest way through lines, code without loops that only
+	jumps forward to its own labels.
+	"""
+	at = dict((l.name, i) for i, l in enumerate(lines) if l.label)
+	cycles = [0] * (len(lines) + 1)
+	for i in reversed(range(len(lines))):
+		l = lines[i]
+		target = at.get(l.operands[-1]) if l.operands else None
+		assert target is None or target > i, "%r jumps back" % l
+		if l.mnemonic in ("sjmp", "ljmp", "ajmp"):
+			cycles[i] = l.cycles + cycles[target]
+		elif target is not None:
+			cycles[i] = l.cycles + max(cycles[i + 1], cycles[target])
+		else:
+			cycles[i] = l.cycles + cycles[i + 1]
+	return cycles[0]
+
+
+# Set by WriteBytes() when a byte is NACKed, the caller clears it
+NACK_FLAG = "F0"
+
+
+def counters(name):
+	"""Load r7 / r6 for a DJNZ loop over the length + 1 bytes of name()."""
+	length = "_%s_PARM_2" % name
+	return [
+		asm("mov", "r7", length, comment="length (low)"),
+		asm("mov", "r6", "(%s+1)" % length, comment="length (high)"),
+		asm("inc", "r7"),
+		asm("inc", "r6"),
+	]
+
+
+def backend(scl, sda, rate=100000, speed=cycles.CPUSpeed.MHz48):
+	"""
+	The i2c controller when scl and sda are its dedicated pins
+	(pins.I2C_SCL / pins.I2C_SDA), otherwise I2CMaster bit banging them.
+
+	Either way the CPU is busy for the whole transfer, apart from the
+	controller's queue: its other functions poll I2CS while it shifts each
+	byte (about 90us at 100kHz, 23us at 400kHz), they just don't have to
+	time the bits.
+	"""
+	if scl is pins.I2C_SCL and sda is pins.I2C_SDA:
+		return I2CController(rate)
+	if pins.I2C_SCL in (scl, sda) or pins.I2C_SDA in (scl, sda):
+		raise ValueError("The i2c controller's SCL and SDA can only be used together")
+	return I2CMaster(sw.OpenDrainInASM("i2c_clk", scl), sw.OpenDrainInASM("i2c_dat", sda), rate, speed)
+
+
+clock = sw.OpenDrainInASM("i2c_clk", pins.Pin("A", 5))
+data = sw.OpenDrainInASM("i2c_dat", pins.Pin("A", 3))
+
+# Fm+, the fastest i2c a 48MHz FX2 can do
+master = I2CMaster(clock, data, 1000000)
+
+# i2cTest(data), write a byte in a transaction of its own, returns the NACK
+body = master.prologue() + master.start() + master.write() + master.stop()
+
+
+def main():
+	print("""\
+/* Generated file from i2c.py */
 
 #include "fx2regs.h"
 #include "fx2types.h"
 
 """)
-print(clock.defines())
-print(data.defines())
-print("""
+	print(clock.defines())
+	print(data.defines())
+	print(I2CController.defines())
 
-""")
+	for rate, prefix in ((100000, "i2c100k_"), (400000, "i2c400k_"), (1000000, "i2c1M_")):
+		print("\n".join(I2CMaster(clock, data, rate).generate(prefix)))
+	for rate, prefix in ((100000, "i2cHw100k_"), (400000, "i2cHw400k_")):
+		print("\n".join(backend(pins.I2C_SCL, pins.I2C_SDA, rate).generate(prefix)))
 
-# i2c, you write on negative edge, read on the positive edge
-# sda ▔▔▔▔\___XXXX--b0--XXXX--b1-- ...
-# clk ▔▔▔▔▔▔▔\____/▔▔▔▔\____/▔▔▔▔\ ... 
-#read_on=sw.ShiftOp.ClockMode.positive,
-read_on = sw.ShiftOp.ClockMode.none
-write_on = sw.ShiftOp.ClockMode.negative
+	print(calling.generate(
+		name="i2cTest",
+		read_on=read_on,
+		write_on=write_on,
+		body=body))
 
-body = []
-
-body += ["/* Start bit */"]
-body += data.setup(pins.PinDirection.output).splitlines()
-body += data.clear().splitlines()
-
-body += ["/* Byte shift */"]
-body += byte_shifter.generate(
-	direction=sw.ShiftOp.FirstBit.MSB,
-	read_on=read_on,
-	write_on=write_on,
-	pad=True)
-
-body += ["/* Ack / Stop Bit */"]
-body += clock.clear().splitlines()
-body += data.setup(pins.PinDirection.input).splitlines()
-body += clock.set().splitlines()
-# If carry is 1, then the bit was nacked
-body += data.bit_to_carry().splitlines()
-body += ["/* JC nacked */"]
-# Loop here while bit is 0, clock stretching
-body += data.bit_to_carry().splitlines()
-body += ["/* JNC rel - */"]
-# Success!
-body += ["/* Success */"]
-# Failure
-body += ["/* Nacked response... */"]
-
-print(calling.generate(
-	name="i2cTest",
-	read_on=read_on,
-	write_on=write_on,
-	body=body))
-
-print("""\
+	print("""\
 BYTE main() {
 	BYTE data = 0xaa;
 	i2cTest(data);
 	return 1;
 }
 """)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,188 @@
+"""
+Instructions of the generated code, kept as objects until they're written out.
+
+The generators pass code around as lists of Items. A Line is one
+instruction, made from its mnemonic and operands: it holds the
+cycles.Instruction they make and what it reads and writes, so nothing has
+to parse text to find them. Labels, assembler comments (Comment) and C
+comments between the statements (Note, Edge) go in the same lists.
+
+Rendering happens at the end, render_c() for the C files and render_asm()
+for a plain assembler listing.
+"""
+
+import cycles
+
+
+class Item(object):
+	"""Anything in a list of code. It doesn't run unless it's a Line."""
+
+	label = False
+	mnemonic = None
+	instruction = None
+	operands = ()
+	comment = None
+
+	@property
+	def parsed(self):
+		"""(Instruction, operands), None if it isn't an instruction."""
+		if self.instruction is None:
+			return None
+		return self.instruction, self.operands
+
+	@property
+	def cycles(self):
+		return self.instruction.cycles if self.instruction else 0
+
+	@property
+	def size(self):
+		return self.instruction.size if self.instruction else 0
+
+	def effects(self, symbols=None):
+		"""(reads, writes), see scheduler.resources()."""
+		return frozenset(), frozenset()
+
+	def _key(self):
+		return (self.__class__, self.operands, self.comment)
+
+	def __eq__(self, other):
+		return isinstance(other, Item) and self._key() == other._key()
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash(self._key())
+
+	def __repr__(self):
+		return "%s(%r)" % (self.__class__.__name__, render_asm([self]).strip())
+
+
+class Line(Item):
+	"""
+	Line("mov", ("a", "dpl"), "arg0->a") is the instruction going into C as
+	__asm__ ("mov	a,dpl");	/* arg0->a */
+	"""
+
+	def __init__(self, mnemonic, operands=(), comment=None):
+		self.mnemonic = mnemonic.lower()
+		self.operands = tuple(operands)
+		self.comment = comment
+		self.instruction = cycles.lookup(self.mnemonic, self.operands)
+		self._effects = {}
+
+	def effects(self, symbols=None):
+		"""
+		(reads, writes), see scheduler.resources(). symbols resolves the
+		names of the proxy bytes and bits.
+		"""
+		key = tuple(sorted((symbols or {}).items()))
+		if key not in self._effects:
+			import scheduler
+			reads, writes = scheduler.resources(self.instruction, self.operands, symbols)
+			self._effects[key] = frozenset(reads), frozenset(writes)
+		return self._effects[key]
+
+	@property
+	def reads(self):
+		return self.effects()[0]
+
+	@property
+	def writes(self):
+		return self.effects()[1]
+
+	def _key(self):
+		return (self.__class__, self.mnemonic, self.operands, self.comment)
+
+
+class Label(Item):
+	"""A local (nnnnn$) or global label, which code can jump to."""
+
+	label = True
+
+	def __init__(self, name):
+		self.name = name
+
+	def effects(self, symbols=None):
+		import scheduler
+		return frozenset([scheduler.BARRIER]), frozenset([scheduler.BARRIER])
+
+	def _key(self):
+		return (self.__class__, self.name)
+
+
+class Comment(Item):
+	"""A comment in the assembler, ; text."""
+
+	def __init__(self, text):
+		self.text = text
+
+	def _key(self):
+		return (self.__class__, self.text)
+
+
+class Note(Item):
+	"""A C comment between the statements, /* text */."""
+
+	def __init__(self, text):
+		self.text = text
+
+	def _key(self):
+		return (self.__class__, self.text)
+
+
+class Edge(Note):
+	"""
+	The scheduler's note of a clock edge, the lines of which come straight
+	after it, and the cycles to the next edge: /* \\_ (N cycles) */ for
+	slot 'neg', /* _/ (N cycles) */ for 'pos'.
+	"""
+
+	SYMBOLS = {'neg': '\\_', 'pos': '_/'}
+
+	def __init__(self, slot, length):
+		Note.__init__(self, "%s (%i cycles)" % (self.SYMBOLS[slot], length))
+		self.slot = slot
+		self.length = length
+
+
+def text(line):
+	"""The assembler statement of a Line, like "mov\ta,dpl"."""
+	if not line.operands:
+		return line.mnemonic
+	return "%s\t%s" % (line.mnemonic, ",".join(line.operands))
+
+
+def _c(item):
+	if isinstance(item, Note):
+		return "/* %s */" % item.text
+	if isinstance(item, Label):
+		statement = "%s:" % item.name
+	elif isinstance(item, Comment):
+		statement = "\t; %s" % item.text
+	else:
+		statement = text(item)
+	c = '__asm__ ("%s");' % statement.replace('\\', '\\\\')
+	if item.comment:
+		c += '\t/* %s */' % item.comment
+	return c
+
+
+def _asm(item):
+	if isinstance(item, Label):
+		return "%s:" % item.name
+	if isinstance(item, (Comment, Note)):
+		return "\t; %s" % item.text
+	if item.comment:
+		return "\t%s\t; %s" % (text(item), item.comment)
+	return "\t%s" % text(item)
+
+
+def render_c(lines, separator="\n"):
+	"""The lines as they go into the body of a C function."""
+	return separator.join(_c(l) for l in lines)
+
+
+def render_asm(lines):
+	"""The lines as a plain assembler listing."""
+	return "\n".join(_asm(l) for l in lines)
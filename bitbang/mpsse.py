@@ -9,17 +9,64 @@ Out on (+ve || -ve)
 
 """
 
+import sys
+import itertools
+
 import pins
+import cycles
 import software as sw
 import calling
+import dispatch
+import peephole
+import usart
 
 # Create the shift byte commands
 clock = sw.BitAccessInASM("clk", pins.Pin("A", 5), pins.PinDirection.output)
 data_in = sw.BitAccessInASM("din", pins.Pin("A", 3), pins.PinDirection.input)
 data_out = sw.BitAccessInASM("dout", pins.Pin("A", 2), pins.PinDirection.output)
+tms = sw.BitAccessInASM("tms", pins.Pin("A", 4), pins.PinDirection.output)
+gpio = sw.BitAccessInASM("gpio", pins.Pin("A", 1), pins.PinDirection.input)
+rtck = sw.BitAccessInASM("rtck", pins.Pin("A", 0), pins.PinDirection.input)
 
 byte_shifter = sw.ShiftByte(clock, data_in, data_out)
 
+# The same on port E, which isn't bit addressable, for boards with the JTAG
+# pins there.
+port_e_shifter = sw.ShiftByte(
+	sw.ByteAccessInASM("clk", pins.Pin("E", 5), pins.PinDirection.output),
+	sw.ByteAccessInASM("din", pins.Pin("E", 3), pins.PinDirection.input),
+	sw.ByteAccessInASM("dout", pins.Pin("E", 2), pins.PinDirection.output))
+# Every way the port E pins can go, through the proxy byte or straight to
+# the port (see software.RegisterAccessInASM). port_e_fastest() picks.
+port_e_wirings = sw.wirings(
+	sw.bitbangs("clk", pins.Pin("E", 5), pins.PinDirection.output),
+	sw.bitbangs("din", pins.Pin("E", 3), pins.PinDirection.input),
+	sw.bitbangs("dout", pins.Pin("E", 2), pins.PinDirection.output))
+
+# Buffers of bytes, 4 at a time round the loop
+bytes_shifter = sw.ShiftBytes(clock, data_in, data_out, unroll=4)
+# The same through the autopointers, for shifting straight out of / into the
+# endpoint buffers
+auto_shifter = sw.ShiftBytes(clock, data_in, data_out, unroll=4, autopointers=True)
+# 1 to 8 bits, for the bit mode commands
+bits_shifter = sw.ShiftBits(clock, data_in, data_out)
+# JTAG state changes, TMS with TDI held
+tms_shifter = sw.ShiftTMS(clock, data_in, data_out, tms)
+# Adaptive clocking (0x96), every edge waits for RTCK
+adaptive_shifter = sw.ShiftByteAdaptive(clock, data_in, data_out, rtck)
+# Clocks without data, waiting on GPIOL1
+clocker = sw.ClockOnly(clock, gpio)
+
+# Quad / dual SPI flash on IO0-3 = PB0-3, SCK on PB7
+qspi_clock = pins.Pin("B", 7)
+qspi_io = [pins.Pin("B", i) for i in range(4)]
+quad_shifter = sw.ShiftLanes(qspi_clock, qspi_io, qspi_io)
+dual_shifter = sw.ShiftLanes(qspi_clock, qspi_io[:2], qspi_io[:2])
+# Two JTAG chains on port D sharing TCK (PD7), TDI on PD0-1 and TDO on PD2-3
+chains_shifter = sw.ShiftLanes(pins.Pin("D", 7),
+	[pins.Pin("D", 2), pins.Pin("D", 3)], [pins.Pin("D", 0), pins.Pin("D", 1)])
+lane_shifters = (("ShiftQuad", quad_shifter), ("ShiftDual", dual_shifter), ("ShiftChains", chains_shifter))
+
 combos = []
 for d in sw.ShiftOp.FirstBit:
 	for read_on in sw.ShiftOp.ClockMode:
@@ -28,22 +75,13 @@ for d in sw.ShiftOp.FirstBit:
 				continue
 			combos.append((d, read_on, write_on))
 
-print("""\
-/* Generated file from mpsse.py */
-
-#include "fx2regs.h"
-#include "fx2types.h"
-
-""")
-print(clock.defines())
-print(data_in.defines())
-print(data_out.defines())
-print("""
-
-""")
+# TMS is always written and always LSB first
+tms_combos = [(read_on, write_on)
+	for read_on in sw.ShiftOp.ClockMode
+	for write_on in (sw.ShiftOp.ClockMode.positive, sw.ShiftOp.ClockMode.negative)]
 
-for d, read_on, write_on in combos:
-	name = ["ShiftByte"]
+def function_name(d, read_on, write_on, prefix="ShiftByte"):
+	name = [prefix]
 	if d == sw.ShiftOp.FirstBit.MSB:
 		name.append("MSBFirst")
 	elif d == sw.ShiftOp.FirstBit.LSB:
@@ -57,17 +95,337 @@ for d, read_on, write_on in combos:
 		name.append("outOnPos")
 	elif write_on == sw.ShiftOp.ClockMode.negative:
 		name.append("outOnNeg")
-	name = "_".join(name)
+	return "_".join(name)
+
+
+# The MPSSE 0x86 divisors most used, slower clocks for long cables and slow
+# targets. Only the JTAG shift (LSB first, in on +ve, out on -ve) is made
+# for each.
+RATE_DIVISORS = (5, 11, 29, 59, 599)
 
+
+def divisor_rate(divisor):
+	"""TCK of an FT2232H for a 0x86 divisor, with the divide by 5 on."""
+	return 12000000 // (2 * (1 + divisor))
+
+
+def byte_function(d, read_on, write_on, optimize=None):
+	"""
+	(C, cycles, bytes) of a ShiftByte_* function, see calling.function_cost().
+	With optimize ("cycles" or "size") it goes through peephole.function().
+	"""
+	assert optimize in (None, "cycles", "size"), optimize
+	name = function_name(d, read_on, write_on)
 	body = byte_shifter.generate(d, read_on, write_on)
+	if optimize:
+		source = peephole.function(name, read_on, write_on, body,
+			byte_shifter.symbols(), size=optimize == "size")[0]
+	else:
+		source = calling.generate(name, read_on, write_on, body)
+	return (source,) + calling.function_cost(source)
+
+
+def port_e_fastest(d, read_on, write_on):
+	"""The ShiftByte of the port E wiring shifting a byte in the fewest cycles."""
+	return usart.fastest(port_e_wirings, d, read_on, write_on)[0]
+
+
+def port_e_functions():
+	"""(defines, functions) of the PortE_ShiftByte_* functions, see port_e_fastest()."""
+	defines, functions = [], []
+	for d, read_on, write_on in combos:
+		shifter = port_e_fastest(d, read_on, write_on)
+		for p in shifter.used_pins():
+			if p.defines() and p.defines() not in defines:
+				defines.append(p.defines())
+		functions.append(calling.generate(function_name(d, read_on, write_on, "PortE_ShiftByte"),
+			read_on, write_on, shifter.generate(d, read_on, write_on)))
+	return defines, functions
+
+
+def reversed_function(read_on, write_on, optimize=None):
+	"""
+	(C, cycles, bytes) of the MSB first ShiftByte_* function reversing the
+	byte round the LSB first one, the cycles including the LSB first one.
+	"""
+	name = function_name(sw.ShiftOp.FirstBit.MSB, read_on, write_on)
+	core = function_name(sw.ShiftOp.FirstBit.LSB, read_on, write_on)
+	source = calling.generate(name, read_on, write_on, calling.reversed_body(read_on, write_on, core))
+	wrapper_cycles, wrapper_bytes = calling.function_cost(source)
+	if read_on == sw.ShiftOp.ClockMode.none:
+		# Jumps to the core, which does the ret
+		wrapper_cycles -= cycles.parse_line("ret")[0].cycles
+	core_cycles = byte_function(sw.ShiftOp.FirstBit.LSB, read_on, write_on, optimize)[1]
+	return source, wrapper_cycles + core_cycles, wrapper_bytes
+
+
+def byte_functions(table=None, optimize=None):
+	"""
+	(functions, tradeoff, reversing) for the ShiftByte_* functions,
+	functions being the C of each and tradeoff comments comparing each MSB
+	first function with reversing the byte round the LSB first one (see
+	calling.reversed_body()). reversing is set when any function needs
+	software.reverse_table().
+
+	With table ("cycles" or "bytes") the reversed one is used where it takes
+	fewer of them. The bytes count the 256 byte table too, so it's only used
+	when all the functions together save more than that. optimize is passed
+	on to byte_function().
+	"""
+	assert table in (None, "cycles", "bytes"), table
+	functions = {}
+	costs = {}
+	for d, read_on, write_on in combos:
+		name = function_name(d, read_on, write_on)
+		source, function_cycles, function_bytes = byte_function(d, read_on, write_on, optimize)
+		functions[name] = source
+		costs[name] = (function_cycles, function_bytes)
+
+	tradeoff = ["/* %-40s %13s %13s */" % ("cycles / bytes", "MSB core", "reverse + LSB")]
+	reversed_functions = {}
+	saved = 0
+	for d, read_on, write_on in combos:
+		if d != sw.ShiftOp.FirstBit.MSB:
+			continue
+		name = function_name(d, read_on, write_on)
+		source, reversed_cycles, reversed_bytes = reversed_function(read_on, write_on, optimize)
+		tradeoff.append("/* %-40s %6i / %4i %6i / %4i */" % (
+			name, costs[name][0], costs[name][1], reversed_cycles, reversed_bytes))
+		if table == "cycles" and reversed_cycles < costs[name][0]:
+			reversed_functions[name] = source
+		elif table == "bytes" and reversed_bytes < costs[name][1]:
+			reversed_functions[name] = source
+			saved += costs[name][1] - reversed_bytes
+	tradeoff.append("/* %-40s %22s %4i */" % ("bit reverse table", "", 256))
+
+	if table == "bytes" and saved <= 256:
+		reversed_functions = {}
+	functions.update(reversed_functions)
+	if reversed_functions:
+		tradeoff.append("/* %i reversed */" % len(reversed_functions))
+	return [functions[function_name(*c)] for c in combos], tradeoff, bool(reversed_functions)
+
+
+def _contract(args, returns):
+	return "%s -> %s" % (", ".join(args) or "nothing", "A: data read" if returns else "nothing")
+
+
+def naked_functions():
+	"""
+	(name, contract, body, C overhead, naked overhead) of the functions
+	taking their arguments in registers (see calling.REGISTERS), for the
+	ShiftByte, ShiftBits, ShiftTMS and ShiftBytesAuto ones. The overheads
+	are the cycles a call takes on top of the shifting (the naked body),
+	as a C function from calling.generate*() and naked.
+	"""
+	none = sw.ShiftOp.ClockMode.none
+	functions = []
+
+	def add(name, args, returns, body, source, argument_bytes, registers=0, autopointer_bytes=0):
+		shift = sw.cycle_count(body)
+		functions.append((name, _contract(args, returns), body,
+			calling.call_cycles(source, argument_bytes, returns) - shift,
+			calling.naked_overhead(registers, autopointer_bytes)))
+
+	for d, read_on, write_on in combos:
+		reading, writing = read_on != none, write_on != none
+		add(function_name(d, read_on, write_on, "ShiftByteNaked"),
+			["A: data"] if writing else [], reading,
+			byte_shifter.generate(d, read_on, write_on),
+			byte_function(d, read_on, write_on)[0], int(writing))
+
+	for d, read_on, write_on in combos:
+		reading, writing = read_on != none, write_on != none
+		name = function_name(d, read_on, write_on, "ShiftBitsNaked")
+		c_name = function_name(d, read_on, write_on, "ShiftBits")
+		add(name, (["A: data"] if writing else []) + ["R7: length"], reading,
+			bits_shifter.generate(d, read_on, write_on, name, registers=True),
+			calling.generate_bits(c_name, read_on, write_on, bits_shifter.generate(d, read_on, write_on, c_name)),
+			1 + int(writing), registers=1)
+
+	for read_on, write_on in tms_combos:
+		name = function_name(None, read_on, write_on, "ShiftTMSNaked")
+		c_name = function_name(None, read_on, write_on, "ShiftTMS")
+		add(name, ["A: data", "R7: length"], read_on != none,
+			tms_shifter.generate(read_on, write_on, name, registers=True),
+			calling.generate_bits(c_name, read_on, write_on, tms_shifter.generate(read_on, write_on, c_name)),
+			2, registers=1)
 
-	print(calling.generate(
-		name=name,
-		read_on=read_on,
-		write_on=write_on,
-		body=body))
+	for d, read_on, write_on in combos:
+		reading, writing = read_on != none, write_on != none
+		name = function_name(d, read_on, write_on, "ShiftBytesNaked")
+		c_name = function_name(d, read_on, write_on, "ShiftBytesAuto")
+		pointers = (["AUTOPTR1: src"] if writing else []) + (["AUTOPTR2: dst"] if reading else [])
+		add(name, pointers + ["R6:R7: length"], False,
+			auto_shifter.generate(d, read_on, write_on, name, registers=True),
+			calling.generate_bytes(c_name, read_on, write_on, auto_shifter.generate(d, read_on, write_on, c_name)),
+			2 * len(sw.ShiftBytes.parameters(read_on, write_on)),
+			registers=2, autopointer_bytes=2 * len(pointers))
+	return functions
 
-print("""\
+
+def naked_header(functions):
+	"""The C prototypes of the naked functions, with their call overheads."""
+	lines = ["/* Generated file from mpsse.py, the naked shift functions */", "/*"]
+	lines += [" * %s" % l for l in ("Registers:\n" + calling.REGISTERS).splitlines()]
+	lines += [" *", " * %-40s %12s %12s" % ("call overhead (cycles)", "C", "naked")]
+	lines += [" * %-45s %6i %6i" % (name, c, naked) for name, contract, body, c, naked in functions]
+	lines += [" */", ""]
+	lines += [calling.prototype(name, contract) for name, contract, body, c, naked in functions]
+	return "\n".join(lines) + "\n"
+
+
+def dispatch_target(d, read_on, write_on, bits):
+	"""The function (and its parameters) for an MPSSE data shifting command."""
+	if bits:
+		return (function_name(d, read_on, write_on, "ShiftBits"),
+			tuple(sw.ShiftBits.parameters(read_on, write_on)))
+	return (function_name(d, read_on, write_on, "ShiftBytesAuto"),
+		tuple(sw.ShiftBytes.parameters(read_on, write_on)))
+
+
+# The optional families of functions, left out unless asked for so the
+# default output is what the firmware links (see the Makefile)
+FAMILIES = ("--port-e", "--bytes", "--adaptive", "--lanes", "--tms", "--rates", "--clocks")
+
+
+def main(args):
+	def wanted(flag):
+		"""Is the family of functions behind flag (one of FAMILIES) asked for."""
+		return flag in args or "--all" in args
+
+	table = None
+	optimize = None
+	for a in args:
+		if a.startswith("--reverse-table="):
+			table = a.split("=", 1)[1]
+		elif a == "--peephole":
+			optimize = "cycles"
+		elif a.startswith("--peephole="):
+			optimize = a.split("=", 1)[1]
+
+	# The naked functions on their own, as an assembler module or header
+	if "--naked-asm" in args:
+		functions = [f[:3] for f in naked_functions()]
+		print(calling.asm_module("mpsse_naked", functions, auto_shifter.symbols()))
+		return
+	if "--naked-h" in args:
+		print(naked_header(naked_functions()))
+		return
+
+	print("""\
+/* Generated file from mpsse.py */
+
+#include "fx2regs.h"
+#include "fx2types.h"
+
+""")
+	print(clock.defines())
+	print(data_in.defines())
+	print(data_out.defines())
+	print(tms.defines())
+	print(gpio.defines())
+	print(rtck.defines())
+	print("""
+
+""")
+
+	functions, tradeoff, reversing = byte_functions(table, optimize)
+	print("\n".join(tradeoff))
+	if reversing:
+		print(sw.reverse_table())
+	for f in functions:
+		print(f)
+
+	if wanted("--port-e"):
+		defines, functions = port_e_functions()
+		print("\n".join(defines))
+		for f in functions:
+			print(f)
+
+	for d, read_on, write_on in (combos if wanted("--adaptive") else ()):
+		name = function_name(d, read_on, write_on, "ShiftByteAdaptive")
+		body = adaptive_shifter.generate(d, read_on, write_on)
+
+		print(calling.generate(
+			name=name,
+			read_on=read_on,
+			write_on=write_on,
+			body=body))
+
+	# ShiftBytesAuto is what ShiftDispatch calls (see dispatch_target()), the
+	# plain pointer copy of it is only there for --bytes
+	buffers = [("ShiftBytesAuto", auto_shifter)]
+	if wanted("--bytes"):
+		buffers.insert(0, ("ShiftBytes", bytes_shifter))
+	for (prefix, shifter), (d, read_on, write_on) in itertools.product(buffers, combos):
+		name = function_name(d, read_on, write_on, prefix)
+		body = shifter.generate(d, read_on, write_on, name)
+
+		print(calling.generate_bytes(
+			name=name,
+			read_on=read_on,
+			write_on=write_on,
+			body=body))
+
+	for (prefix, shifter), (d, read_on, write_on) in itertools.product(
+			lane_shifters if wanted("--lanes") else (), combos):
+		if not shifter.supports(d, read_on, write_on):
+			continue
+		print(calling.generate(
+			name=function_name(d, read_on, write_on, prefix),
+			read_on=read_on,
+			write_on=write_on,
+			body=shifter.generate(d, read_on, write_on)))
+
+	# Called by ShiftDispatch for the bit mode commands
+	for d, read_on, write_on in combos:
+		name = function_name(d, read_on, write_on, "ShiftBits")
+		body = bits_shifter.generate(d, read_on, write_on, name)
+
+		print(calling.generate_bits(
+			name=name,
+			read_on=read_on,
+			write_on=write_on,
+			body=body))
+
+	for read_on, write_on in (tms_combos if wanted("--tms") else ()):
+		name = function_name(None, read_on, write_on, "ShiftTMS")
+		body = tms_shifter.generate(read_on, write_on, name)
+
+		print(calling.generate_bits(
+			name=name,
+			read_on=read_on,
+			write_on=write_on,
+			body=body))
+
+	jtag = (sw.ShiftOp.FirstBit.LSB, sw.ShiftOp.ClockMode.positive, sw.ShiftOp.ClockMode.negative)
+	for divisor in (RATE_DIVISORS if wanted("--rates") else ()):
+		rate = divisor_rate(divisor)
+		name = "%s_Div%i" % (function_name(*jtag), divisor)
+		print(calling.generate(name, jtag[1], jtag[2],
+			byte_shifter.generate(*jtag, rate=rate)))
+		name = "%s_Div%i" % (function_name(*jtag, prefix="ShiftBits"), divisor)
+		print(calling.generate_bits(name, jtag[1], jtag[2],
+			bits_shifter.generate(*jtag, name=name, rate=rate)))
+
+	if wanted("--clocks"):
+		print(calling.generate_bits("ClockBits", sw.ShiftOp.ClockMode.none,
+			sw.ShiftOp.ClockMode.none, clocker.bits("ClockBits")))
+		print(calling.generate_clocks("ClockBytes", True, clocker.bytes("ClockBytes")))
+		for level, suffix in ((1, "High"), (0, "Low")):
+			name = "ClockUntil" + suffix
+			print(calling.generate_clocks(name, False, clocker.until(name, level)))
+			name = "ClockBytesUntil" + suffix
+			print(calling.generate_clocks(name, True, clocker.until(name, level, counted=True)))
+
+	if "--naked" in args:
+		for name, contract, body, c, naked in naked_functions():
+			print(calling.generate_naked(name, contract, body))
+
+	print(dispatch.generate("ShiftDispatch", dispatch.targets(dispatch_target)))
+
+	print("""\
 BYTE main() {
 	BYTE data = 0xaa;
 
@@ -77,3 +435,7 @@ BYTE main() {
 	return data;
 }
 """)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
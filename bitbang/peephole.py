@@ -0,0 +1,251 @@
+"""
+Peephole optimisation of the generated function bodies.
+
+The passes look at the lines of a body (ir.Items) one instruction at a
+time, using the cycles.Instruction flags and scheduler.effects() to see
+what each reads and writes:
+
+  oe_writes()      drops ORL / ANL / MOV of an OE register which can't
+                   change it, like the set up of a pin already that way
+  dead_carry()     drops moves into the carry overwritten before they're used
+  merge_prologue() moves the A set up at the start of a function (see
+                   calling.entry()) down into the first NOPs with room for it
+  fold_nops()      turns runs of 3 NOPs into a 3 cycle, 2 byte SJMP
+
+The clock timing the scheduler worked out is kept. An instruction dropped
+between the first and the last pin access is replaced by NOPs, so only the
+code before and after the clocking gets faster, the rest only smaller.
+
+  python3 peephole.py         Savings over the mpsse.py functions
+  python3 peephole.py --size  Folding the NOPs too
+"""
+
+import sys
+import itertools
+
+import ir
+import scheduler
+import sfr
+import software as sw
+import calling
+
+# A 3 cycle NOP in 2 bytes, jumping to the next instruction
+FILLER = ir.Line("sjmp", [".+2"], "3 cycle nop")
+
+OE_BYTES = set(scheduler.byte_resource("%#04x" % a) for a in sfr.OES.values())
+
+
+def _instruction(line):
+	"""(mnemonic, destination, source) of line, None if it isn't an instruction."""
+	if line.instruction is None:
+		return None
+	return (line.mnemonic,) + tuple(list(line.operands) + [None, None])[:2]
+
+
+def _pinned(line, symbols=None):
+	return scheduler.Op("line", [line], symbols=symbols).pinned
+
+
+def _remove(lines, dropped, symbols=None):
+	"""
+	lines without the ones at the indexes in dropped, NOPs taking the place
+	of those between the first and last pin access left.
+	"""
+	pinned = [i for i, l in enumerate(lines) if i not in dropped and _pinned(l, symbols)]
+	first, last = (pinned[0], pinned[-1]) if pinned else (len(lines), -1)
+	result = []
+	for i, l in enumerate(lines):
+		if i not in dropped:
+			result.append(l)
+		elif first < i < last:
+			result += [scheduler.NOP] * l.cycles
+	return result
+
+
+def oe_writes(lines, symbols=None):
+	"""
+	Drop the writes of an immediate to an OE register which leave it as it
+	was, as far as the writes before them (back to a label) tell.
+	"""
+	known = {}	# OE byte -> (mask of the bits known, their values)
+	dropped = set()
+	for i, line in enumerate(lines):
+		if line.label:
+			known = {}
+			continue
+		parsed = _instruction(line)
+		if parsed is None:
+			continue
+		mnemonic, dst, src = parsed
+		reads, writes = scheduler.effects(line, symbols)
+		if scheduler.BARRIER in writes:
+			known = {}
+			continue
+
+		oe = scheduler.byte_resource(dst, symbols) if dst else None
+		value = scheduler._number(src[1:]) if src and src.startswith('#') else None
+		if oe in OE_BYTES and value is not None and mnemonic in ('orl', 'anl', 'mov'):
+			mask, bits = known.get(oe, (0, 0))
+			if mnemonic == 'orl':
+				redundant = value & ~(mask & bits) & 0xff == 0
+				mask, bits = mask | value, bits | value
+			elif mnemonic == 'anl':
+				cleared = ~value & 0xff
+				redundant = cleared & ~(mask & ~bits) & 0xff == 0
+				mask, bits = mask | cleared, bits & value
+			else:
+				redundant = (mask, bits) == (0xff, value)
+				mask, bits = 0xff, value
+			if redundant:
+				dropped.add(i)
+			known[oe] = (mask, bits)
+			continue
+
+		for w in writes:
+			for oe in list(known):
+				if scheduler.conflicts(w, oe):
+					del known[oe]
+	return _remove(lines, dropped, symbols)
+
+
+def _carry_only(line, symbols=None):
+	"""Does line only write the carry (mov c,bit / clr c / setb c / cpl c)."""
+	if line.instruction is None or not line.instruction.effects_carry:
+		return False
+	reads, writes = scheduler.effects(line, symbols)
+	return writes == set([scheduler.CARRY])
+
+
+def _carry_dead(lines, symbols=None, live_out=False):
+	"""Is the carry overwritten before it's read at the start of lines."""
+	for line in lines:
+		if line.label:
+			return False
+		if line.instruction is None:
+			continue
+		reads, writes = scheduler.effects(line, symbols)
+		if any(scheduler.conflicts(r, scheduler.CARRY) for r in reads):
+			return False
+		if any(scheduler.conflicts(w, scheduler.CARRY) for w in writes):
+			return True
+	return not live_out
+
+
+def dead_carry(lines, symbols=None, live_out=False):
+	"""
+	Drop the instructions only moving something into the carry which is
+	overwritten before it's read. With live_out the carry is read after
+	lines.
+	"""
+	while True:
+		dropped = set(i for i, l in enumerate(lines)
+			if _carry_only(l, symbols) and _carry_dead(lines[i + 1:], symbols, live_out))
+		if not dropped:
+			return lines
+		lines = _remove(lines, dropped, symbols)
+
+
+def merge_prologue(lines, count, symbols=None):
+	"""
+	Move the first count lines (the set up of A) into the first run of NOPs
+	in the rest long enough to hold them, see scheduler.sink().
+	"""
+	if not count:
+		return lines
+	op = scheduler.Op("prologue", lines[:count], symbols=symbols)
+	sunk = scheduler.sink(op, lines[count:], symbols=symbols)
+	return lines if sunk is None else sunk
+
+
+def fold_nops(lines):
+	"""Every 3 NOPs in a row becomes a FILLER, the same cycles in a byte less."""
+	result = []
+	for nop, run in itertools.groupby(lines, lambda l: l == scheduler.NOP):
+		run = list(run)
+		if nop:
+			run = [FILLER] * (len(run) // 3) + run[:len(run) % 3]
+		result += run
+	return result
+
+
+def optimize(lines, symbols=None, prologue=0, size=False, live_out=False):
+	"""
+	(lines, savings) for the lines after the passes, savings being a list
+	of (pass, cycles saved, bytes saved). The first prologue lines are the
+	set up of A merge_prologue() moves, fold_nops() only runs with size.
+	"""
+	passes = [
+		("oe", lambda l: oe_writes(l, symbols)),
+		("carry", lambda l: dead_carry(l, symbols, live_out)),
+		("prologue", lambda l: merge_prologue(l, prologue, symbols)),
+	]
+	if size:
+		passes.append(("nops", fold_nops))
+
+	lines = list(lines)
+	savings = []
+	for name, f in passes:
+		if name != "prologue":
+			# The other passes keep the prologue where it is
+			head, body = lines[:prologue], f(lines[prologue:])
+			after = head + body
+		else:
+			after = f(lines)
+			prologue = 0 if after is not lines else prologue
+		savings.append((name,
+			sw.cycle_count(lines) - sw.cycle_count(after), sw.code_size(lines) - sw.code_size(after)))
+		lines = after
+	return lines, savings
+
+
+def function(name, read_on, write_on, body, symbols=None, size=False):
+	"""(C, savings) of calling.generate() with the body optimized."""
+	head = calling.entry(read_on, write_on)
+	lines, savings = optimize(head + list(body), symbols, len(head), size)
+	return calling.generate(name, read_on, write_on, lines, entry=False), savings
+
+
+def total(savings):
+	"""(cycles, bytes) saved by all the passes."""
+	return sum(s[1] for s in savings), sum(s[2] for s in savings)
+
+
+def main(args):
+	import mpsse
+
+	size = "--size" in args
+	print("%-45s %12s %12s  %s" % ("function", "cycles", "bytes", "saved by pass (cycles/bytes)"))
+	totals = [0, 0]
+
+	def show(name, before, savings):
+		c, b = total(savings)
+		totals[0] += c
+		totals[1] += b
+		print("%-45s %5i %+6i %5i %+6i  %s" % (
+			name, sw.cycle_count(before), -c, sw.code_size(before), -b,
+			" ".join("%s %i/%i" % s for s in savings)))
+
+	shifters = [
+		("ShiftByte", mpsse.byte_shifter),
+		("PortE_ShiftByte", mpsse.port_e_shifter),
+		("ShiftByteAdaptive", mpsse.adaptive_shifter),
+	] + list(mpsse.lane_shifters)
+	for (prefix, shifter), (d, read_on, write_on) in itertools.product(shifters, mpsse.combos):
+		if not shifter.supports(d, read_on, write_on):
+			continue
+		head = calling.entry(read_on, write_on)
+		lines = head + shifter.generate(d, read_on, write_on)
+		savings = optimize(lines, shifter.symbols(), len(head), size)[1]
+		show(mpsse.function_name(d, read_on, write_on, prefix), lines, savings)
+
+	for d, read_on, write_on in mpsse.combos:
+		name = mpsse.function_name(d, read_on, write_on, "ShiftBits")
+		lines = mpsse.bits_shifter.generate(d, read_on, write_on, name)
+		show(name, lines, optimize(lines, mpsse.bits_shifter.symbols(), size=size)[1])
+
+	print("%-45s %12i %12i" % ("total", -totals[0], -totals[1]))
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
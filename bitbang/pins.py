@@ -37,3 +37,22 @@ class Pin(object):
 	def nask(self):
 		return ~(1 << self.index) & 0xff
 
+
+
+class DedicatedPin(object):
+	"""A pin which isn't part of a port, like the i2c controller's SCL / SDA."""
+	def __init__(self, name):
+		self.name = name
+
+	@property
+	def bit_accessible(self):
+		return False
+
+
+# The pins of the FX2's i2c controller (I2CS / I2DAT)
+I2C_SCL = DedicatedPin("SCL")
+I2C_SDA = DedicatedPin("SDA")
+
+# The pins of USART0, in mode 0 TXD0 is the shift clock and RXD0 the data
+TXD0 = DedicatedPin("TXD0")
+RXD0 = DedicatedPin("RXD0")
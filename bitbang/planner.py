@@ -0,0 +1,400 @@
+"""
+Pick the pin mapping of a board which gives the most throughput.
+
+A board (one of BOARDS, or a JSON file of the same form) lists the
+pins each signal can be wired to and the modes it's used in. Every legal
+mapping is scored by the CPU cycles per bit the generators take for each
+mode, JTAG's counting the TMS commands (ShiftTMS) along with the data, and
+the best one is printed with the lines setting up the generators for it
+(the top of mpsse.py / i2c.py). Port E pins go through the proxy byte or
+straight to the port, whichever wiring of them is quicker. The i2c bit rate
+is reported on its own, it isn't part of the score (see i2c_cost()).
+
+Pins are written as "A5" (port A pin 5) or the name of a dedicated pin,
+"TXD0" / "RXD0" for USART0 (see usart.py) or "SCL" / "SDA" for the i2c
+controller.
+
+  python3 planner.py                    Plan the example board
+  python3 planner.py tiao               Plan one of BOARDS
+  python3 planner.py board.json         Plan a board of your own
+  python3 planner.py --all board.json   List every legal mapping
+  python3 planner.py --json board.json  Print the plan as JSON
+"""
+
+import sys
+import json
+import itertools
+
+import pins
+import cycles
+import software as sw
+import usart
+import i2c
+
+# How many mappings are listed without --all
+LISTED = 10
+
+MSB, LSB = sw.ShiftOp.FirstBit.MSB, sw.ShiftOp.FirstBit.LSB
+none, pos, neg = sw.ShiftOp.ClockMode.none, sw.ShiftOp.ClockMode.positive, sw.ShiftOp.ClockMode.negative
+
+# The signals of each mode, and for the byte shifting ones the combinations
+# of ShiftByte it uses
+MODES = {
+	'jtag': (('clock', 'in', 'out', 'tms'), [(LSB, pos, neg)]),
+	'spi': (('clock', 'in', 'out'), [(MSB, pos, neg)]),
+	# Reading / programming a flash, one way at a time
+	'spi_flash': (('clock', 'in', 'out'), [(MSB, none, neg), (MSB, pos, none)]),
+	'i2c': (('scl', 'sda'), None),
+}
+
+# The ShiftTMS combinations JTAG uses, TMS written on the falling edge with
+# and without TDO read (MPSSE 0x4b, 0x6b)
+TMS_COMBOS = [(none, neg), (pos, neg)]
+
+# A 100 pin FX2 board where the JTAG and i2c signals can go to a few places,
+# the mapping mpsse.py and i2c.py use now first
+EXAMPLE_BOARD = {
+	'modes': ['jtag', 'i2c'],
+	'signals': {
+		'clock': ['A5', 'E5', 'TXD0'],
+		'in': ['A3', 'E3', 'RXD0'],
+		'out': ['A2', 'E2', 'RXD0'],
+		'tms': ['A4', 'E4'],
+		'scl': ['A5', 'A1', 'SCL'],
+		'sda': ['A3', 'A0', 'SDA'],
+	},
+}
+
+# The boards the README names. docs/ only has the FT2232H descriptors of
+# the Pipistrello and the TIAO adapter (channel A the MPSSE, B a serial
+# port), not how an FX2 board is wired, so the pins below are where an FX2
+# standing in for them can put each signal: the MPSSE's ADBUS0-3 (TCK/SK,
+# TDI/DO, TDO/DI, TMS/CS) on the low bits of a port.
+BOARDS = {
+	'example': EXAMPLE_BOARD,
+	# JTAG to the Spartan 6 and the i2c bus of the FX2's boot EEPROM
+	'atlys': {
+		'modes': ['jtag', 'i2c'],
+		'signals': {
+			'clock': ['A0', 'D0', 'E0', 'TXD0'],
+			'in': ['A2', 'D2', 'E2', 'RXD0'],
+			'out': ['A1', 'D1', 'E1', 'RXD0'],
+			'tms': ['A3', 'D3', 'E3'],
+			'scl': ['SCL'],
+			'sda': ['SDA'],
+		},
+	},
+	# As the Atlys, the Spartan 6 flash read and written over SPI too
+	'opsis': {
+		'modes': ['jtag', 'spi_flash', 'i2c'],
+		'signals': {
+			'clock': ['A0', 'D0', 'E0', 'TXD0'],
+			'in': ['A2', 'D2', 'E2', 'RXD0'],
+			'out': ['A1', 'D1', 'E1', 'RXD0'],
+			'tms': ['A3', 'D3', 'E3'],
+			'scl': ['SCL'],
+			'sda': ['SDA'],
+		},
+	},
+	# docs/tiao.md, JTAG / SPI / i2c on channel A. The MPSSE's i2c is SK and
+	# DO, here the controller or port B so they can be wired at once.
+	'tiao': {
+		'modes': ['jtag', 'spi', 'i2c'],
+		'signals': {
+			'clock': ['A0', 'E0', 'TXD0'],
+			'in': ['A2', 'E2', 'RXD0'],
+			'out': ['A1', 'E1', 'RXD0'],
+			'tms': ['A3', 'E3'],
+			'scl': ['B0', 'SCL'],
+			'sda': ['B1', 'SDA'],
+		},
+	},
+	# docs/pipistrello.md, JTAG on channel A, channel B the serial port to
+	# the FPGA, which takes USART0
+	'pipistrello': {
+		'modes': ['jtag'],
+		'signals': {
+			'clock': ['A0', 'E0'],
+			'in': ['A2', 'E2'],
+			'out': ['A1', 'E1'],
+			'tms': ['A3', 'E3'],
+		},
+	},
+}
+
+DEDICATED = dict((p.name, p) for p in (pins.TXD0, pins.RXD0, pins.I2C_SCL, pins.I2C_SDA))
+
+
+def parse_pin(name):
+	"""pins.Pin for "A5", the dedicated pin for "TXD0" and the like."""
+	if name in DEDICATED:
+		return DEDICATED[name]
+	if len(name) != 2 or not name[1].isdigit():
+		raise ValueError("Unknown pin %r" % name)
+	return pins.Pin(name[0].upper(), int(name[1]))
+
+
+def pin_name(pin):
+	if isinstance(pin, pins.DedicatedPin):
+		return pin.name
+	return "%s%i" % (pin.port, pin.index)
+
+
+def bitbangs(name, pin, direction):
+	"""The BitBangs a port pin can go through (see software.bitbangs()), a dedicated pin as it is."""
+	if isinstance(pin, pins.DedicatedPin):
+		return [pin]
+	return sw.bitbangs(name, pin, direction)
+
+
+def wirings(mapping):
+	"""
+	Every (clk, din, dout, tms) of BitBangs the mapping's clock / in / out /
+	tms can go through together, tms None when the mapping has no TMS.
+	"""
+	clk = bitbangs("clk", mapping['clock'], pins.PinDirection.output)
+	din = bitbangs("din", mapping['in'], pins.PinDirection.input)
+	dout = bitbangs("dout", mapping['out'], pins.PinDirection.output)
+	if 'tms' not in mapping:
+		return [w + (None,) for w in sw.wirings(clk, din, dout)]
+	return [w + (tms,) for tms in bitbangs("tms", mapping['tms'], pins.PinDirection.output)
+		for w in sw.wirings(clk, din, dout, [tms])]
+
+
+def shift_cost(wiring, combos):
+	"""
+	Cycles per bit of the fastest shifter for the combos on the (clk, din,
+	dout) of a wiring, None when it can't do them all.
+	"""
+	total = 0
+	for combo in combos:
+		try:
+			total += usart.fastest([wiring[:3]], *combo)[1]
+		except ValueError:
+			return None
+	return total / 8.0 / len(combos)
+
+
+def tms_cost(wiring):
+	"""
+	Cycles per bit of ShiftTMS for the TMS_COMBOS on a wiring, None when it
+	can't be bit banged there.
+	"""
+	if not all(isinstance(b, sw.BitBang) for b in wiring):
+		return None
+	shifter = sw.ShiftTMS(*wiring)
+	total = 0
+	for read_on, write_on in TMS_COMBOS:
+		try:
+			shifter.generate(read_on, write_on, "ShiftTMS")
+		except ValueError:
+			return None
+		total += shifter.schedule(LSB, read_on, write_on).period
+	return total / float(len(TMS_COMBOS))
+
+
+def shift_costs(mapping, modes):
+	"""
+	(costs, wiring) of the wiring (see wirings()) doing the byte shifting
+	modes in the fewest cycles, costs being {mode: cycles per bit}. None
+	when no wiring can do them all. A mode with TMS costs the average over
+	its ShiftByte and ShiftTMS combinations.
+	"""
+	best = None
+	for wiring in wirings(mapping):
+		result = {}
+		for mode in modes:
+			combos = MODES[mode][1]
+			if combos is None:
+				continue
+			result[mode] = shift_cost(wiring, combos)
+			if result[mode] is not None and 'tms' in MODES[mode][0]:
+				tms = tms_cost(wiring)
+				result[mode] = None if tms is None else (
+					result[mode] * len(combos) + tms * len(TMS_COMBOS)) / (len(combos) + len(TMS_COMBOS))
+			if result[mode] is None:
+				break
+		else:
+			if best is None or sum(result.values()) < sum(best[0].values()):
+				best = (result, wiring)
+	return best
+
+
+def i2c_cost(scl, sda, speed):
+	"""
+	(CPU cycles per bit, bit rate) of i2c at the fastest rate scl / sda can
+	do, or None. Bit banged the CPU times every bit, so that's the period;
+	the controller shifts a byte (and the ACK) while the CPU does something
+	else, so it's the longest Poll() spread over the 9 bits.
+	"""
+	dedicated = (pins.I2C_SCL, pins.I2C_SDA)
+	if (scl, sda) == dedicated:
+		rate = max(i2c.I2CController.RATES)
+		return i2c.I2CController(rate).poll_cycles() / 9.0, rate
+	if isinstance(scl, pins.DedicatedPin) or isinstance(sda, pins.DedicatedPin):
+		return None
+	# Bit banged through the OE proxy they share
+	if not (scl.bit_accessible and sda.bit_accessible) or scl.port != sda.port:
+		return None
+	for rate in sorted(i2c.I2CMaster.MODES, reverse=True):
+		try:
+			return i2c.backend(scl, sda, rate, speed).period, rate
+		except ValueError:
+			continue
+	return None
+
+
+def costs(mapping, modes, speed):
+	"""{mode: cycles per bit} for a mapping, None when it isn't legal."""
+	result = {}
+	if any(MODES[mode][1] is not None for mode in modes):
+		shifting = shift_costs(mapping, modes)
+		if shifting is None:
+			return None
+		result.update(shifting[0])
+	for mode in modes:
+		signals, combos = MODES[mode]
+		if combos is None:
+			cost = i2c_cost(mapping['scl'], mapping['sda'], speed)
+			if cost is None:
+				return None
+			result[mode] = cost[0]
+		elif 'tms' in signals and isinstance(mapping['tms'], pins.DedicatedPin):
+			return None
+	return result
+
+
+def mappings(board):
+	"""Every assignment of the board's signals, no pin used twice (bar RXD0 for in and out)."""
+	signals = []
+	for mode in board['modes']:
+		for s in MODES[mode][0]:
+			if s not in signals:
+				signals.append(s)
+	choices = [[parse_pin(p) for p in board['signals'][s]] for s in signals]
+	for assignment in itertools.product(*choices):
+		used = [p for s, p in zip(signals, assignment) if not (s == 'in' and p is pins.RXD0)]
+		keys = [pin_name(p) for p in used]
+		if len(set(keys)) != len(keys):
+			continue
+		yield dict(zip(signals, assignment))
+
+
+def board_speed(board):
+	return cycles.CPUSpeed[board.get('speed', 'MHz48')]
+
+
+def plan(board):
+	"""The legal mappings of a board as (total, costs, mapping), best first."""
+	speed = board_speed(board)
+	results = []
+	for mapping in mappings(board):
+		c = costs(mapping, board['modes'], speed)
+		if c is not None:
+			results.append((sum(c.values()), c, mapping))
+	results.sort(key=lambda r: r[0])
+	return results
+
+
+# (signal, the variable in mpsse.py, its BitBang's name, direction)
+VARIABLES = (
+	('clock', 'clock', 'clk', 'output'),
+	('in', 'data_in', 'din', 'input'),
+	('out', 'data_out', 'dout', 'output'),
+	('tms', 'tms', 'tms', 'output'),
+)
+
+
+def config(mapping, modes, speed):
+	"""Python setting the generators up for the mapping."""
+	lines = []
+	kinds = {}
+	shifting = shift_costs(mapping, modes) if any(MODES[m][1] is not None for m in modes) else None
+	if shifting:
+		for signal, bitbang in zip(('clock', 'in', 'out', 'tms'), shifting[1]):
+			if bitbang is not None:
+				kinds[signal] = type(bitbang).__name__
+	for signal, variable, name, direction in VARIABLES:
+		if signal not in mapping:
+			continue
+		pin = mapping[signal]
+		if isinstance(pin, pins.DedicatedPin):
+			lines.append('%s = pins.%s' % (variable, pin.name))
+			continue
+		kind = kinds.get(signal, "BitAccessInASM" if pin.bit_accessible else "ByteAccessInASM")
+		lines.append('%s = sw.%s("%s", pins.Pin("%s", %i), pins.PinDirection.%s)' % (
+			variable, kind, name, pin.port, pin.index, direction))
+	if 'i2c' in modes:
+		args = []
+		for signal in ('scl', 'sda'):
+			pin = mapping[signal]
+			if isinstance(pin, pins.DedicatedPin):
+				args.append("pins.I2C_%s" % pin.name)
+			else:
+				args.append('pins.Pin("%s", %i)' % (pin.port, pin.index))
+		args.append("%i" % i2c_cost(mapping['scl'], mapping['sda'], speed)[1])
+		if not isinstance(mapping['scl'], pins.DedicatedPin):
+			args.append("cycles.CPUSpeed.%s" % speed.name)
+		lines.append("bus = i2c.backend(%s)" % ", ".join(args))
+	return lines
+
+
+def report(board, results, everything=False):
+	modes = board['modes']
+	speed = board_speed(board)
+	rated = 'i2c' in modes
+	lines = ["%-40s %8s  %s%s" % ("mapping", "total", "  ".join("%9s" % m for m in modes),
+		"  %9s" % "i2c bit/s" if rated else "")]
+	for total, c, mapping in results if everything else results[:LISTED]:
+		lines.append("%-40s %8.2f  %s%s" % (
+			" ".join("%s=%s" % (s, pin_name(p)) for s, p in sorted(mapping.items())),
+			total, "  ".join("%9.2f" % c[m] for m in modes),
+			"  %9i" % i2c_cost(mapping['scl'], mapping['sda'], speed)[1] if rated else ""))
+	if not everything and len(results) > LISTED:
+		lines.append("... %i more, see --all" % (len(results) - LISTED))
+	lines.append("")
+	if not results:
+		lines.append("No legal mapping")
+		return "\n".join(lines)
+	total, c, mapping = results[0]
+	lines.append("Best, %.2f cycles per bit over %s:" % (total, ", ".join(modes)))
+	if 'i2c' in modes:
+		lines.append("i2c at %i bit/s" % i2c_cost(mapping['scl'], mapping['sda'], speed)[1])
+	lines += ["\t" + l for l in config(mapping, modes, speed)]
+	return "\n".join(lines)
+
+
+def main(args):
+	board = EXAMPLE_BOARD
+	files = [a for a in args if not a.startswith("--")]
+	if files and files[0] in BOARDS:
+		board = BOARDS[files[0]]
+	elif files:
+		with open(files[0]) as f:
+			board = json.load(f)
+	for mode in board['modes']:
+		if mode not in MODES:
+			sys.stderr.write("Unknown mode %r, not one of %s\n" % (mode, ", ".join(sorted(MODES))))
+			return 1
+
+	results = plan(board)
+	speed = board_speed(board)
+	if "--json" in args:
+		best = results[0][2] if results else None
+		print(json.dumps({
+			'best': dict((s, pin_name(p)) for s, p in best.items()) if best else None,
+			'config': config(best, board['modes'], speed) if best else [],
+			'i2c_rate': i2c_cost(best['scl'], best['sda'], speed)[1] if best and 'i2c' in board['modes'] else None,
+			'mappings': [{
+				'mapping': dict((s, pin_name(p)) for s, p in mapping.items()),
+				'cycles_per_bit': c,
+				'total': total,
+			} for total, c, mapping in results],
+		}, indent=2, sort_keys=True))
+	else:
+		print(report(board, results, "--all" in args))
+	return 0 if results else 1
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
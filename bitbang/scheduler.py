@@ -0,0 +1,612 @@
+"""
+Instruction scheduler for the unrolled bit banging loops.
+
+A shift loop is described by the ops of one iteration in program order,
+including the two clock edge ops. The reads and writes of every instruction
+(carry, A, registers, the pin SFRs and their bits) are worked out from the
+instructions, giving the dependencies between the ops of an iteration and
+between neighbouring iterations.
+
+Ops which touch a pin keep their place between the same two clock edges as
+in the program order. Every other op can be moved to either side of an edge
+and into the previous or next iteration (software pipelining), as long as
+the dependencies still hold. The placement with the smallest edge to edge
+gap wins and the shorter side is padded with NOPs for a 50% duty cycle.
+
+    neg edge (N slot ops) pos edge (P slot ops) neg edge ...
+             \__ low time _/        \_ high time _/
+"""
+
+import itertools
+
+import cycles
+import sfr
+import ir
+
+
+NOP = ir.Line("nop")
+
+# The two halves of a clock period, named after the edge which starts them.
+SLOTS = ('neg', 'pos')
+
+# Iterations relative to its own an op can be moved into (see Schedule)
+STAGES = (0, 1, -1)
+
+# Anything touching these can be seen outside the chip
+PIN_BYTES = set(sfr.PORTS.values()) | set(sfr.OES.values())
+
+# Control flow can't be reordered, it conflicts with everything
+BARRIER = '*'
+
+_CONTROL = set([
+	'JMP', 'AJMP', 'LJMP', 'SJMP', 'JC', 'JNC', 'JB', 'JNB', 'JBC', 'JZ',
+	'JNZ', 'CJNE', 'DJNZ', 'CALL', 'ACALL', 'LCALL', 'RET', 'RETI'])
+# Mnemonics which read their destination as well as writing it
+_READ_DST = set([
+	'ANL', 'ORL', 'XRL', 'ADD', 'ADDC', 'SUBB', 'XCH', 'XCHD', 'INC', 'DEC',
+	'CPL', 'RL', 'RR', 'RLC', 'RRC', 'SWAP', 'DA'])
+# Mnemonics which also write their source
+_WRITE_SRC = set(['XCH', 'XCHD'])
+_CARRY_IN = set(['ADDC', 'SUBB', 'RLC', 'RRC', 'DA'])
+_CARRY_OUT = set(['ADD', 'ADDC', 'SUBB', 'RLC', 'RRC', 'DA', 'MUL', 'DIV'])
+
+CARRY = 'PSW.7'
+
+def _number(s):
+	try:
+		return int(s, 0)
+	except ValueError:
+		return None
+
+
+def _byte(addr):
+	return {0xE0: 'A', 0xF0: 'B', 0xD0: 'PSW', 0x82: 'DPL', 0x83: 'DPH'}.get(addr, 'D%02X' % addr)
+
+
+def byte_resource(name, symbols=None):
+	"""Resource name for a direct byte operand."""
+	name = name.strip()
+	symbols = symbols or {}
+	if name in symbols:
+		return _byte(symbols[name])
+	n = _number(name)
+	if n is not None:
+		return _byte(n)
+	bare = name.lstrip('_').upper()
+	if bare in sfr.SFRS:
+		return _byte(sfr.SFRS[bare])
+	if len(bare) == 3 and bare.startswith('AR') and bare[2] in '01234567':
+		return _byte(int(bare[2]))
+	return name
+
+
+def bit_resource(name, symbols=None):
+	"""Resource name for a bit operand, the byte holding it plus '.bit'."""
+	name = name.strip()
+	symbols = symbols or {}
+	addr = symbols.get(name, _number(name))
+	if addr is None:
+		addr = sfr.BITS.get(name.lstrip('_').upper())
+	if addr is None:
+		if '.' not in name:
+			return name
+		byte, bit = name.rsplit('.', 1)
+		return "%s.%s" % (byte_resource(byte, symbols), bit)
+	if addr < 0x80:
+		return "D%02X.%i" % (0x20 + addr // 8, addr % 8)
+	return "%s.%i" % (_byte(addr & 0xF8), addr & 7)
+
+
+def _operand(kind, text, symbols):
+	"""(resource accessed, resources read to find it) for an operand."""
+	A = cycles.ArgType
+	text = text.strip()
+	if isinstance(kind, tuple):
+		return 'CODE', set(['A', 'DPL', 'DPH'])
+	if kind == A.accumulator:
+		return 'A', set()
+	elif kind == A.b:
+		return 'B', set()
+	elif kind == A.carry:
+		return CARRY, set()
+	elif kind == A.register:
+		return _byte(int(text[-1])), set()
+	elif kind == A.indirect_byte:
+		return 'IRAM', set([_byte(int(text[-1]))])
+	elif kind == A.direct_byte:
+		return byte_resource(text, symbols), set()
+	elif kind == A.direct_bit:
+		return bit_resource(text, symbols), set()
+	elif kind == A.inverse_direct_bit:
+		return bit_resource(text[1:], symbols), set()
+	elif kind == A.data_pointer:
+		return 'DPTR', set()
+	elif kind == A.indirect_data_pointer:
+		return 'XDATA', set(['DPL', 'DPH'])
+	return None, set()
+
+
+def effects(line, symbols=None):
+	"""Resources read and written by line (an ir.Item), see resources()."""
+	reads, writes = line.effects(symbols)
+	return set(reads), set(writes)
+
+
+def resources(i, operands, symbols=None):
+	"""
+	Resources read and written by the instruction i with operands.
+
+	Resources are 'A', 'B', 'PSW.7' (carry), 'DPL'/'DPH', 'Dxx' for direct
+	bytes (registers are bank 0, D00-D07) and 'Dxx.n' for their bits. 'IRAM'
+	is anything reached through @Ri.
+	"""
+	mnemonic = i.mneomic.upper()
+	if mnemonic in _CONTROL:
+		return set([BARRIER]), set([BARRIER])
+
+	args = i.args
+	if isinstance(args, cycles.ArgsMul):
+		return set(['A', 'B']), set(['A', 'B', CARRY, 'PSW.2'])
+
+	kinds = list(args)
+	reads, writes = set(), set()
+	accessed = []
+	for kind, text in zip(kinds, operands):
+		resource, via = _operand(kind, text, symbols)
+		reads |= via
+		accessed.append((kind, resource))
+
+	if mnemonic == 'MOVX':
+		reads.add(_byte(sfr.SFRS['MPAGE']))
+		accessed = [(k, 'XDATA' if k == cycles.ArgType.indirect_byte else r) for k, r in accessed]
+	if mnemonic in ('PUSH', 'POP'):
+		reads.add('D81')
+		writes |= set(['D81', 'IRAM'])
+
+	if len(accessed) == 1:
+		kind, r = accessed[0]
+		if mnemonic in ('PUSH', ):
+			reads.add(r)
+		elif mnemonic not in ('NOP', ):
+			writes.add(r)
+			if mnemonic in _READ_DST:
+				reads.add(r)
+	elif len(accessed) >= 2:
+		(dkind, dst), (skind, src) = accessed[:2]
+		writes.add(dst)
+		if skind not in (cycles.ArgType.immediate_byte, cycles.ArgType.immediate_word):
+			reads.add(src)
+		if mnemonic in _READ_DST:
+			reads.add(dst)
+		if mnemonic in _WRITE_SRC:
+			writes.add(src)
+	if 'DPTR' in reads or 'DPTR' in writes:
+		for s in (reads, writes):
+			if 'DPTR' in s:
+				s.discard('DPTR')
+				s |= set(['DPL', 'DPH'])
+
+	if mnemonic in _CARRY_IN:
+		reads.add(CARRY)
+	if mnemonic in _CARRY_OUT:
+		writes.add(CARRY)
+	if mnemonic in ('ADD', 'ADDC', 'SUBB'):
+		writes |= set(['PSW.6', 'PSW.2'])
+	reads.discard(None)
+	writes.discard(None)
+	return reads, writes
+
+
+def _iram(r):
+	return r.startswith('D') and _number('0x' + r[1:3]) is not None and int(r[1:3], 16) < 0x80
+
+
+def conflicts(a, b):
+	"""Does resource a overlap resource b."""
+	if a == b or BARRIER in (a, b):
+		return True
+	if a.startswith(b + '.') or b.startswith(a + '.'):
+		return True
+	if 'IRAM' in (a, b):
+		other = b if a == 'IRAM' else a
+		return _iram(other)
+	return False
+
+
+def _pin(r):
+	byte = r.split('.')[0]
+	return byte.startswith('D') and _number('0x' + byte[1:]) in PIN_BYTES
+
+
+class Op(object):
+	"""
+	A few instructions from one loop iteration which are kept together.
+
+	edge is 'neg' or 'pos' for the ops making the clock edges, those stay
+	fixed and the edge happens as they finish. Out of count iterations the op
+	runs in iterations first to count + last - 1, so last=1 runs it once more
+	after the last iteration (like the rotate storing the last bit read).
+
+	alone is run instead of lines outside the clocked periods, for a write
+	into a proxy byte which relies on the next clock edge to write it out.
+	"""
+
+	def __init__(self, name, lines, edge=None, first=0, last=0, symbols=None, alone=None):
+		assert edge in (None,) + SLOTS, edge
+		self.name = name
+		self.lines = list(lines)
+		self.edge = edge
+		self.first = first
+		self.last = last
+		self.alone = alone
+
+		self.cycles = 0
+		self.reads, self.writes = set(), set()
+		for l in self.lines:
+			self.cycles += l.cycles
+			r, w = effects(l, symbols)
+			self.reads |= r
+			self.writes |= w
+
+	@property
+	def pinned(self):
+		"""Ops touching a pin have to stay between the same clock edges."""
+		return any(_pin(r) for r in self.reads | self.writes)
+
+	def depends(self, other):
+		"""Does the order of self and other matter."""
+		for a in self.writes:
+			for b in other.reads | other.writes:
+				if conflicts(a, b):
+					return True
+		for a in self.reads:
+			for b in other.writes:
+				if conflicts(a, b):
+					return True
+		return False
+
+	def __repr__(self):
+		return "Op(%r, %icy)" % (self.name, self.cycles)
+
+
+class Schedule(object):
+	"""
+	Placement of every op of an iteration.
+
+	slots maps 'neg' / 'pos' to a list of (op, stage) in order; an op with
+	stage s runs for iteration i in the clock period of iteration i - s.
+	"""
+
+	def __init__(self, ops, slots):
+		self.ops = ops
+		self.slots = slots
+		self.edges = dict((o.edge, o) for o in ops if o.edge)
+
+	def gap(self, slot):
+		"""Cycles from the edge starting slot to the following edge."""
+		other = SLOTS[1 - SLOTS.index(slot)]
+		return sum(o.cycles for o, s in self.slots[slot]) + self.edges[other].cycles
+
+	@property
+	def gaps(self):
+		return tuple(self.gap(s) for s in SLOTS)
+
+	@property
+	def period(self):
+		return 2 * max(self.gaps)
+
+	def _exists(self, op, i, count):
+		return op.first <= i < count + op.last
+
+	def halves(self, period):
+		"""
+		Cycles from each edge to the next for a clock period of period
+		cycles, at least self.period. An odd cycle goes to the slot with the
+		longer gap.
+		"""
+		assert period >= self.period, (period, self.period)
+		short, long = period // 2, period - period // 2
+		neg, pos = self.gaps
+		if neg > pos:
+			return {'neg': long, 'pos': short}
+		return {'neg': short, 'pos': long}
+
+	def _block(self, b, count, pad, nop, comment, tagged=False, period=None, delay=None):
+		"""
+		The code run in the clock period of iteration b. With tagged it comes
+		as (line, iteration) pairs, the iteration being None for NOPs and
+		comments.
+
+		With period each slot is padded out to its share of it by
+		delay(cycles), by default that many NOPs.
+		"""
+		delay = delay or (lambda n: [nop] * n)
+		longest = max(self.gaps)
+		halves = self.halves(period) if period else None
+		clocked = 0 <= b < count
+		block = []
+		for slot in SLOTS:
+			length = self.gap(slot)
+			if halves:
+				length = halves[slot]
+			elif pad:
+				length = longest
+			if clocked:
+				if slot == 'neg':
+					block.append((comment("Bit %i" % b), None))
+				block.append((ir.Edge(slot, length), None))
+				block += [(l, b) for l in self.edges[slot].lines]
+			for op, stage in self.slots[slot]:
+				if self._exists(op, b + stage, count):
+					lines = op.lines if clocked or op.alone is None else op.alone
+					block += [(l, b + stage) for l in lines]
+				elif clocked:
+					block += [(nop, None)] * op.cycles
+			if clocked and length > self.gap(slot):
+				block += [(l, None) for l in delay(length - self.gap(slot))]
+		if tagged:
+			return block
+		return [l for l, i in block]
+
+	def _range(self, count):
+		placed = [(o, s) for slot in SLOTS for o, s in self.slots[slot]]
+		first = min([0] + [o.first - s for o, s in placed])
+		last = max([count - 1] + [count - 1 + o.last - s for o, s in placed])
+		return first, last
+
+	def render(self, count=8, pad=True, nop=NOP, comment=None, period=None, delay=None):
+		"""
+		Straight line code for count iterations.
+
+		Ops falling outside the first or last iteration are emitted before /
+		after the clocking; a missing op inside the clocking is replaced by
+		NOPs so every period keeps the same length. period and delay slow
+		the clock down, see _block().
+		"""
+		comment = comment or ir.Comment
+		first, last = self._range(count)
+
+		cmds = []
+		for b in range(first, last + 1):
+			block = self._block(b, count, pad, nop, comment, period=period, delay=delay)
+			if not block:
+				continue
+			if b < 0:
+				cmds.append(comment("Before"))
+			elif b >= count:
+				cmds.append(comment("After"))
+			cmds += block
+		return cmds
+
+	def entries(self, count=8, pad=True, nop=NOP, comment=None, period=None, delay=None):
+		"""
+		The code of render() split up so it can be entered at the start of
+		any iteration k, to only run iterations k to count - 1.
+
+		Returns (stubs, blocks). Running stubs[k] and then jumping into
+		blocks[k] runs iterations k onwards, the blocks in order are the
+		same code as render(). Where the ops of iteration k placed in the
+		periods before it (software pipelining) come at the very end of the
+		previous period, blocks[k] starts with them and stubs[k] is empty.
+		Otherwise stubs[k] holds a copy of them.
+
+		Only works for schedules without ops in an earlier stage or missing
+		from the first iterations, those would run in blocks[k] for
+		iterations before k.
+		"""
+		comment = comment or ir.Comment
+		placed = [(o, s) for slot in SLOTS for o, s in self.slots[slot]]
+		assert all(s >= 0 and o.first == 0 for o, s in placed), placed
+		first, last = self._range(count)
+
+		# Every line of render() as (line, iteration, period)
+		flat = []
+		starts = {}
+		for b in range(first, last + 1):
+			starts[b] = len(flat)
+			block = self._block(b, count, pad, nop, comment, tagged=True, period=period, delay=delay)
+			if block and b < 0:
+				flat.append((comment("Before"), None, b))
+			elif block and b >= count:
+				flat.append((comment("After"), None, b))
+			flat += [(l, i, b) for l, i in block]
+
+		entry = [0]
+		stubs = [[]]
+		for k in range(1, count):
+			later = [n for n, (l, i, b) in enumerate(flat[:starts[k]]) if i is not None and i >= k]
+			tail = flat[later[0]:starts[k]] if later else []
+			if tail and tail[0][2] == k - 1 and all(i is None or i >= k for l, i, b in tail):
+				entry.append(later[0])
+				stubs.append([])
+			else:
+				entry.append(starts[k])
+				stubs.append([flat[n][0] for n in later])
+
+		bounds = entry + [len(flat)]
+		blocks = [[l for l, i, b in flat[bounds[k]:bounds[k + 1]]] for k in range(count)]
+		return stubs, blocks
+
+
+def _windows(ops, stages=STAGES):
+	"""
+	Allowed (slot, stage) for each op.
+
+	A pinned op follows the same edge as in the program order, an op before
+	the first edge follows the last edge of the previous iteration.
+	"""
+	windows = {}
+	previous = None
+	for o in ops:
+		if o.edge:
+			previous = o.edge
+			continue
+		if not o.pinned:
+			windows[o] = [(slot, stage) for stage in stages for slot in SLOTS]
+		elif previous is None:
+			windows[o] = [([x.edge for x in ops if x.edge][-1], 1)]
+		else:
+			windows[o] = [(previous, 0)]
+	return windows
+
+
+def _constraints(ops, distance=2):
+	"""
+	Pairs ((a, i), (b, j)) where instance a of iteration i has to run before
+	instance b of iteration j, from the program order of ops.
+	"""
+	pairs = []
+	for d in range(0, distance + 1):
+		for ia, a in enumerate(ops):
+			for ib, b in enumerate(ops):
+				if d == 0 and ib <= ia:
+					continue
+				if a.edge and b.edge:
+					continue
+				if a.depends(b) or b.depends(a):
+					pairs.append(((a, 0), (b, d)))
+	return pairs
+
+
+def _keys(slots, edges):
+	"""Position of each op within the period it runs in."""
+	keys = {}
+	for e in edges:
+		keys[e] = (0, SLOTS.index(e.edge), -1)
+	for n, slot in enumerate(SLOTS):
+		for i, (o, stage) in enumerate(slots[slot]):
+			keys[o] = (-stage, n, i)
+	return keys
+
+
+def _legal(slots, edges, pairs):
+	keys = _keys(slots, edges)
+	for (a, i), (b, j) in pairs:
+		ka, kb = keys[a], keys[b]
+		if (ka[0] + i,) + ka[1:] >= (kb[0] + j,) + kb[1:]:
+			return False
+	return True
+
+
+def schedule(ops, count=8, stages=STAGES):
+	"""
+	Find the fastest legal placement of ops (one iteration, in program
+	order, including a 'neg' and a 'pos' edge op), with the free ops in the
+	given stages.
+	"""
+	edges = [o for o in ops if o.edge]
+	assert sorted(o.edge for o in edges) == sorted(SLOTS), edges
+	movable = [o for o in ops if not o.edge]
+	windows = _windows(ops, stages)
+	pairs = _constraints(ops)
+
+	# Rank every assignment of ops to (slot, stage) by the time it needs,
+	# then look for an order within the slots which keeps the dependencies.
+	candidates = []
+	for n, choice in enumerate(itertools.product(*(windows[o] for o in movable))):
+		slots = dict((s, []) for s in SLOTS)
+		for o, (slot, stage) in zip(movable, choice):
+			slots[slot].append((o, stage))
+		s = Schedule(ops, slots)
+		outside = sum(o.cycles for o, (slot, stage) in zip(movable, choice) if stage)
+		candidates.append(((max(s.gaps), sum(s.gaps), outside, n), slots))
+	candidates.sort(key=lambda c: c[0])
+
+	for cost, slots in candidates:
+		for order in itertools.product(*(itertools.permutations(slots[s]) for s in SLOTS)):
+			ordered = dict(zip(SLOTS, (list(x) for x in order)))
+			if _legal(ordered, edges, pairs):
+				return Schedule(ops, ordered)
+	raise ValueError("No legal schedule for %r" % (ops,))
+
+
+def sink(op, lines, nop=NOP, symbols=None):
+	"""
+	Move op, which runs just before lines, down into the first run of NOPs
+	in lines long enough to hold it. The NOPs are replaced, so the timing of
+	lines doesn't change. Only NOPs before anything op depends on (and before
+	any label or jump) are used.
+
+	Returns the new lines, or None if there is no room.
+	"""
+	run = 0
+	for i, line in enumerate(lines):
+		if line == nop:
+			run += 1
+			if run == op.cycles:
+				return lines[:i + 1 - run] + op.lines + lines[i + 1:]
+			continue
+		run = 0
+		if op.depends(Op(line, [line], symbols=symbols)):
+			return None
+	return None
+
+
+def defer(lines, cycles, symbols=None):
+	"""
+	Move the instructions just before the first clock edge in lines (the
+	first pin access after an ir.Edge) to just after it, as near to cycles
+	worth as they come. The edge comes that much earlier and the half period
+	after it gets that much longer, for code starting after a long stretch
+	of other work. Instructions touching a pin stay, the others are only
+	moved past what they don't depend on, and none from before a label.
+	"""
+	marks = [i for i, l in enumerate(lines) if isinstance(l, ir.Edge)]
+	if not marks:
+		return lines
+	mark = marks[0]
+	pinned = [i for i in range(mark + 1, len(lines)) if Op(lines[i], [lines[i]], symbols=symbols).pinned]
+	if not pinned:
+		return lines
+	edge = pinned[0]
+	passed = [Op(l, [l], symbols=symbols) for l in lines[mark:edge + 1]]
+
+	moved, total = [], 0
+	for i in reversed(range(mark)):
+		line = lines[i]
+		if line.label:
+			break
+		if line.mnemonic is None:
+			continue
+		op = Op(line, [line], symbols=symbols)
+		if (op.pinned or abs(cycles - total - op.cycles) >= abs(cycles - total)
+				or any(op.depends(p) for p in passed)):
+			# It stays, the lines before it have to get past it too
+			passed.append(op)
+			continue
+		moved.insert(0, i)
+		total += op.cycles
+	if not moved:
+		return lines
+
+	marker = lines[mark]
+	kept = [l for i, l in enumerate(lines[:edge + 1]) if i not in moved]
+	kept[mark - len(moved)] = ir.Edge(marker.slot, marker.length + total)
+	return kept + [lines[i] for i in moved] + lines[edge + 1:]
+
+
+def trim(lines, cycles, nop=NOP, symbols=None):
+	"""
+	Drop up to cycles worth of the NOPs after the last pin access in lines,
+	for code which is followed by at least that many cycles of other work.
+	"""
+	pinned = [i for i, l in enumerate(lines) if Op(l, [l], symbols=symbols).pinned]
+	last = max([-1] + pinned)
+	kept = []
+	for l in reversed(lines[last + 1:]):
+		if l == nop and cycles > 0:
+			cycles -= 1
+			continue
+		kept.insert(0, l)
+	return lines[:last + 1] + kept
+
+
+if __name__ == "__main__":
+	import mpsse
+
+	for d, read_on, write_on in mpsse.combos:
+		ops = mpsse.byte_shifter.ops(d, read_on, write_on)
+		s = schedule(ops)
+		print("%-40s %2i/%-2i %s" % (
+			mpsse.function_name(d, read_on, write_on), s.gaps[0], s.gaps[1],
+			" ".join("%s:%s%+i" % (o.name, slot, st) for slot in SLOTS for o, st in s.slots[slot])))
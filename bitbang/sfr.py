@@ -0,0 +1,36 @@
+"""
+Addresses of the FX2's special function registers and named bits (see
+fx2regs.h), for the generators and the simulator alike.
+"""
+
+# Special function registers
+SFRS = {
+	'IOA': 0x80, 'SP': 0x81, 'DPL': 0x82, 'DPH': 0x83, 'DPL1': 0x84,
+	'DPH1': 0x85, 'DPS': 0x86, 'PCON': 0x87, 'TCON': 0x88, 'TMOD': 0x89,
+	'TL0': 0x8A, 'TL1': 0x8B, 'TH0': 0x8C, 'TH1': 0x8D, 'CKCON': 0x8E,
+	'IOB': 0x90, 'EXIF': 0x91, 'MPAGE': 0x92, 'SCON0': 0x98,
+	'SBUF0': 0x99, 'AUTOPTRH1': 0x9A, 'AUTOPTRL1': 0x9B,
+	'AUTOPTRH2': 0x9D, 'AUTOPTRL2': 0x9E, 'IOC': 0xA0, 'INT2CLR': 0xA1,
+	'INT4CLR': 0xA2, 'IE': 0xA8, 'EP2468STAT': 0xAA, 'EP24FIFOFLGS': 0xAB,
+	'EP68FIFOFLGS': 0xAC, 'AUTOPTRSETUP': 0xAF, 'IOD': 0xB0, 'IOE': 0xB1,
+	'OEA': 0xB2, 'OEB': 0xB3, 'OEC': 0xB4, 'OED': 0xB5, 'OEE': 0xB6,
+	'IP': 0xB8, 'EP01STAT': 0xBA, 'GPIFTRIG': 0xBB, 'SCON1': 0xC0,
+	'SBUF1': 0xC1, 'T2CON': 0xC8, 'PSW': 0xD0, 'EICON': 0xD8, 'ACC': 0xE0,
+	'EIE': 0xE8, 'B': 0xF0, 'EIP': 0xF8,
+}
+
+# Named bits in the bit addressable SFRs
+BITS = {
+	'CY': 0xD7, 'AC': 0xD6, 'F0': 0xD5, 'OV': 0xD2,
+	'RI': 0x98, 'TI': 0x99, 'RB8': 0x9A, 'TB8': 0x9B, 'REN': 0x9C,
+	'SM2': 0x9D, 'SM1': 0x9E, 'SM0': 0x9F,
+	'RI_0': 0x98, 'TI_0': 0x99, 'REN_0': 0x9C, 'SM2_0': 0x9D,
+	'SM1_0': 0x9E, 'SM0_0': 0x9F,
+}
+for _port, _addr in (('A', 0x80), ('B', 0x90), ('C', 0xA0), ('D', 0xB0)):
+	for _i in range(8):
+		BITS['P%s%i' % (_port, _i)] = _addr + _i
+
+# The IO port and output enable registers by port
+PORTS = {'A': 0x80, 'B': 0x90, 'C': 0xA0, 'D': 0xB0, 'E': 0xB1}
+OES = {'A': 0xB2, 'B': 0xB3, 'C': 0xB4, 'D': 0xB5, 'E': 0xB6}
@@ -0,0 +1,1872 @@
+"""
+Cycle accurate simulator for the FX2's 8051 core.
+
+Runs the inline assembly emitted by the generators (or a plain .asm listing)
+using the cycle counts from cycles.md and records when every IO pin is
+written, so the real bit rate and clock duty cycle of a generated function
+can be measured rather than read off the comments.
+
+Cycles are instruction cycles (4 CPU clocks on the FX2). Reads and writes
+happen on the last cycle of an instruction.
+"""
+
+import re
+import sys
+from collections import namedtuple
+
+import cycles
+import ir
+import pins
+from sfr import SFRS, BITS, PORTS, OES
+
+
+# The autopointer data registers in xdata, reading / writing them goes
+# through AUTOPTR1 / AUTOPTR2 when AUTOPTRSETUP.APTREN is set.
+XAUTODAT = {0xE67B: 1, 0xE67C: 2}
+
+PORT_ADDRS = dict((v, k) for k, v in PORTS.items())
+OE_ADDRS = dict((v, k) for k, v in OES.items())
+
+ACC = SFRS['ACC']
+PSW = SFRS['PSW']
+B = SFRS['B']
+
+
+Event = namedtuple('Event', ['cycle', 'pin', 'value', 'changed'])
+Event.__doc__ = """A write to an IO pin; value is the level seen on the pin afterwards."""
+
+
+class SimulationError(Exception):
+	pass
+
+
+_LABEL = re.compile(r'^\s*([A-Za-z0-9_$.]+)\s*::?(.*)$')
+_EQUATE = re.compile(r'^([A-Za-z_][\w$]*)\s*==?\s*(\S+)$')
+_C_FUNCTION = re.compile(r'^\s*[A-Za-z_][\w\s\*]*?\b([A-Za-z_]\w*)\s*\([^;]*\)[^;]*\{\s*$')
+_C_RETURN = re.compile(r'^\s*return\b[^;]*;')
+_ASM_BLOCK_START = re.compile(r'\b__asm\b(?!__)')
+_LOCAL_LABEL = re.compile(r'(?<![\w$])\d+\$')
+_ASM_BLOCK_END = re.compile(r'\b__endasm\b')
+
+
+Statement = namedtuple('Statement', ['instruction', 'operands', 'text', 'address'])
+
+
+class Program(object):
+	"""A list of parsed instructions plus the labels pointing into it."""
+
+	def __init__(self):
+		self.statements = []
+		self.labels = {}
+		self.addresses = {}
+		self.size = 0
+		self.scope = ''
+		# name = value lines of a listing, the Simulator's symbols to start with
+		self.equates = {}
+
+	def label(self, name):
+		# Local labels (nnnnn$) only mean something up to the next normal label
+		if _LOCAL_LABEL.match(name):
+			name = self.scope + name
+		else:
+			self.scope = name
+		self.labels[name] = len(self.statements)
+		self.addresses[name] = self.size
+
+	def add(self, text):
+		text = _LOCAL_LABEL.sub(lambda m: self.scope + m.group(0), text)
+		parsed = cycles.parse_line(text)
+		instruction, operands = parsed
+		s = Statement(instruction, tuple(o.strip() for o in operands), text, self.size)
+		self.statements.append(s)
+		self.size += instruction.size
+		return s
+
+	def add_asm(self, text):
+		"""Add a line of assembler, which may hold a label and a comment."""
+		text = text.split(';', 1)[0].strip()
+		while text:
+			m = _LABEL.match(text)
+			if not m:
+				break
+			self.label(m.group(1))
+			text = m.group(2).strip()
+		if not text or text.startswith('.'):
+			return
+		m = _EQUATE.match(text)
+		if m:
+			self.equates[m.group(1)] = int(m.group(2), 0)
+			return
+		self.add(text)
+
+	@classmethod
+	def from_asm(cls, s):
+		"""Load a plain assembler listing."""
+		p = cls()
+		for line in s.splitlines():
+			p.add_asm(line)
+		return p
+
+	@classmethod
+	def from_c(cls, s):
+		"""
+		Load the assembler out of generated C.
+
+		Picks up __asm__("...") statements and __asm ... __endasm blocks. A
+		function definition becomes a label (with sdcc's leading underscore)
+		and a C "return" becomes a ret.
+		"""
+		if not isinstance(s, str):
+			s = ir.render_c(s)
+
+		p = cls()
+		in_block = False
+		for line in s.splitlines():
+			if in_block:
+				if _ASM_BLOCK_END.search(line):
+					in_block = False
+					line = _ASM_BLOCK_END.split(line)[0]
+				p.add_asm(line)
+				continue
+			if '__asm__' in line:
+				p.add_asm(cycles.asm_text(line))
+				continue
+			if _ASM_BLOCK_START.search(line):
+				in_block = True
+				p.add_asm(_ASM_BLOCK_START.split(line, 1)[1])
+				continue
+			m = _C_FUNCTION.match(line)
+			if m:
+				p.label('_' + m.group(1))
+				continue
+			if _C_RETURN.match(line):
+				p.add('ret')
+		return p
+
+
+def pin_key(pin):
+	if isinstance(pin, pins.Pin):
+		return (pin.port, pin.index)
+	return pin
+
+
+class Simulator(object):
+	"""
+	Simulates the subset of the FX2 needed by the bit banging code.
+
+	IO pins follow the FX2 rules: a pin with its OEx bit set shows the IOx
+	latch, otherwise the value from the input function for that pin (see
+	drive()) or default_input. Read-modify-write instructions read the latch
+	rather than the pin, like the real core.
+	"""
+
+	def __init__(self, program, symbols=None, default_input=1):
+		if isinstance(program, str) or isinstance(program, (list, tuple)):
+			program = Program.from_c(program)
+		self.program = program
+		self.symbols = dict(program.equates)
+		self.symbols.update(symbols or {})
+		self.default_input = default_input
+
+		self.iram = bytearray(256)
+		self.sfr = bytearray(128)
+		self.xdata = bytearray(0x10000)
+		self.code = {}
+
+		self.inputs = {}
+		self.events = []
+		self.recorded = {}
+		self.registers = {}
+		self.sfr_registers = {}
+		self.cycle = 0
+		self.pc = 0
+		self.depth = 0
+		self.executed = 0
+
+		self.sfr[SFRS['SP'] - 0x80] = 0x7F
+
+	# Symbols -----------------------------------------------------------
+	def address(self, name):
+		"""Resolve a direct byte address, including (name + n)."""
+		name = name.strip()
+		if name in self.symbols:
+			return self.symbols[name]
+		if name.startswith('(') and name.endswith(')'):
+			return self.address(name[1:-1])
+		if '+' in name:
+			base, offset = name.rsplit('+', 1)
+			return self.address(base) + self.address(offset)
+		n = self._number(name)
+		if n is not None:
+			return n
+		if name in self.program.addresses:
+			return self.program.addresses[name]
+		bare = name.lstrip('_').upper()
+		if bare in SFRS:
+			return SFRS[bare]
+		if re.match(r'^AR[0-7]$', bare):
+			return int(bare[2])
+		raise SimulationError("Unknown symbol %r" % name)
+
+	def bit_address(self, name):
+		"""Resolve a bit address, including the byte.bit form."""
+		name = name.strip()
+		if name in self.symbols:
+			return self.symbols[name]
+		n = self._number(name)
+		if n is not None:
+			return n
+		bare = name.lstrip('_').upper()
+		if bare in BITS:
+			return BITS[bare]
+		if '.' in name:
+			byte, bit = name.rsplit('.', 1)
+			addr = self.address(byte)
+			bit = int(bit, 0)
+			if 0x20 <= addr < 0x30:
+				return (addr - 0x20) * 8 + bit
+			if addr >= 0x80 and addr % 8 == 0:
+				return addr + bit
+			raise SimulationError("%r is not bit addressable" % byte)
+		raise SimulationError("Unknown bit %r" % name)
+
+	def _number(self, s):
+		try:
+			return int(s, 0)
+		except ValueError:
+			pass
+		if s.lower().endswith('h'):
+			try:
+				return int(s[:-1], 16)
+			except ValueError:
+				pass
+		return None
+
+	def immediate(self, s):
+		s = s.strip()
+		assert s.startswith('#'), s
+		s = s[1:].strip()
+		if s.startswith('(') and s.endswith(')'):
+			s = s[1:-1].strip()
+		if s.startswith('<'):
+			return self.immediate('#' + s[1:]) & 0xff
+		if s.startswith('>'):
+			return (self.immediate('#' + s[1:]) >> 8) & 0xff
+		if s.startswith('~'):
+			return ~self.immediate('#' + s[1:]) & 0xff
+		n = self._number(s)
+		if n is not None:
+			return n
+		if s in self.program.addresses:
+			return self.program.addresses[s]
+		return self.address(s)
+
+	# Pins --------------------------------------------------------------
+	def drive(self, pin, fn):
+		"""Drive an input pin; fn(sim) returns the level at sim.cycle."""
+		self.inputs[pin_key(pin)] = fn
+
+	def pin_level(self, pin):
+		port, index = pin_key(pin)
+		mask = 1 << index
+		if self.sfr[OES[port] - 0x80] & mask:
+			return int(bool(self.sfr[PORTS[port] - 0x80] & mask))
+		fn = self.inputs.get((port, index))
+		if fn is None:
+			return self.default_input
+		return int(bool(fn(self)))
+
+	def _port_pins(self, port):
+		value = 0
+		for i in range(8):
+			if self.pin_level((port, i)):
+				value |= 1 << i
+		return value
+
+	def _record(self, port, old_levels):
+		# An input can change between writes (like a stretched i2c clock
+		# being let go), catch the events up with it first
+		for i in range(8):
+			last = self.recorded.get((port, i), old_levels[i])
+			if last != old_levels[i]:
+				self.events.append(Event(self.cycle, (port, i), old_levels[i], True))
+		for i in range(8):
+			level = self.pin_level((port, i))
+			self.events.append(Event(self.cycle, (port, i), level, level != old_levels[i]))
+			self.recorded[(port, i)] = level
+
+	def _levels(self, port):
+		return [self.pin_level((port, i)) for i in range(8)]
+
+	# Memory ------------------------------------------------------------
+	def read_direct(self, addr, latch=False):
+		if addr < 0x80:
+			return self.iram[addr]
+		if addr in PORT_ADDRS and not latch:
+			return self._port_pins(PORT_ADDRS[addr])
+		if addr in self.sfr_registers:
+			return self.sfr_registers[addr].read(self, addr) & 0xff
+		return self.sfr[addr - 0x80]
+
+	def write_direct(self, addr, value):
+		value &= 0xff
+		if addr < 0x80:
+			self.iram[addr] = value
+			return
+		port = PORT_ADDRS.get(addr) or OE_ADDRS.get(addr)
+		if port:
+			old = self._levels(port)
+			self.sfr[addr - 0x80] = value
+			self._record(port, old)
+			return
+		if addr in self.sfr_registers:
+			self.sfr_registers[addr].write(self, addr, value)
+			return
+		self.sfr[addr - 0x80] = value
+
+	def read_bit(self, bit, latch=False):
+		if bit < 0x80:
+			return (self.iram[0x20 + bit // 8] >> (bit % 8)) & 1
+		return (self.read_direct(bit & 0xF8, latch) >> (bit % 8)) & 1
+
+	def write_bit(self, bit, value):
+		if bit < 0x80:
+			addr = 0x20 + bit // 8
+		else:
+			addr = bit & 0xF8
+		old = self.read_direct(addr, latch=True)
+		mask = 1 << (bit % 8)
+		self.write_direct(addr, (old | mask) if value else (old & ~mask))
+
+	def _autopointer(self, addr):
+		"""
+		The address an access to XAUTODAT1 / XAUTODAT2 really goes to, moving
+		on the autopointer. Other addresses are returned as they are.
+		"""
+		addr &= 0xffff
+		n = XAUTODAT.get(addr)
+		setup = self.sfr[SFRS['AUTOPTRSETUP'] - 0x80]
+		if n is None or not setup & 0x01:
+			return addr
+		high = SFRS['AUTOPTRH%i' % n] - 0x80
+		low = SFRS['AUTOPTRL%i' % n] - 0x80
+		pointer = self.sfr[high] << 8 | self.sfr[low]
+		if setup & (1 << n):
+			self.sfr[high] = ((pointer + 1) >> 8) & 0xff
+			self.sfr[low] = (pointer + 1) & 0xff
+		return pointer
+
+	def read_xdata(self, addr):
+		addr = self._autopointer(addr)
+		if addr in self.registers:
+			return self.registers[addr].read(self, addr) & 0xff
+		return self.xdata[addr]
+
+	def write_xdata(self, addr, value):
+		addr = self._autopointer(addr)
+		if addr in self.registers:
+			self.registers[addr].write(self, addr, value & 0xff)
+			return
+		self.xdata[addr] = value & 0xff
+
+	def map_registers(self, device, addrs):
+		"""Send reads / writes of the xdata addrs to device.read() / write()."""
+		for addr in addrs:
+			self.registers[addr] = device
+
+	def map_sfrs(self, device, addrs):
+		"""Send reads / writes of the SFRs at addrs to device.read() / write()."""
+		for addr in addrs:
+			self.sfr_registers[addr] = device
+
+	# Registers ---------------------------------------------------------
+	@property
+	def a(self):
+		return self.sfr[ACC - 0x80]
+
+	@a.setter
+	def a(self, value):
+		self.sfr[ACC - 0x80] = value & 0xff
+
+	@property
+	def b(self):
+		return self.sfr[B - 0x80]
+
+	@b.setter
+	def b(self, value):
+		self.sfr[B - 0x80] = value & 0xff
+
+	@property
+	def c(self):
+		return self.sfr[PSW - 0x80] >> 7
+
+	@c.setter
+	def c(self, value):
+		if value:
+			self.sfr[PSW - 0x80] |= 0x80
+		else:
+			self.sfr[PSW - 0x80] &= 0x7f
+
+	@property
+	def dptr(self):
+		return self.sfr[SFRS['DPH'] - 0x80] << 8 | self.sfr[SFRS['DPL'] - 0x80]
+
+	@dptr.setter
+	def dptr(self, value):
+		self.sfr[SFRS['DPH'] - 0x80] = (value >> 8) & 0xff
+		self.sfr[SFRS['DPL'] - 0x80] = value & 0xff
+
+	@property
+	def sp(self):
+		return self.sfr[SFRS['SP'] - 0x80]
+
+	@sp.setter
+	def sp(self, value):
+		self.sfr[SFRS['SP'] - 0x80] = value & 0xff
+
+	def r(self, n):
+		bank = (self.sfr[PSW - 0x80] >> 3) & 0x3
+		return bank * 8 + n
+
+	# Operands ----------------------------------------------------------
+	def _reg(self, s):
+		return self.r(int(s.strip()[-1]))
+
+	def read(self, kind, s, latch=False):
+		A = cycles.ArgType
+		if kind == A.accumulator:
+			return self.a
+		elif kind == A.b:
+			return self.b
+		elif kind == A.register:
+			return self.iram[self._reg(s)]
+		elif kind == A.carry:
+			return self.c
+		elif kind == A.direct_byte:
+			return self.read_direct(self.address(s), latch)
+		elif kind == A.indirect_byte:
+			return self.iram[self.iram[self._reg(s)]]
+		elif kind == A.direct_bit:
+			return self.read_bit(self.bit_address(s), latch)
+		elif kind == A.inverse_direct_bit:
+			return 1 - self.read_bit(self.bit_address(s[1:]), latch)
+		elif kind in (A.immediate_byte, A.immediate_word):
+			return self.immediate(s)
+		elif kind == A.data_pointer:
+			return self.dptr
+		elif kind == A.indirect_data_pointer:
+			return self.read_xdata(self.dptr)
+		raise SimulationError("Can't read %s (%s)" % (s, kind))
+
+	def write(self, kind, s, value):
+		A = cycles.ArgType
+		if kind == A.accumulator:
+			self.a = value
+		elif kind == A.b:
+			self.b = value
+		elif kind == A.register:
+			self.iram[self._reg(s)] = value & 0xff
+		elif kind == A.carry:
+			self.c = value
+		elif kind == A.direct_byte:
+			self.write_direct(self.address(s), value)
+		elif kind == A.indirect_byte:
+			self.iram[self.iram[self._reg(s)]] = value & 0xff
+		elif kind == A.direct_bit:
+			self.write_bit(self.bit_address(s), value)
+		elif kind == A.data_pointer:
+			self.dptr = value
+		elif kind == A.indirect_data_pointer:
+			self.write_xdata(self.dptr, value)
+		else:
+			raise SimulationError("Can't write %s (%s)" % (s, kind))
+
+	def _xaddr(self, s):
+		"""Address for MOVX @Ri / @DPTR, MPAGE supplies the high byte for @Ri."""
+		if s.strip().lower() == '@dptr':
+			return self.dptr
+		return self.sfr[SFRS['MPAGE'] - 0x80] << 8 | self.iram[self._reg(s)]
+
+	def target(self, name):
+		name = name.strip()
+		if name.startswith('.'):
+			# Relative to the instruction itself, pc has already moved on
+			here = self.program.statements[self.pc - 1].address
+			return self._at(here + int(name[1:] or 0))
+		if name in self.program.labels:
+			return self.program.labels[name]
+		raise SimulationError("Unknown label %r" % name)
+
+	def _at(self, address):
+		for i, s in enumerate(self.program.statements):
+			if s.address == address:
+				return i
+		raise SimulationError("No instruction at address %#x" % address)
+
+	def _push(self, value):
+		self.sp += 1
+		self.iram[self.sp] = value & 0xff
+
+	def _pop(self):
+		v = self.iram[self.sp]
+		self.sp -= 1
+		return v
+
+	# Execution ---------------------------------------------------------
+	def call(self, label):
+		"""Run from label until its matching ret."""
+		return self.run(label)
+
+	def run(self, entry=None, max_cycles=1000000):
+		if entry is not None:
+			self.pc = self.target(entry)
+		self.depth = 0
+		start = self.cycle
+		while self.pc < len(self.program.statements):
+			if self.cycle - start > max_cycles:
+				raise SimulationError("Ran for more than %i cycles" % max_cycles)
+			if not self.step():
+				break
+		return self.cycle - start
+
+	def step(self):
+		"""Execute one instruction, returns False once the outermost ret runs."""
+		s = self.program.statements[self.pc]
+		self.pc += 1
+		self.cycle += s.instruction.cycles
+		self.executed += 1
+		return self._execute(s)
+
+	def _execute(self, s):
+		A = cycles.ArgType
+		i = s.instruction
+		op = i.mneomic
+		args = i.args
+		ops = s.operands
+		kinds = list(args)
+
+		def rd(n, latch=False):
+			return self.read(kinds[n], ops[n], latch)
+
+		def wr(n, value):
+			self.write(kinds[n], ops[n], value)
+
+		def jump(name):
+			self.pc = self.target(name)
+
+		# Read-modify-write instructions see the port latch
+		rmw = op in ('ANL', 'ORL', 'XRL', 'INC', 'DEC', 'CPL', 'CLR', 'SETB', 'DJNZ', 'JBC') or (
+			op == 'MOV' and kinds and kinds[0] == A.direct_bit)
+
+		if op == 'NOP':
+			pass
+		elif op in ('MOV',):
+			if kinds[0] == A.direct_bit:
+				wr(0, self.c)
+			elif kinds[0] == A.data_pointer:
+				self.dptr = self.immediate(ops[1])
+			else:
+				wr(0, rd(1))
+		elif op == 'MOVX':
+			if kinds[0] == A.accumulator:
+				self.a = self.read_xdata(self._xaddr(ops[1]))
+			else:
+				self.write_xdata(self._xaddr(ops[0]), self.a)
+		elif op == 'MOVC':
+			if args[1][1] == A.data_pointer:
+				base = self.dptr
+			elif self.pc < len(self.program.statements):
+				base = self.program.statements[self.pc].address
+			else:
+				base = self.program.size
+			addr = (base + self.a) & 0xffff
+			if addr not in self.code:
+				raise SimulationError("No code byte at %#x" % addr)
+			self.a = self.code[addr]
+		elif op in ('ANL', 'ORL', 'XRL'):
+			if kinds[0] == A.carry:
+				b = rd(1)
+				if op == 'ANL':
+					self.c = self.c & b
+				else:
+					self.c = self.c | b
+			else:
+				a, b = rd(0, rmw), rd(1)
+				wr(0, {'ANL': a & b, 'ORL': a | b, 'XRL': a ^ b}[op])
+		elif op in ('ADD', 'ADDC', 'SUBB'):
+			a, b = self.a, rd(1)
+			c = self.c if op != 'ADD' else 0
+			if op == 'SUBB':
+				r = a - b - c
+				self.c = r < 0
+				ov = ((a ^ b) & (a ^ r) & 0x80) != 0
+				ac = ((a & 0xf) - (b & 0xf) - c) < 0
+			else:
+				r = a + b + c
+				self.c = r > 0xff
+				ov = (~(a ^ b) & (a ^ r) & 0x80) != 0
+				ac = ((a & 0xf) + (b & 0xf) + c) > 0xf
+			self._flags(ov=ov, ac=ac)
+			self.a = r
+		elif op in ('INC', 'DEC'):
+			if kinds[0] == A.data_pointer:
+				self.dptr = (self.dptr + 1) & 0xffff
+			else:
+				wr(0, rd(0, rmw) + (1 if op == 'INC' else -1))
+		elif op == 'MUL':
+			r = self.a * self.b
+			self.a, self.b = r & 0xff, r >> 8
+			self.c = 0
+			self._flags(ov=r > 0xff)
+		elif op == 'DIV':
+			if self.b == 0:
+				self._flags(ov=True)
+			else:
+				self.a, self.b = divmod(self.a, self.b)
+				self._flags(ov=False)
+			self.c = 0
+		elif op == 'DA':
+			a = self.a
+			if (a & 0xf) > 9 or (self.sfr[PSW - 0x80] & 0x40):
+				a += 6
+			if (a >> 4) > 9 or self.c or a > 0xff:
+				a += 0x60
+			if a > 0xff:
+				self.c = 1
+			self.a = a
+		elif op in ('CLR', 'SETB', 'CPL'):
+			if kinds[0] == A.accumulator:
+				self.a = {'CLR': 0, 'CPL': ~self.a}[op]
+			else:
+				v = rd(0, rmw)
+				wr(0, {'CLR': 0, 'SETB': 1, 'CPL': 1 - v}[op])
+		elif op == 'RL':
+			self.a = (self.a << 1) | (self.a >> 7)
+		elif op == 'RR':
+			self.a = (self.a >> 1) | ((self.a & 1) << 7)
+		elif op == 'RLC':
+			a = self.a
+			self.a = (a << 1) | self.c
+			self.c = a >> 7
+		elif op == 'RRC':
+			a = self.a
+			self.a = (a >> 1) | (self.c << 7)
+			self.c = a & 1
+		elif op == 'SWAP':
+			self.a = ((self.a << 4) | (self.a >> 4))
+		elif op == 'XCH':
+			v = rd(1)
+			wr(1, self.a)
+			self.a = v
+		elif op == 'XCHD':
+			v = rd(1)
+			wr(1, (v & 0xf0) | (self.a & 0x0f))
+			self.a = (self.a & 0xf0) | (v & 0x0f)
+		elif op == 'PUSH':
+			self._push(rd(0))
+		elif op == 'POP':
+			wr(0, self._pop())
+		elif op in ('ACALL', 'LCALL'):
+			ret = self.pc
+			self._push(ret & 0xff)
+			self._push(ret >> 8)
+			self.depth += 1
+			jump(ops[0])
+		elif op in ('RET', 'RETI'):
+			if self.depth == 0:
+				return False
+			hi = self._pop()
+			lo = self._pop()
+			self.pc = hi << 8 | lo
+			self.depth -= 1
+		elif op in ('AJMP', 'LJMP', 'SJMP'):
+			jump(ops[0])
+		elif op == 'JMP':
+			self.pc = self._at((self.a + self.dptr) & 0xffff)
+		elif op in ('JC', 'JNC'):
+			if self.c == (op == 'JC'):
+				jump(ops[0])
+		elif op in ('JZ', 'JNZ'):
+			if (self.a == 0) == (op == 'JZ'):
+				jump(ops[0])
+		elif op in ('JB', 'JNB'):
+			if rd(0) == (op == 'JB'):
+				jump(ops[1])
+		elif op == 'JBC':
+			if rd(0, True):
+				wr(0, 0)
+				jump(ops[1])
+		elif op == 'CJNE':
+			a, b = rd(0), rd(1)
+			self.c = a < b
+			if a != b:
+				jump(ops[2])
+		elif op == 'DJNZ':
+			v = (rd(0, rmw) - 1) & 0xff
+			wr(0, v)
+			if v:
+				jump(ops[1])
+		else:
+			raise SimulationError("Unsupported instruction %s" % s.text)
+		return True
+
+	def _flags(self, ov=None, ac=None):
+		psw = self.sfr[PSW - 0x80]
+		if ov is not None:
+			psw = (psw | 0x04) if ov else (psw & ~0x04)
+		if ac is not None:
+			psw = (psw | 0x40) if ac else (psw & ~0x40)
+		self.sfr[PSW - 0x80] = psw & 0xff
+
+	# Results -----------------------------------------------------------
+	def transitions(self, pin):
+		"""(cycle, level) for every change of level on a pin."""
+		key = pin_key(pin)
+		return [(e.cycle, e.value) for e in self.events if e.pin == key and e.changed]
+
+	def writes(self, pin):
+		"""(cycle, level) for every write to a pin, even if it didn't change."""
+		key = pin_key(pin)
+		return [(e.cycle, e.value) for e in self.events if e.pin == key]
+
+	def level_before(self, pin, cycle, initial=None):
+		"""Level of a pin just before the given cycle."""
+		level = initial
+		for c, v in self.writes(pin):
+			if c >= cycle:
+				break
+			level = v
+		return level
+
+
+def serial_source(clk, bits, edge=1):
+	"""
+	Input function for a device shifting out bits to be sampled on `edge`.
+
+	The device starts with bits[0] on its output and moves to the next bit on
+	each opposite clk edge that follows a sampling edge.
+	"""
+	def fn(sim):
+		samples = 0
+		n = 0
+		for c, v in sim.transitions(clk):
+			if c > sim.cycle:
+				break
+			if v == edge:
+				samples += 1
+			else:
+				n = samples
+		return bits[min(n, len(bits) - 1)]
+	return fn
+
+
+def echo(pin, delay, initial=1):
+	"""Input function for a device echoing pin delay cycles later, like RTCK."""
+	def fn(sim):
+		return sim.level_before(pin, sim.cycle - delay + 1, initial)
+	return fn
+
+
+class I2CDevice(object):
+	"""
+	An i2c target at address, for driving the SCL / SDA inputs of an open
+	drain i2c master (see drive(), scl() and sda()). It ACKs its address and
+	every byte written to it, sends data (round and round) when read and
+	holds SCL low for stretch cycles after the clock of every ACK.
+
+	Each time a line is looked at the bus is decoded from the transitions
+	so far, so the device answers a clock edge from the next event on.
+	"""
+
+	def __init__(self, scl, sda, address, data=(0,), stretch=0):
+		self.scl_pin = pin_key(scl)
+		self.sda_pin = pin_key(sda)
+		self.address = address
+		self.data = data
+		self.stretch = stretch
+
+	def decode(self, sim):
+		"""
+		(transfers, sda, hold): transfers is [address, read, [[byte, acked],
+		...]] for each start so far, sda what the device drives and SCL is
+		held low until cycle hold.
+		"""
+		transfers = []
+		scl = sda = 1
+		state = None
+		out = 1
+		hold = bits = byte = sent = 0
+		for e in sim.events:
+			if not e.changed or e.pin not in (self.scl_pin, self.sda_pin):
+				continue
+			if e.pin == self.sda_pin:
+				if scl and not e.value:
+					state, bits, byte, out = 'address', 0, 0, 1
+				elif scl:
+					state, out = None, 1
+				sda = e.value
+				continue
+
+			scl = e.value
+			if scl:
+				if state in ('address', 'write'):
+					byte = byte << 1 | sda
+					bits += 1
+				elif state == 'acked':
+					transfers[-1][2][-1][1] = not sda
+				continue
+
+			if state in ('address', 'write') and bits == 8:
+				if state == 'address':
+					transfers.append([byte >> 1, byte & 1, []])
+					if byte >> 1 != self.address:
+						state = None
+						continue
+				else:
+					transfers[-1][2].append([byte, True])
+				state, out = ('ack', 0) if state == 'write' else ('ack_address', 0)
+			elif state in ('ack', 'ack_address') or (state == 'acked' and transfers[-1][2][-1][1]):
+				hold = e.cycle + self.stretch
+				if state == 'ack_address' and transfers[-1][1] or state == 'acked':
+					byte = self.data[sent % len(self.data)]
+					sent += 1
+					transfers[-1][2].append([byte, None])
+					state, bits, out = 'read', 0, byte >> 7
+				else:
+					state, bits, byte, out = 'write', 0, 0, 1
+			elif state == 'read':
+				bits += 1
+				state, out = ('acked', 1) if bits == 8 else ('read', byte >> (7 - bits) & 1)
+			elif state == 'acked':
+				state, out = None, 1
+		return transfers, out, hold
+
+	def scl(self, sim):
+		return int(sim.cycle >= self.decode(sim)[2])
+
+	def sda(self, sim):
+		return self.decode(sim)[1]
+
+	def attach(self, sim):
+		sim.drive(self.scl_pin, self.scl)
+		sim.drive(self.sda_pin, self.sda)
+
+
+class I2CController(object):
+	"""
+	The FX2's i2c controller (I2CS, I2DAT and I2CTL in xdata) with a
+	target at address on its bus, which ACKs like I2CDevice and sends data
+	(round and round) when read. Each byte takes 9 clocks at the rate set
+	in I2CTL (a start one more) with the CPU at speed. transfers is in the
+	same form as from I2CDevice.decode().
+
+	With bus_error I2CS always has BERR set, with stuck (SCL held low) DONE
+	never comes and a STOP never finishes.
+	"""
+
+	I2CS, I2DAT, I2CTL = 0xE678, 0xE679, 0xE67A
+
+	START, STOP, LASTRD, BERR, ACK, DONE = 0x80, 0x40, 0x20, 0x04, 0x02, 0x01
+
+	def __init__(self, address, data=(0,), speed=cycles.CPUSpeed.MHz48, bus_error=False, stuck=False):
+		self.address = address
+		self.data = data
+		self.speed = speed
+		self.bus_error = bus_error
+		self.stuck = stuck
+		self.transfers = []
+		self.control = 0
+		self.requested = 0
+		self.value = 0xFF
+		self.busy_until = 0
+		self.stop_until = 0
+		self.done = False
+		self.ack = False
+		self.reading = False
+		self.sent = 0
+
+	def attach(self, sim):
+		sim.map_registers(self, (self.I2CS, self.I2DAT, self.I2CTL))
+
+	def bit_cycles(self):
+		return self.speed.cycles_per_second // (400000 if self.control & 0x01 else 100000)
+
+	def _stop(self, sim):
+		self.requested &= ~self.STOP
+		self.reading = False
+		self.stop_until = max(sim.cycle, self.busy_until) + self.bit_cycles()
+
+	def _byte(self, sim, bits=9):
+		self.done = True
+		self.busy_until = max(sim.cycle, self.busy_until, self.stop_until) + bits * self.bit_cycles()
+
+	def read(self, sim, addr):
+		if addr == self.I2CS:
+			status = self.requested
+			if sim.cycle < self.stop_until:
+				status |= self.STOP
+			if self.done and sim.cycle >= self.busy_until:
+				status |= self.DONE
+			if self.ack:
+				status |= self.ACK
+			if self.bus_error:
+				status |= self.BERR
+			if self.stuck:
+				status = status & ~self.DONE | self.STOP
+			return status
+		if addr == self.I2CTL:
+			return self.control
+
+		value = self.value
+		self.done = False
+		if self.reading and self.requested & self.STOP:
+			self._stop(sim)
+		elif self.reading:
+			# Reading I2DAT clocks in the next byte
+			self.value = self.data[self.sent % len(self.data)]
+			self.sent += 1
+			self.transfers[-1][2].append([self.value, not self.requested & self.LASTRD])
+			self.requested &= ~self.LASTRD
+			self._byte(sim)
+		return value
+
+	def write(self, sim, addr, value):
+		if addr == self.I2CTL:
+			self.control = value
+		elif addr == self.I2CS:
+			self.requested |= value & (self.START | self.STOP | self.LASTRD)
+			if self.requested & self.STOP and not self.reading:
+				self._stop(sim)
+		elif self.requested & self.START:
+			self.requested &= ~self.START
+			self.transfers.append([value >> 1, value & 1, []])
+			self.ack = value >> 1 == self.address
+			self.reading = self.ack and bool(value & 1)
+			self._byte(sim, 10)
+		else:
+			self.transfers[-1][2].append([value, self.ack])
+			self._byte(sim)
+
+
+class USART0(object):
+	"""
+	USART0 in mode 0 (SCON0 / SBUF0). Bytes written to SBUF0 are put in
+	sent, a reception started by writing REN with RI clear gets the next of
+	data (round and round) and puts it in received. TI / RI are set 8 bits
+	after the write, a bit being a cycle with SCON0.SM2 set (CLKOUT/4) and 3
+	cycles without.
+	"""
+
+	SCON0, SBUF0 = 0x98, 0x99
+
+	# SCON0 bits
+	RI, TI, REN, SM2 = 0x01, 0x02, 0x10, 0x20
+
+	def __init__(self, data=(0,)):
+		self.data = data
+		self.sent = []
+		self.received = []
+		self.control = 0
+		self.value = 0
+		self.ti_at = None
+		self.ri_at = None
+
+	def attach(self, sim):
+		sim.map_sfrs(self, (self.SCON0, self.SBUF0))
+
+	def byte_cycles(self):
+		return 8 * (1 if self.control & self.SM2 else 3)
+
+	@staticmethod
+	def _flag(sim, at, value):
+		"""When the flag is set after writing value to it."""
+		if value:
+			return sim.cycle if at is None or at > sim.cycle else at
+		if at is not None and at <= sim.cycle:
+			return None
+		# A byte still shifting sets it later
+		return at
+
+	def read(self, sim, addr):
+		if addr == self.SBUF0:
+			return self.value
+		value = self.control
+		if self.ti_at is not None and sim.cycle >= self.ti_at:
+			value |= self.TI
+		if self.ri_at is not None and sim.cycle >= self.ri_at:
+			value |= self.RI
+		return value
+
+	def write(self, sim, addr, value):
+		if addr == self.SBUF0:
+			self.sent.append(value)
+			self.ti_at = sim.cycle + self.byte_cycles()
+			return
+		if value & 0xC0:
+			raise SimulationError("USART0 is only modelled in mode 0")
+		self.control = value & ~(self.TI | self.RI)
+		self.ti_at = self._flag(sim, self.ti_at, value & self.TI)
+		self.ri_at = self._flag(sim, self.ri_at, value & self.RI)
+		if self.control & self.REN and self.ri_at is None:
+			self.value = self.data[len(self.received) % len(self.data)]
+			self.received.append(self.value)
+			self.ri_at = sim.cycle + self.byte_cycles()
+
+
+def byte_bits(value, msb_first=True, count=8):
+	bits = [(value >> i) & 1 for i in range(count)]
+	if msb_first:
+		bits = [(value >> (7 - i)) & 1 for i in range(count)]
+	return bits
+
+
+def clock_stats(sim, clk):
+	"""
+	Period and duty cycle figures for a clock pin.
+
+	Periods are measured rising edge to rising edge, high / low times from
+	each edge to the following one.
+	"""
+	t = sim.transitions(clk)
+	high = [b[0] - a[0] for a, b in zip(t, t[1:]) if a[1] == 1]
+	low = [b[0] - a[0] for a, b in zip(t, t[1:]) if a[1] == 0]
+	rising = [c for c, v in t if v == 1]
+	periods = [b - a for a, b in zip(rising, rising[1:])]
+	stats = {
+		'edges': len(t),
+		'pulses': len(rising),
+		'high': high,
+		'low': low,
+		'periods': periods,
+	}
+	if periods:
+		stats['period_min'] = min(periods)
+		stats['period_max'] = max(periods)
+		stats['period_mean'] = sum(periods) / len(periods)
+	if high and low:
+		high_mean = sum(high) / len(high)
+		low_mean = sum(low) / len(low)
+		stats['duty'] = high_mean / (high_mean + low_mean)
+	return stats
+
+
+def sampled(sim, clk, data, edge):
+	"""Level of data at every clk edge to `edge`, ie what a device would sample."""
+	return [sim.level_before(data, c) for c, v in sim.transitions(clk) if v == edge]
+
+
+def run_shifter(body, clk, din=None, dout=None, data=0, read_data=0,
+		msb_first=True, read_edge=1, symbols=None, setup=None, count=8, listing=False):
+	"""
+	Run a generated shift byte body.
+
+	The clock and data out pins start as outputs and A holds `data`.
+	din is driven with read_data by a device which expects to be sampled on
+	read_edge (see serial_source). With listing the body goes through
+	ir.render_asm() first. Returns the simulator.
+	"""
+	if listing:
+		program = Program.from_asm(ir.render_asm(body))
+	else:
+		program = Program.from_c(body)
+	sim = Simulator(program, symbols=symbols)
+	clk = pin_key(clk)
+	for p in (clk, pin_key(dout) if dout else None):
+		if p:
+			sim.sfr[OES[p[0]] - 0x80] |= 1 << p[1]
+	sim.sfr[PORTS[clk[0]] - 0x80] |= 1 << clk[1]
+	sim.a = data
+	if din is not None:
+		sim.drive(din, serial_source(clk, byte_bits(read_data, msb_first, count), read_edge))
+	if setup:
+		setup(sim)
+	sim.run()
+	return sim
+
+
+def load_table(sim, name, values, addr=0x3000):
+	"""Put the __code table name (as sdcc calls it) at addr for MOVC."""
+	sim.symbols['_' + name] = addr
+	for i, value in enumerate(values):
+		sim.code[addr + i] = value
+
+
+# Where the arguments after the first go, in place of sdcc's overlay segment
+PARM_BASE = 0x30
+
+
+def c_arguments(sim, name, args):
+	"""
+	Pass 16 bit args to name() like sdcc, the first in dptr and the others in
+	_name_PARM_2, _name_PARM_3, ...
+	"""
+	sim.dptr = args[0]
+	for i, value in enumerate(args[1:]):
+		addr = PARM_BASE + 2 * i
+		sim.symbols["_%s_PARM_%i" % (name, i + 2)] = addr
+		sim.iram[addr] = value & 0xff
+		sim.iram[addr + 1] = value >> 8
+
+
+def run_bytes(source, name, clk, din=None, dout=None, data=(), read_data=(),
+		msb_first=True, read_edge=1, symbols=None, src=0x1000, dst=0x2000):
+	"""
+	Run a generated shift bytes function, name(), from the C source.
+
+	data goes in the buffer at src and the destination buffer is at dst, the
+	arguments are passed as for software.ShiftBytes.parameters(). din is
+	driven with the bits of read_data as in run_shifter. Returns the simulator.
+	"""
+	sim = Simulator(Program.from_c(source), symbols=symbols)
+	clk = pin_key(clk)
+	for p in (clk, pin_key(dout) if dout else None):
+		if p:
+			sim.sfr[OES[p[0]] - 0x80] |= 1 << p[1]
+	sim.sfr[PORTS[clk[0]] - 0x80] |= 1 << clk[1]
+
+	args = []
+	if dout is not None:
+		args.append(src)
+		sim.xdata[src:src + len(data)] = bytearray(data)
+	if din is not None:
+		args.append(dst)
+		bits = []
+		for value in read_data:
+			bits += byte_bits(value, msb_first)
+		sim.drive(din, serial_source(clk, bits, read_edge))
+	args.append(max(len(data), len(read_data)) - 1)
+	c_arguments(sim, name, args)
+	sim.run("_" + name)
+	return sim
+
+
+def run_bits(source, name, clk, count, din=None, dout=None, data=0, read_data=0,
+		msb_first=True, read_edge=1, symbols=None, outputs=()):
+	"""
+	Run a generated function shifting count bits, name(), from the C source.
+
+	The arguments are passed as for software.ShiftBits.parameters() and din
+	is driven with the first count bits of read_data as in run_shifter.
+	outputs are any other pins the function drives. Returns the simulator.
+	"""
+	sim = Simulator(Program.from_c(source), symbols=symbols)
+	clk = pin_key(clk)
+	for p in [clk, dout] + list(outputs):
+		if p:
+			p = pin_key(p)
+			sim.sfr[OES[p[0]] - 0x80] |= 1 << p[1]
+	sim.sfr[PORTS[clk[0]] - 0x80] |= 1 << clk[1]
+
+	args = []
+	if dout is not None:
+		args.append(data)
+	if din is not None:
+		sim.drive(din, serial_source(clk, byte_bits(read_data, msb_first)[:count], read_edge))
+	args.append(count - 1)
+	c_arguments(sim, name, args)
+	sim.run("_" + name)
+	return sim
+
+
+def run_clocks(source, name, clk, args=(), gpio=None, gpio_bits=(0,), symbols=None):
+	"""
+	Run a generated clock only function, name(*args), from the C source.
+	gpio reads gpio_bits[n] from the nth rising clk edge on, as in
+	serial_source. Returns the simulator.
+	"""
+	sim = Simulator(Program.from_c(source), symbols=symbols)
+	clk = pin_key(clk)
+	sim.sfr[OES[clk[0]] - 0x80] |= 1 << clk[1]
+	sim.sfr[PORTS[clk[0]] - 0x80] |= 1 << clk[1]
+	if gpio is not None:
+		sim.drive(gpio, serial_source(clk, list(gpio_bits)))
+	if args:
+		c_arguments(sim, name, list(args))
+	sim.run("_" + name)
+	return sim
+
+
+def run_i2c(source, name, device=None, args=(), symbols=None):
+	"""
+	Run the i2c function name(*args) from the C source, with both lines let
+	go (pulled up) and device on the bus. Returns the simulator.
+	"""
+	sim = Simulator(Program.from_c(source), symbols=symbols)
+	if device is not None:
+		device.attach(sim)
+	if args:
+		c_arguments(sim, name, list(args))
+	sim.run("_" + name)
+	return sim
+
+
+if __name__ == "__main__":
+	import itertools
+
+	import mpsse
+	import i2c
+	import calling
+	import software as sw
+
+	failures = []
+
+	def show(line):
+		"""Print a line of the table, remembering it if a check in it failed."""
+		print(line)
+		if "BAD" in line:
+			failures.append(line)
+
+	show("%-45s %6s %6s %6s %8s  %s" % ("function", "cycles", "period", "duty", "Mbit/s", "check"))
+	for prefix, shifter in (("", mpsse.byte_shifter), ("PortE_", mpsse.port_e_shifter)):
+		clk = shifter.clk_pin.pin
+		din = shifter.din_pin.pin
+		dout = shifter.dout_pin.pin
+		for d, read_on, write_on in mpsse.combos:
+			name = prefix + mpsse.function_name(d, read_on, write_on)
+			body = shifter.generate(d, read_on, write_on)
+			msb = d == sw.ShiftOp.FirstBit.MSB
+			read_edge = 1 if read_on == sw.ShiftOp.ClockMode.positive else 0
+
+			sim = run_shifter(body, clk, din, dout, data=0xA5, read_data=0x3C,
+				msb_first=msb, read_edge=read_edge, symbols=shifter.symbols())
+			stats = clock_stats(sim, clk)
+
+			check = []
+			if write_on != sw.ShiftOp.ClockMode.none:
+				sample_edge = 1 if write_on == sw.ShiftOp.ClockMode.negative else 0
+				bits = sampled(sim, clk, dout, sample_edge)[:8]
+				check.append("out %s" % ("ok" if bits == byte_bits(0xA5, msb) else "BAD %r" % bits))
+			if read_on != sw.ShiftOp.ClockMode.none:
+				check.append("in %s" % ("ok" if sim.a == 0x3C else "BAD %#04x" % sim.a))
+			# The same body as a plain assembler listing runs the same
+			listed = run_shifter(body, clk, din, dout, data=0xA5, read_data=0x3C,
+				msb_first=msb, read_edge=read_edge, symbols=shifter.symbols(), listing=True)
+			if (listed.cycle, listed.a, listed.transitions(clk)) != (sim.cycle, sim.a, sim.transitions(clk)):
+				check.append("listing BAD")
+
+			period = stats.get('period_mean', 0)
+			mbit = 12.0 / period if period else 0
+			show("%-45s %6i %6.1f %5.1f%% %8.3f  %s" % (
+				name, sim.cycle, period, stats.get('duty', 0) * 100, mbit, ", ".join(check)))
+
+		# Bulk transfers, 6 bytes to go through both loops of the unrolled code
+		data = [0xA5, 0x0F, 0x3C, 0x81, 0x7E, 0x55]
+		read_data = [0x3C, 0xF0, 0x5A, 0x18, 0xC3, 0xAA]
+		for (kind, auto), (d, read_on, write_on) in itertools.product(
+				(("ShiftBytes", False), ("ShiftBytesAuto", True)), mpsse.combos):
+			bulk = sw.ShiftBytes(shifter.clk_pin, shifter.din_pin, shifter.dout_pin,
+				unroll=4, autopointers=auto)
+			name = prefix + mpsse.function_name(d, read_on, write_on, kind)
+			source = calling.generate_bytes(name, read_on, write_on,
+				bulk.generate(d, read_on, write_on, name))
+			msb = d == sw.ShiftOp.FirstBit.MSB
+			reading = read_on != sw.ShiftOp.ClockMode.none
+			writing = write_on != sw.ShiftOp.ClockMode.none
+
+			sim = run_bytes(source, name, clk,
+				din=din if reading else None, dout=dout if writing else None,
+				data=data if writing else (), read_data=read_data if reading else (),
+				msb_first=msb, read_edge=1 if read_on == sw.ShiftOp.ClockMode.positive else 0,
+				symbols=bulk.symbols(), src=0x10fd, dst=0x20fe)
+			stats = clock_stats(sim, clk)
+
+			check = []
+			if writing:
+				sample_edge = 1 if write_on == sw.ShiftOp.ClockMode.negative else 0
+				bits = sampled(sim, clk, dout, sample_edge)[:8 * len(data)]
+				expected = sum((byte_bits(v, msb) for v in data), [])
+				check.append("out %s" % ("ok" if bits == expected else "BAD"))
+			if reading:
+				got = list(sim.xdata[0x20fe:0x20fe + len(read_data)])
+				check.append("in %s" % ("ok" if got == read_data else "BAD %r" % got))
+
+			bits = stats['pulses']
+			show("%-45s %6i %6.1f %5.1f%% %8.3f  %s" % (
+				name, sim.cycle, sim.cycle / float(bits), stats.get('duty', 0) * 100,
+				12.0 * bits / sim.cycle, ", ".join(check)))
+
+		# Partial bytes, every length through one function
+		bits_shifter = sw.ShiftBits(shifter.clk_pin, shifter.din_pin, shifter.dout_pin)
+		for d, read_on, write_on in mpsse.combos:
+			name = prefix + mpsse.function_name(d, read_on, write_on, "ShiftBits")
+			source = calling.generate_bits(name, read_on, write_on,
+				bits_shifter.generate(d, read_on, write_on, name))
+			msb = d == sw.ShiftOp.FirstBit.MSB
+			reading = read_on != sw.ShiftOp.ClockMode.none
+			writing = write_on != sw.ShiftOp.ClockMode.none
+
+			check = []
+			total = periods = 0
+			for count in range(1, 9):
+				sim = run_bits(source, name, clk, count,
+					din=din if reading else None, dout=dout if writing else None,
+					data=0xA5, read_data=0x3C, msb_first=msb,
+					read_edge=1 if read_on == sw.ShiftOp.ClockMode.positive else 0,
+					symbols=bits_shifter.symbols())
+				stats = clock_stats(sim, clk)
+				total += sim.cycle
+				periods = max(periods, stats.get('period_max', 0))
+				if stats['pulses'] != count:
+					check.append("%i: BAD %i pulses" % (count, stats['pulses']))
+				if writing:
+					sample_edge = 1 if write_on == sw.ShiftOp.ClockMode.negative else 0
+					bits = sampled(sim, clk, dout, sample_edge)[:count]
+					if bits != byte_bits(0xA5, msb)[:count]:
+						check.append("%i: out BAD %r" % (count, bits))
+				if reading:
+					# MSB first ends up in the bottom bits, LSB first in the top
+					got = byte_bits(sim.a, msb)[-count:]
+					if got != byte_bits(0x3C, msb)[:count]:
+						check.append("%i: in BAD %#04x" % (count, sim.a))
+
+			show("%-45s %6i %6.1f %6s %8s  %s" % (
+				name, total, periods, "", "", ", ".join(check) or "1-8 bits ok"))
+
+		# TMS, with bit 7 held on TDI
+		tms = sw.BitAccessInASM("tms", pins.Pin("A", 4), pins.PinDirection.output)
+		if prefix:
+			tms = sw.ByteAccessInASM("tms", pins.Pin("E", 4), pins.PinDirection.output)
+		tms_shifter = sw.ShiftTMS(shifter.clk_pin, shifter.din_pin, shifter.dout_pin, tms)
+		for read_on, write_on in mpsse.tms_combos:
+			name = prefix + mpsse.function_name(None, read_on, write_on, "ShiftTMS")
+			source = calling.generate_bits(name, read_on, write_on,
+				tms_shifter.generate(read_on, write_on, name))
+			reading = read_on != sw.ShiftOp.ClockMode.none
+
+			check = []
+			total = periods = 0
+			# A length of 7 (count 8) has to stop at 7 bits, bit 7 is TDI's
+			for count in range(1, 9):
+				clocked = min(count, 7)
+				for data in (0x25, 0xDA):
+					sim = run_bits(source, name, clk, count,
+						din=din if reading else None, dout=tms.pin,
+						data=data, read_data=0x3C, msb_first=False,
+						read_edge=1 if read_on == sw.ShiftOp.ClockMode.positive else 0,
+						symbols=tms_shifter.symbols(), outputs=[dout])
+					stats = clock_stats(sim, clk)
+					total += sim.cycle
+					periods = max(periods, stats.get('period_max', 0))
+					if stats['pulses'] != clocked:
+						check.append("%i: BAD %i pulses" % (count, stats['pulses']))
+					sample_edge = 1 if write_on == sw.ShiftOp.ClockMode.negative else 0
+					bits = sampled(sim, clk, tms.pin, sample_edge)
+					if bits != byte_bits(data, False)[:clocked]:
+						check.append("%i: tms BAD %r" % (count, bits))
+					tdi = set(sum((sampled(sim, clk, dout, edge) for edge in (0, 1)), []))
+					if tdi != set([data >> 7]):
+						check.append("%i: tdi BAD" % count)
+					if reading and byte_bits(sim.a, False)[-clocked:] != byte_bits(0x3C, False)[:clocked]:
+						check.append("%i: in BAD %#04x" % (count, sim.a))
+
+			show("%-45s %6i %6.1f %6s %8s  %s" % (
+				name, total, periods, "", "", ", ".join(check) or "lengths 0-7 ok"))
+
+		# Clocks without data
+		gpio = sw.BitAccessInASM("gpio", pins.Pin("A", 1), pins.PinDirection.input)
+		if prefix:
+			gpio = sw.ByteAccessInASM("gpio", pins.Pin("E", 1), pins.PinDirection.input)
+		clocker = sw.ClockOnly(shifter.clk_pin, gpio)
+		none = sw.ShiftOp.ClockMode.none
+		runs = [
+			("ClockBits", calling.generate_bits("f", none, none, clocker.bits("f")),
+				[([n - 1], None, n) for n in range(1, 9)]),
+			("ClockBytes", calling.generate_clocks("f", True, clocker.bytes("f")),
+				[([n], None, 8 * (n + 1)) for n in (0, 1, 255, 256)]),
+		]
+		for level, suffix in ((1, "High"), (0, "Low")):
+			runs += [
+				("ClockUntil" + suffix, calling.generate_clocks("f", False, clocker.until("f", level)),
+					[([], (1 - level,) * (n - 1) + (level,), n) for n in (1, 2, 9)]),
+				("ClockBytesUntil" + suffix, calling.generate_clocks("f", True, clocker.until("f", level, counted=True)),
+					[([n], (1 - level,) * (k - 1) + (level,), min(k, 8 * (n + 1)))
+						for n, k in ((0, 3), (0, 20), (1, 16), (2, 9))]),
+			]
+		for kind, source, cases in runs:
+			check = []
+			total = 0
+			for args, gpio_bits, expected in cases:
+				sim = run_clocks(source, "f", clk, args, gpio.pin if gpio_bits else None, gpio_bits,
+					symbols=clocker.symbols())
+				stats = clock_stats(sim, clk)
+				total += sim.cycle
+				if stats['pulses'] != expected:
+					check.append("%r: BAD %i clocks" % (args, stats['pulses']))
+			show("%-45s %6i %6s %6s %8s  %s" % (
+				prefix + kind, total, "", "", "", ", ".join(check) or "clocks ok"))
+
+	# Adaptive clocking, with RTCK following straight away, late and never,
+	# the clock on port A and on port E
+	rtck = sw.BitAccessInASM("rtck", pins.Pin("A", 0), pins.PinDirection.input)
+	for prefix, shifter in (("", mpsse.byte_shifter), ("PortE_", mpsse.port_e_shifter)):
+		adaptive = sw.ShiftByteAdaptive(shifter.clk_pin, shifter.din_pin, shifter.dout_pin, rtck, timeout=16)
+		clk = adaptive.clk_pin.pin
+		for d, read_on, write_on in mpsse.combos:
+			name = prefix + mpsse.function_name(d, read_on, write_on, "ShiftByteAdaptive")
+			body = adaptive.generate(d, read_on, write_on)
+			msb = d == sw.ShiftOp.FirstBit.MSB
+			check = []
+			waits = sum(1 for l in body if ".+7" in l.operands)
+			if waits != 16:
+				check.append("BAD %i waits" % waits)
+			for delay, timeout in ((0, False), (20, False), (None, True)):
+				def setup(sim):
+					if delay is None:
+						sim.drive(adaptive.rtck_pin.pin, lambda sim: 0)
+					else:
+						sim.drive(adaptive.rtck_pin.pin, echo(clk, delay))
+				sim = run_shifter(body, clk, adaptive.din_pin.pin, adaptive.dout_pin.pin,
+					data=0xA5, read_data=0x3C, msb_first=msb,
+					read_edge=1 if read_on == sw.ShiftOp.ClockMode.positive else 0,
+					symbols=adaptive.symbols(), setup=setup)
+				if write_on != sw.ShiftOp.ClockMode.none:
+					sample_edge = 1 if write_on == sw.ShiftOp.ClockMode.negative else 0
+					if sampled(sim, clk, adaptive.dout_pin.pin, sample_edge)[:8] != byte_bits(0xA5, msb):
+						check.append("%r: out BAD" % delay)
+				if read_on != sw.ShiftOp.ClockMode.none and sim.a != 0x3C and not timeout:
+					check.append("%r: in BAD %#04x" % (delay, sim.a))
+				if bool(sim.read_bit(BITS['F0'])) != timeout:
+					check.append("%r: F0 BAD" % delay)
+				if delay == 0 and sim.cycle != adaptive.byte_cycles(d, read_on, write_on):
+					check.append("best case BAD %i cycles, not %i" % (
+						sim.cycle, adaptive.byte_cycles(d, read_on, write_on)))
+			show("%-45s %6i %6s %6s %8s  %s" % (
+				name, adaptive.byte_cycles(d, read_on, write_on), "", "", "",
+				", ".join(check) or "rtck ok"))
+
+	# Slower clocks, for the 0x86 divisors at each CPU speed
+	jtag = (sw.ShiftOp.FirstBit.LSB, sw.ShiftOp.ClockMode.positive, sw.ShiftOp.ClockMode.negative)
+	shifter = mpsse.byte_shifter
+	for speed, divisor in itertools.product(cycles.CPUSpeed, (0,) + mpsse.RATE_DIVISORS):
+		rate = mpsse.divisor_rate(divisor)
+		period, actual, error = shifter.timing(jtag[0], jtag[1], jtag[2], rate, speed)
+		body = shifter.generate(*jtag, rate=rate, speed=speed)
+		sim = run_shifter(body, shifter.clk_pin.pin, shifter.din_pin.pin, shifter.dout_pin.pin,
+			data=0xA5, read_data=0x3C, msb_first=False, read_edge=1)
+		stats = clock_stats(sim, shifter.clk_pin.pin)
+
+		check = []
+		bits = sampled(sim, shifter.clk_pin.pin, shifter.dout_pin.pin, 1)[:8]
+		check.append("out %s" % ("ok" if bits == byte_bits(0xA5, False) else "BAD %r" % bits))
+		check.append("in %s" % ("ok" if sim.a == 0x3C else "BAD %#04x" % sim.a))
+		if (stats['period_min'], stats['period_max']) != (period, period):
+			check.append("period BAD %i-%i not %i" % (stats['period_min'], stats['period_max'], period))
+		show("%-45s %6i %6.1f %5.1f%% %8.3f  %s" % (
+			"%s_Div%i @%s %+.2f%%" % (mpsse.function_name(*jtag), divisor, speed, error * 100),
+			sim.cycle, stats['period_mean'], stats.get('duty', 0) * 100,
+			speed.cycles_per_second / 1e6 / period, ", ".join(check)))
+
+	# i2c transactions with a target, as is and stretching the clock
+	none = sw.ShiftOp.ClockMode.none
+	scl, sda = i2c.clock.pin, i2c.data.pin
+	address, memory = 0x50, (0xC3, 0x5A)
+	for speed, rate in ((cycles.CPUSpeed.MHz48, 100000), (cycles.CPUSpeed.MHz48, 400000),
+			(cycles.CPUSpeed.MHz48, 1000000), (cycles.CPUSpeed.MHz24, 400000),
+			(cycles.CPUSpeed.MHz12, 100000)):
+		master = i2c.I2CMaster(i2c.clock, i2c.data, rate, speed)
+
+		def byte(value, part):
+			return [sw.asm("mov", "a", "#%#04x" % value)] + part
+
+		write = (master.prologue() + master.start() + byte(address << 1, master.write())
+			+ [sw.asm("mov", "r6", "a")] + byte(0xA5, master.write()) + [sw.asm("mov", "r7", "a")] + master.stop())
+		read = (master.prologue() + master.start() + byte(address << 1, master.write())
+			+ byte(0x10, master.write()) + master.restart() + byte(address << 1 | 1, master.write())
+			+ byte(1, master.read()) + [sw.asm("mov", "r6", "a")] + byte(0, master.read())
+			+ [sw.asm("mov", "r7", "a")] + master.stop())
+		wrong = master.prologue() + master.start() + byte(0x51 << 1, master.write()) + master.stop()
+
+		check = []
+		cycles_used = 0
+		for stretch in (0, 50):
+			def run(body):
+				device = I2CDevice(scl, sda, address, memory, stretch)
+				sim = run_i2c(calling.generate("f", none, none, body), "f", device, symbols=master.symbols())
+				return sim, device.decode(sim)[0]
+
+			sim, transfers = run(write)
+			if transfers != [[address, 0, [[0xA5, True]]]] or (sim.iram[sim.r(6)], sim.iram[sim.r(7)]) != (0, 0):
+				check.append("%i: write BAD %r" % (stretch, transfers))
+			if not stretch:
+				cycles_used = sim.cycle
+				stats = clock_stats(sim, scl)
+				if stats['period_min'] != master.period:
+					check.append("period BAD %i not %i" % (stats['period_min'], master.period))
+				if stats['periods'].count(master.period) < 12:
+					check.append("bits BAD %r" % stats['periods'])
+				if min(stats['low']) < master.times['low'] or min(stats['high']) < master.times['high']:
+					check.append("hi/lo BAD %i/%i" % (min(stats['high']), min(stats['low'])))
+
+			sim, transfers = run(read)
+			if transfers != [[address, 0, [[0x10, True]]], [address, 1, [[0xC3, True], [0x5A, False]]]]:
+				check.append("%i: read BAD %r" % (stretch, transfers))
+			if (sim.iram[sim.r(6)], sim.iram[sim.r(7)]) != memory:
+				check.append("%i: read BAD %#04x %#04x" % (stretch, sim.iram[sim.r(6)], sim.iram[sim.r(7)]))
+
+			sim, transfers = run(wrong)
+			if transfers != [[0x51, 0, []]] or sim.a != 1:
+				check.append("%i: NACK BAD %r" % (stretch, transfers))
+		show("%-45s %6i %6.1f %5.1f%% %8.3f  %s" % (
+			"i2c %ikHz @%s %+.2f%%" % (rate // 1000, speed, master.error * 100),
+			cycles_used, master.period, stats.get('duty', 0) * 100,
+			speed.cycles_per_second / 1e6 / master.period, ", ".join(check) or "i2c ok"))
+
+	# The functions of both i2c backends called in turn, with the batched transfers
+	src, dst = 0x1000, 0x2000
+	for label, bus in (
+			("i2c 400kHz", i2c.backend(scl, sda, 400000)),
+			("i2c 1000kHz", i2c.backend(scl, sda, 1000000)),
+			("i2c controller 100kHz", i2c.backend(pins.I2C_SCL, pins.I2C_SDA, 100000)),
+			("i2c controller 400kHz", i2c.backend(pins.I2C_SCL, pins.I2C_SDA, 400000))):
+		program = Program.from_c("\n".join(bus.generate("f_")))
+
+		def transaction(calls, **faults):
+			sim = Simulator(program, symbols=bus.symbols())
+			if isinstance(bus, i2c.I2CController):
+				target = I2CController(address, memory, **faults)
+			else:
+				target = I2CDevice(scl, sda, address, memory)
+			target.attach(sim)
+			sim.xdata[src:src + 2] = bytes((0x10, 0xA5))
+			results = []
+			for name, args in calls:
+				c_arguments(sim, "f_" + name, list(args))
+				sim.run("_f_" + name)
+				results.append(sim.a)
+			if isinstance(target, I2CDevice):
+				return sim, target.decode(sim)[0], results
+			return sim, target.transfers, results
+
+		check = []
+		polls_ok = ""
+		sim, transfers, results = transaction([("Start", [0]), ("Write", [address << 1]),
+			("WriteBytes", [src, 1]), ("Stop", [0])])
+		if transfers != [[address, 0, [[0x10, True], [0xA5, True]]]] or results[1] or sim.read_bit(BITS['F0']):
+			check.append("write BAD %r" % transfers)
+		write_cycles = sim.cycle
+
+		sim, transfers, results = transaction([("Start", [0]), ("Write", [address << 1 | 1]),
+			("ReadBytes", [dst, 2])])
+		if transfers != [[address, 1, [[0xC3, True], [0x5A, True], [0xC3, False]]]]:
+			check.append("read BAD %r" % transfers)
+		if list(sim.xdata[dst:dst + 3]) != [0xC3, 0x5A, 0xC3]:
+			check.append("read BAD %r" % list(sim.xdata[dst:dst + 3]))
+
+		sim, transfers, results = transaction([("Start", [0]), ("Write", [0x51 << 1]),
+			("WriteBytes", [src, 1]), ("Stop", [0])])
+		if results[1] != 1 or not sim.read_bit(BITS['F0']):
+			check.append("NACK BAD %r" % transfers)
+
+		if isinstance(bus, i2c.I2CController):
+			# Every function gives up rather than hang, with the error flag set
+			error = sim.bit_address(bus.ERROR_FLAG)
+			if sim.read_bit(error):
+				check.append("error flag BAD")
+			for fault in ("bus_error", "stuck"):
+				for calls in ([("Start", [0]), ("Write", [address << 1]), ("WriteBytes", [src, 1]), ("Stop", [0])],
+						[("Start", [0]), ("Write", [address << 1 | 1]), ("ReadBytes", [dst, 2])]):
+					sim = transaction(calls, **{fault: True})[0]
+					if not sim.read_bit(error):
+						check.append("%s BAD %s" % (fault, calls[-1][0]))
+
+			def polled(first, queue, args, **faults):
+				"""
+				Queue a transfer after Start() and Write(first), then
+				Poll() it along between POLL_GAP cycles of other work.
+				Returns (sim, transfers, status, cycles of each poll).
+				"""
+				sim = Simulator(program, symbols=bus.symbols())
+				target = I2CController(address, memory, **faults)
+				target.attach(sim)
+				sim.xdata[src:src + 2] = bytes((0x10, 0xA5))
+				for name, a in (("Start", [0]), ("Write", [first]), (queue, args)):
+					c_arguments(sim, "f_" + name, list(a))
+					sim.run("_f_" + name)
+				polls = []
+				while len(polls) < 1000:
+					sim.cycle += POLL_GAP
+					polls.append(sim.run("_f_Poll"))
+					if sim.a != bus.POLL_BUSY:
+						break
+				return sim, target.transfers, sim.a, polls
+
+			# The queue, the other work only held up by a poll at a time
+			POLL_GAP = 200
+			sim, transfers, status, polls = polled(address << 1, "QueueWrite", [src, 1])
+			if transfers != [[address, 0, [[0x10, True], [0xA5, True]]]] or status != bus.POLL_IDLE:
+				check.append("queued write BAD %r" % transfers)
+			longest_poll = max(polls)
+			sim, transfers, status, polls = polled(address << 1 | 1, "QueueRead", [dst, 2])
+			if (transfers != [[address, 1, [[0xC3, True], [0x5A, True], [0xC3, False]]]]
+					or list(sim.xdata[dst:dst + 3]) != [0xC3, 0x5A, 0xC3] or status != bus.POLL_IDLE):
+				check.append("queued read BAD %r" % transfers)
+			longest_poll = max([longest_poll] + polls) + sw.asm("lcall", "_f").cycles
+			if longest_poll > bus.poll_cycles():
+				check.append("poll BAD %i cycles, not %i" % (longest_poll, bus.poll_cycles()))
+			# The target ACKs addresses of its own, so this one is NACKed
+			if polled(0x51 << 1, "QueueWrite", [src, 1])[2] != bus.POLL_NACK:
+				check.append("queued NACK BAD")
+			if polled(address << 1, "QueueWrite", [src, 1], bus_error=True)[2] != bus.POLL_ERROR:
+				check.append("queued bus_error BAD")
+			polls_ok = ", polls <= %i cycles" % longest_poll
+		show("%-45s %6i %6s %6s %8s  %s" % (
+			label, write_cycles, "", "", "", ", ".join(check) or "transfers ok" + polls_ok))
+
+	# MSB first functions reversing the byte round the LSB first ones
+	reverse = [sum(b << i for i, b in enumerate(byte_bits(v))) for v in range(256)]
+	program = Program.from_c("\n".join(mpsse.byte_functions("bytes")[0]))
+	clk, din, dout = [pin_key(p.pin) for p in (mpsse.clock, mpsse.data_in, mpsse.data_out)]
+	for d, read_on, write_on in mpsse.combos:
+		if d != sw.ShiftOp.FirstBit.MSB:
+			continue
+		sim = Simulator(program, symbols=mpsse.byte_shifter.symbols())
+		load_table(sim, sw.REVERSE_TABLE, reverse)
+		for p in (clk, dout):
+			sim.sfr[OES[p[0]] - 0x80] |= 1 << p[1]
+		sim.sfr[PORTS[clk[0]] - 0x80] |= 1 << clk[1]
+		sim.write_direct(SFRS['DPL'], 0xA5)
+		sim.drive(din, serial_source(clk, byte_bits(0x3C), int(read_on == sw.ShiftOp.ClockMode.positive)))
+		sim.run("_" + mpsse.function_name(d, read_on, write_on))
+		check = []
+		if write_on != sw.ShiftOp.ClockMode.none:
+			sample_edge = 1 if write_on == sw.ShiftOp.ClockMode.negative else 0
+			if sampled(sim, clk, dout, sample_edge)[:8] != byte_bits(0xA5):
+				check.append("out BAD")
+		if read_on != sw.ShiftOp.ClockMode.none and sim.read_direct(SFRS['DPL']) != 0x3C:
+			check.append("in BAD %#04x" % sim.read_direct(SFRS['DPL']))
+		expected = mpsse.reversed_function(read_on, write_on)[1]
+		if sim.cycle != expected:
+			check.append("BAD %i cycles, not %i" % (sim.cycle, expected))
+		show("%-45s %6i %6s %6s %8s  %s" % (
+			"reversed " + mpsse.function_name(d, read_on, write_on), sim.cycle, "", "", "",
+			", ".join(check) or "reverse ok"))
+
+	# The ShiftByte_* functions through the peephole passes
+	for d, read_on, write_on in mpsse.combos:
+		name = mpsse.function_name(d, read_on, write_on)
+		source, expected = mpsse.byte_function(d, read_on, write_on, "size")[:2]
+		sim = Simulator(Program.from_c(source), symbols=mpsse.byte_shifter.symbols())
+		for p in (clk, dout):
+			sim.sfr[OES[p[0]] - 0x80] |= 1 << p[1]
+		sim.sfr[PORTS[clk[0]] - 0x80] |= 1 << clk[1]
+		sim.write_direct(SFRS['DPL'], 0xA5)
+		sim.drive(din, serial_source(clk, byte_bits(0x3C, d == sw.ShiftOp.FirstBit.MSB),
+			int(read_on == sw.ShiftOp.ClockMode.positive)))
+		sim.run("_" + name)
+		check = []
+		if write_on != sw.ShiftOp.ClockMode.none:
+			sample_edge = 1 if write_on == sw.ShiftOp.ClockMode.negative else 0
+			if sampled(sim, clk, dout, sample_edge)[:8] != byte_bits(0xA5, d == sw.ShiftOp.FirstBit.MSB):
+				check.append("out BAD")
+		if read_on != sw.ShiftOp.ClockMode.none and sim.read_direct(SFRS['DPL']) != 0x3C:
+			check.append("in BAD %#04x" % sim.read_direct(SFRS['DPL']))
+		if sim.cycle != expected:
+			check.append("BAD %i cycles, not %i" % (sim.cycle, expected))
+		show("%-45s %6i %6s %6s %8s  %s" % (
+			"peephole " + name, sim.cycle, "", "", "", ", ".join(check) or "peephole ok"))
+
+	# The naked functions, out of the assembler module, against the C ones
+	naked = Program.from_asm(calling.asm_module("mpsse_naked",
+		[f[:3] for f in mpsse.naked_functions()], mpsse.auto_shifter.symbols()))
+	tms = pin_key(mpsse.tms.pin)
+
+	def changes(sim):
+		"""The order the clock and data out pins changed in."""
+		return [(e.pin, e.value) for e in sim.events if e.changed and e.pin in (clk, dout, tms)]
+
+	runs = ([("ShiftByte", c) for c in mpsse.combos] + [("ShiftBits", c) for c in mpsse.combos]
+		+ [("ShiftTMS", (None,) + c) for c in mpsse.tms_combos] + [("ShiftBytes", c) for c in mpsse.combos])
+	for kind, (d, read_on, write_on) in runs:
+		name = mpsse.function_name(d, read_on, write_on, kind + "Naked")
+		reading = read_on != sw.ShiftOp.ClockMode.none
+		writing = write_on != sw.ShiftOp.ClockMode.none
+		msb = d == sw.ShiftOp.FirstBit.MSB
+		read_edge = int(read_on == sw.ShiftOp.ClockMode.positive)
+		data, read_data, count = [0xA5, 0x0F, 0x3C], [0x3C, 0xF0, 0x5A], 5
+
+		sim = Simulator(naked)
+		for p in (clk, dout, tms):
+			sim.sfr[OES[p[0]] - 0x80] |= 1 << p[1]
+		sim.sfr[PORTS[clk[0]] - 0x80] |= 1 << clk[1]
+		sim.a = data[0]
+		if kind == "ShiftBytes":
+			c_name = mpsse.function_name(d, read_on, write_on, "ShiftBytesAuto")
+			source = calling.generate_bytes(c_name, read_on, write_on,
+				mpsse.auto_shifter.generate(d, read_on, write_on, c_name))
+			c = run_bytes(source, c_name, clk, din=din if reading else None,
+				dout=dout if writing else None, data=data if writing else (),
+				read_data=read_data if reading else (), msb_first=msb, read_edge=read_edge,
+				symbols=mpsse.auto_shifter.symbols())
+			sim.xdata[0x1000:0x1003] = bytearray(data)
+			for reg, value in (('AUTOPTRH1', 0x10), ('AUTOPTRL1', 0x00), ('AUTOPTRH2', 0x20), ('AUTOPTRL2', 0x00)):
+				sim.write_direct(SFRS[reg], value)
+			sim.write_direct(7, len(data) - 1)
+			sim.write_direct(6, 0)
+			bits = sum((byte_bits(v, msb) for v in read_data), [])
+		elif kind == "ShiftByte":
+			c = Simulator(Program.from_c(mpsse.byte_function(d, read_on, write_on)[0]),
+				symbols=mpsse.byte_shifter.symbols())
+			for p in (clk, dout):
+				c.sfr[OES[p[0]] - 0x80] |= 1 << p[1]
+			c.sfr[PORTS[clk[0]] - 0x80] |= 1 << clk[1]
+			c.write_direct(SFRS['DPL'], data[0])
+			bits = byte_bits(read_data[0], msb)
+			c.drive(din, serial_source(clk, bits, read_edge))
+			c.run("_" + mpsse.function_name(d, read_on, write_on))
+		else:
+			shifter = mpsse.bits_shifter if kind == "ShiftBits" else mpsse.tms_shifter
+			c_name = mpsse.function_name(d, read_on, write_on, kind)
+			if kind == "ShiftBits":
+				body = shifter.generate(d, read_on, write_on, c_name)
+			else:
+				body = shifter.generate(read_on, write_on, c_name)
+			c = run_bits(calling.generate_bits(c_name, read_on, write_on, body), c_name, clk, count,
+				din=din if reading else None, dout=tms if kind == "ShiftTMS" else dout if writing else None,
+				data=data[0], read_data=read_data[0], msb_first=msb, read_edge=read_edge,
+				symbols=shifter.symbols(), outputs=[dout])
+			sim.write_direct(7, count - 1)
+			bits = byte_bits(read_data[0], msb)[:count]
+		if reading:
+			sim.drive(din, serial_source(clk, bits, read_edge))
+		sim.run("_" + name)
+
+		check = []
+		if changes(sim) != changes(c):
+			check.append("pins BAD")
+		if kind == "ShiftBytes" and sim.xdata[0x2000:0x2003] != c.xdata[0x2000:0x2003]:
+			check.append("in BAD %r" % list(sim.xdata[0x2000:0x2003]))
+		elif kind != "ShiftBytes" and reading and sim.a != c.a:
+			check.append("in BAD %#04x, not %#04x" % (sim.a, c.a))
+		show("%-45s %6i %6i %6s %8s  %s" % (name, sim.cycle, c.cycle, "", "", ", ".join(check) or "naked ok"))
+
+	# The byte shifted through USART0 in mode 0, at both dividers
+	import usart
+	for s in (usart.ShiftByteUSART(4), usart.ShiftByteUSART(12),
+			usart.ShiftByteUSART(4, table=sw.REVERSE_TABLE)):
+		for d, read_on, write_on in mpsse.combos:
+			if not s.supports(d, read_on, write_on):
+				continue
+			msb = d == sw.ShiftOp.FirstBit.MSB
+			sim = Simulator(Program.from_c(s.generate(d, read_on, write_on)))
+			port = USART0([0x3C])
+			port.attach(sim)
+			load_table(sim, sw.REVERSE_TABLE, reverse)
+			sim.a = 0xA5
+			sim.run()
+			check = []
+			if write_on != sw.ShiftOp.ClockMode.none:
+				if len(port.sent) != 1 or byte_bits(port.sent[0], False) != byte_bits(0xA5, msb):
+					check.append("write BAD %r" % port.sent)
+			elif port.received != [0x3C] or byte_bits(sim.a, msb) != byte_bits(0x3C, False):
+				check.append("read BAD %#04x" % sim.a)
+			if sim.cycle != s.byte_cycles(d, read_on, write_on):
+				check.append("BAD %i cycles, not %i" % (sim.cycle, s.byte_cycles(d, read_on, write_on)))
+			show("%-45s %6i %6i %6s %8.3f  %s" % (
+				"USART0/%i%s %s" % (s.divider, " table" if s.table else "",
+					mpsse.function_name(d, read_on, write_on)),
+				sim.cycle, s.bit_cycles(), "", 8 * cycles.CPUSpeed.MHz48.cycles_per_second / 1e6 / sim.cycle,
+				", ".join(check) or "usart ok"))
+
+	# 2 and 4 bits a clock, each lane checked on its own
+	for prefix, lanes in mpsse.lane_shifters:
+		clk = pin_key(lanes.clk)
+		clocks = 8 // lanes.lanes
+		for d, read_on, write_on in mpsse.combos:
+			if not lanes.supports(d, read_on, write_on):
+				continue
+
+			def lane_bits(value, n):
+				return [(value >> (lanes.group(d, k) + n)) & 1 for k in range(clocks)]
+
+			sim = Simulator(Program.from_c(lanes.generate(d, read_on, write_on)))
+			for p in [lanes.clk] + ([] if lanes.shared else lanes.dout):
+				sim.sfr[OES[p.port] - 0x80] |= p.mask
+			sim.sfr[PORTS[clk[0]] - 0x80] |= lanes.clk.mask
+			sim.a = 0xA5
+			for n, p in enumerate(lanes.din):
+				sim.drive(pin_key(p), serial_source(clk, lane_bits(0x3C, n),
+					int(read_on == sw.ShiftOp.ClockMode.positive)))
+			sim.run()
+			stats = clock_stats(sim, clk)
+
+			check = []
+			if write_on != sw.ShiftOp.ClockMode.none:
+				sample_edge = 1 if write_on == sw.ShiftOp.ClockMode.negative else 0
+				if any(sampled(sim, clk, pin_key(p), sample_edge) != lane_bits(0xA5, n)
+						for n, p in enumerate(lanes.dout)):
+					check.append("out BAD")
+			if read_on != sw.ShiftOp.ClockMode.none and sim.a != 0x3C:
+				check.append("in BAD %#04x" % sim.a)
+			if stats['pulses'] != clocks:
+				check.append("BAD %i clocks" % stats['pulses'])
+			if sim.cycle != lanes.byte_cycles(d, read_on, write_on):
+				check.append("BAD %i cycles, not %i" % (sim.cycle, lanes.byte_cycles(d, read_on, write_on)))
+			period = stats.get('period_mean', 0)
+			show("%-45s %6i %6.1f %5.1f%% %8.3f  %s" % (
+				mpsse.function_name(d, read_on, write_on, prefix), sim.cycle, period,
+				stats.get('duty', 0) * 100, 8 * 12.0 / sim.cycle, ", ".join(check) or "lanes ok"))
+
+	# Port E through the proxy byte and the registers, every wiring of them
+	# right and port_e_fastest() picking the quickest
+	other = ("E", 0)
+
+	def hold_other(sim):
+		"""E0, another output on port E, held high."""
+		sim.sfr[OES["E"] - 0x80] |= 1
+		sim.sfr[PORTS["E"] - 0x80] |= 1
+
+	for d, read_on, write_on in mpsse.combos:
+		msb = d == sw.ShiftOp.FirstBit.MSB
+		check = []
+		counts = []
+		for wiring in mpsse.port_e_wirings:
+			s = sw.ShiftByte(*wiring)
+			clk, din, dout = [pin_key(p.pin) for p in wiring]
+			sim = run_shifter(s.generate(d, read_on, write_on), clk, din, dout, data=0xA5, read_data=0x3C,
+				msb_first=msb, read_edge=int(read_on == sw.ShiftOp.ClockMode.positive),
+				symbols=s.symbols(), setup=hold_other)
+			kinds = "/".join(type(p).__name__[:-len("AccessInASM")] for p in wiring)
+			if write_on != sw.ShiftOp.ClockMode.none:
+				sample_edge = 1 if write_on == sw.ShiftOp.ClockMode.negative else 0
+				if sampled(sim, clk, dout, sample_edge)[:8] != byte_bits(0xA5, msb):
+					check.append("%s out BAD" % kinds)
+			if read_on != sw.ShiftOp.ClockMode.none and sim.a != 0x3C:
+				check.append("%s in BAD %#04x" % (kinds, sim.a))
+			if sim.transitions(other):
+				check.append("%s BAD E0 changed" % kinds)
+			if sim.cycle != s.byte_cycles(d, read_on, write_on):
+				check.append("%s BAD %i cycles, not %i" % (kinds, sim.cycle, s.byte_cycles(d, read_on, write_on)))
+			counts.append((sim.cycle, kinds))
+		picked = mpsse.port_e_fastest(d, read_on, write_on)
+		if picked.byte_cycles(d, read_on, write_on) != min(counts)[0]:
+			check.append("picked BAD")
+		show("%-45s %6i %6s %6s %8s  %s" % (
+			"PortE " + mpsse.function_name(d, read_on, write_on), min(counts)[0], "", "", min(counts)[1],
+			", ".join(check) or "wiring ok"))
+
+	# analyzer.py timing, the clock inside the byte as clock_stats() has it,
+	# data out and in never changing on the edge they're sampled on
+	import analyzer
+	for name, s, d, read_on, write_on, body in analyzer.functions():
+		check = []
+		timing = analyzer.analyze(name, s, d, read_on, write_on, body)
+		clk, din, dout = [pin_key(p.pin) for p in (s.clk_pin, s.din_pin, s.dout_pin)]
+		sim = run_shifter(body, clk, din, dout, data=0xA5, read_data=0x3C,
+			msb_first=d == sw.ShiftOp.FirstBit.MSB,
+			read_edge=int(read_on == sw.ShiftOp.ClockMode.positive), symbols=s.symbols())
+		stats = clock_stats(sim, clk)
+		bits = timing['bits']
+		if [b['low'] for b in bits] != stats['low'] or [b['high'] for b in bits[:-1]] != stats['high']:
+			check.append("clock BAD")
+		boundary = timing['boundary']
+		if boundary['cycles'] != boundary['lead_in'] + boundary['tail'] + boundary['call']:
+			check.append("boundary BAD")
+		for pin in ('out', 'in'):
+			if pin in timing and min(timing[pin].values()) < 1:
+				check.append("%s setup/hold BAD" % pin)
+		show("%-45s %6i %6i %6i %+8i  %s" % (name, timing['cycles'], timing['every'],
+			timing.get('out', {}).get('setup_min', 0), boundary['extra'], ", ".join(check) or "timing ok"))
+
+	if failures:
+		sys.stderr.write("%i checks failed:\n%s\n" % (len(failures), "\n".join(failures)))
+	sys.exit(1 if failures else 0)
@@ -2,10 +2,13 @@
 Tools for generating efficient software based bit banging functions.
 """
 
+import itertools
 from enum import Enum
 
 import pins
 import cycles
+import scheduler
+import ir
 
 
 class BitBang(object):
@@ -56,11 +59,11 @@ class BitBang(object):
 	def setup(self, direction=None):
 		if self.direction == pins.PinDirection.bidirectional:
 			if not direction:
-				return ""
+				return []
 		else:
 			if direction:
 				assert direction == self.direction
-				return ""
+				return []
 			direction = self.direction
 
 		if direction == pins.PinDirection.input:
@@ -89,6 +92,22 @@ class BitBang(object):
 	def setto(self, value_name):
 		raise NotImplementedError
 
+	# Set up
+	def prologue(self):
+		"""Code which has to run once before the bit is used."""
+		return []
+
+	def symbols(self):
+		"""Addresses of the symbols used by the generated code."""
+		return {}
+
+	def flushed_by(self, other):
+		"""Does an operation on other also write this bit out to the pin?"""
+		return False
+
+	# Do bit_to_carry() / carry_to_bit() use A
+	uses_a = False
+
 def indent(s):
 	return ("\n	".join(s.split("\n")))
 
@@ -108,7 +127,7 @@ class ByteAccessInC(BitBang):
 
 	def defines(self):
 		d = {
-			'port_name': sef.pin.port_name,
+			'port_name': self.pin.port_name,
 			'port_oe': self.pin.output_name,
 			'mask': self.pin.mask,
 			'nask': self.pin.nask,
@@ -191,7 +210,7 @@ class BitAccessInC(BitBang):
 
 	def defines(self):
 		d = {
-			'bit_name': sef.pin.bit_name,
+			'bit_name': self.pin.bit_name,
 			'bit_oe': self.pin.output_name,
 			'mask': self.pin.mask,
 			'nask': self.pin.nask,
@@ -392,9 +411,20 @@ class ByteAccessInASM(BitBang):
 	// b6  -- (1cy) ROTATE
 	// == 9 cycles between clock edges
 
-	// 12MHz / 12 cycles per CLK == 1.0Mbit/s
-	// 12MHz / 10 cycles per CLK == 1.2Mbit/s
-	// 12MHz /  9 cycles per CLK == 1.3Mbit/s
+	// A clock period is two of these gaps, at 48MHz (12M cycles/s)
+	// 2 * 10 cycles per CLK == 600kbit/s
+	// 2 *  9 cycles per CLK == 667kbit/s
+	//
+	// What ShiftByte gets (cycles per clock period, simulator.py checks
+	// them): writes merged into the edge's MOV pins, @R0 (see ShiftByte.ops)
+	// and the MOV C, proxy_pin_data_in of a read free to move past an edge
+	// outOnPos / outOnNeg                        12    1.0Mbit/s
+	// inOnPos / inOnNeg                          14    857kbit/s
+	// inOnNeg_outOnNeg                           16    750kbit/s
+	// inOnPos_outOnNeg / inOnNeg_outOnPos        18    667kbit/s
+	// inOnPos_outOnPos                           20    600kbit/s
+	// Each edge is 4 cycles (CPL / SETB + MOV pins, @R0) and a read another
+	// MOV @R0, pins, which can't share an edge's write.
 
 	// Using lots of registers
 	// =================================================
@@ -438,6 +468,109 @@ class ByteAccessInASM(BitBang):
 	// =============================================
 	"""
 
+	# Proxy bytes live at the top of the bit addressable space, one per port.
+	PROXY_TOP = 0x2F
+
+	def __init__(self, name, pin, direction, pointer="r0"):
+		"""
+		ByteAccessInASM("tdi", pins.Pin("E", 3), pins.PinDirection.output)
+
+		pointer is the register holding the address of the proxy byte.
+		"""
+		BitBang.__init__(self, name, pin, direction)
+		assert pointer in ("r0", "r1"), pointer
+
+		self.pointer = pointer
+		self.port_name = self.pin.port_name
+		self.oe_name = self.pin.output_name
+		self.mask = self.pin.mask
+		self.nask = self.pin.nask
+
+		self.proxy = self.PROXY_TOP - "ABCDE".index(self.pin.port)
+		self.proxy_name = "%s_proxy" % self.port_name.lower()
+		self.proxy_bit = (self.proxy - 0x20) * 8 + self.pin.index
+		self.proxy_bit_name = "%s_proxy" % self.name
+
+	def defines(self):
+		return """\
+#ifndef %(port_name)s_PROXY
+#define %(port_name)s_PROXY %(proxy)#04x
+__data __at (%(port_name)s_PROXY) volatile BYTE %(proxy_name)s;
+#endif
+__bit __at (%(proxy_bit)#04x) %(proxy_bit_name)s;
+""" % self.__dict__
+
+	def symbols(self):
+		return {
+			"_" + self.proxy_name: self.proxy,
+			"_" + self.proxy_bit_name: self.proxy_bit,
+		}
+
+	def prologue(self):
+		return [
+			asm("mov", self.pointer, "#_%s" % self.proxy_name, comment="%s->proxy" % self.pointer),
+			asm("mov", "@%s" % self.pointer, "_%s" % self.port_name, comment="%s->proxy" % self.port_name),
+		]
+
+	def flushed_by(self, other):
+		return (isinstance(other, ByteAccessInASM)
+			and (other.pin.port, other.pointer) == (self.pin.port, self.pointer))
+
+	def flush(self):
+		return [
+			asm("mov", "_%s" % self.port_name, "@%s" % self.pointer, comment="proxy->%s" % self.port_name),
+		]
+
+	# Simple bit operations
+	def set(self):
+		return [
+			asm("setb", "_%s" % self.proxy_bit_name, comment="Set %s" % self.name),
+		] + self.flush()
+
+	def get(self):
+		raise NotImplementedError
+
+	def clear(self):
+		return [
+			asm("clr", "_%s" % self.proxy_bit_name, comment="Clear %s" % self.name),
+		] + self.flush()
+
+	def toggle(self):
+		return [
+			asm("cpl", "_%s" % self.proxy_bit_name, comment="Toggle %s" % self.name),
+		] + self.flush()
+
+	# Direction set up
+	def _setup_input(self):
+		return [
+			asm("anl", "_%s" % self.oe_name, "#%#04x" % self.nask, comment="Set %s as input" % self.name),
+		]
+
+	def _setup_output(self):
+		return [
+			asm("orl", "_%s" % self.oe_name, "#%#04x" % self.mask, comment="Set %s as output" % self.name),
+		]
+
+	# To/From the carry bit
+	def bit_to_carry(self):
+		return [
+			asm("mov", "@%s" % self.pointer, "_%s" % self.port_name, comment="%s->proxy" % self.port_name),
+			asm("mov", "c", "_%s" % self.proxy_bit_name, comment="%s->carry" % self.name),
+		]
+
+	def carry_to_proxy(self):
+		"""carry_to_bit without writing the proxy out to the pins."""
+		return [
+			asm("mov", "_%s" % self.proxy_bit_name, "c", comment="carry->%s" % self.name),
+		]
+
+	def carry_to_bit(self):
+		return self.carry_to_proxy() + self.flush()
+
+	# Other
+	def setto(self, value_name):
+		raise NotImplementedError
+
 
 class BitAccessInASM(BitBang):
 	"""Access bits (in bit addressable space) via bit operations. Implemented in assembly."""
@@ -460,37 +593,234 @@ class BitAccessInASM(BitBang):
 
 	# Simple bit operations
 	def set(self):
-		return """\
-__asm__ ("setb	_%(bit_name)s");		/* Set %(name)s */""" % self.__dict__
+		return [asm("setb", "_%s" % self.bit_name, comment="Set %s" % self.name)]
 
 	def get(self):
 		raise NotImplementedError
 
 	def clear(self):
-		return """\
-__asm__ ("clr	_%(bit_name)s");		/* Clear %(name)s */""" % self.__dict__
+		return [asm("clr", "_%s" % self.bit_name, comment="Clear %s" % self.name)]
 
 	def toggle(self):
-		return """\
-__asm__ ("cpl	_%(bit_name)s");		/* Toggle %(name)s */""" % self.__dict__
+		return [asm("cpl", "_%s" % self.bit_name, comment="Toggle %s" % self.name)]
 
 	# Direction set up
 	def _setup_input(self):
-		return """\
-__asm__ ("anl	_%(oe_name)s,#%(nask)#04x;");	/* Set %(name)s as input */""" % self.__dict__
+		return [
+			asm("anl", "_%s" % self.oe_name, "#%#04x" % self.nask, comment="Set %s as input" % self.name),
+		]
 
 	def _setup_output(self):
-		return """\
-__asm__ ("orl	_%(oe_name)s,#%(mask)#04x;");	/* Set %(name)s as output */""" % self.__dict__
+		return [
+			asm("orl", "_%s" % self.oe_name, "#%#04x" % self.mask, comment="Set %s as output" % self.name),
+		]
 
 	# To/From the carry bit
 	def bit_to_carry(self):
-		return """\
-__asm__ ("mov	c,_%(bit_name)s");	/* %(name)s->carry */""" % self.__dict__
+		return [asm("mov", "c", "_%s" % self.bit_name, comment="%s->carry" % self.name)]
+
+	def carry_to_bit(self):
+		return [asm("mov", "_%s" % self.bit_name, "c", comment="carry->%s" % self.name)]
+
+	# Other
+	def setto(self, value_name):
+		raise NotImplementedError
+
+
+class RegisterAccessInASM(BitBang):
+	"""
+	The "lots of registers" version from the ByteAccessInASM notes, for
+	any port (IOE too) without a proxy byte. The clock changes with a read
+	modify write of the port and the data goes through A:
+
+	  set()          (3cy) ORL pins, #mask
+	  clear()        (3cy) ANL pins, #nask
+	  toggle()       (3cy) XRL pins, #mask
+	  bit_to_carry() (2cy) MOV A, pins; (2cy) MOV C, ACC.n
+	  carry_to_bit() (2cy) MOV A, pins; (2cy) MOV ACC.n, C; (2cy) MOV pins, A
+
+	The masks are immediates, MOV A, Rx_mask; ORL pins, A takes the same 3
+	cycles but A too. The data moves use A, so a shifter keeps its data in
+	a register while they're there (see ShiftByte.data_register()).
+
+	carry_to_bit() writes back what the other pins of the port read, so an
+	output on the same port must not go through a proxy byte (which would
+	write the clock back as it was), see conflicts().
+	"""
+
+	# bit_to_carry() / carry_to_bit() use A
+	uses_a = True
+
+	def __init__(self, name, pin, direction):
+		"""
+		RegisterAccessInASM("clk", pins.Pin("E", 5), pins.PinDirection.output)
+		"""
+		BitBang.__init__(self, name, pin, direction)
+
+		self.port_name = self.pin.port_name
+		self.oe_name = self.pin.output_name
+		self.mask = self.pin.mask
+		self.nask = self.pin.nask
+
+	def defines(self):
+		return ""
+
+	# Simple bit operations
+	def set(self):
+		return [
+			asm("orl", "_%s" % self.port_name, "#%#04x" % self.mask, comment="Set %s" % self.name),
+		]
+
+	def get(self):
+		raise NotImplementedError
+
+	def clear(self):
+		return [
+			asm("anl", "_%s" % self.port_name, "#%#04x" % self.nask, comment="Clear %s" % self.name),
+		]
+
+	def toggle(self):
+		return [
+			asm("xrl", "_%s" % self.port_name, "#%#04x" % self.mask, comment="Toggle %s" % self.name),
+		]
+
+	# Direction set up
+	def _setup_input(self):
+		return [
+			asm("anl", "_%s" % self.oe_name, "#%#04x" % self.nask, comment="Set %s as input" % self.name),
+		]
+
+	def _setup_output(self):
+		return [
+			asm("orl", "_%s" % self.oe_name, "#%#04x" % self.mask, comment="Set %s as output" % self.name),
+		]
+
+	# To/From the carry bit
+	def bit_to_carry(self):
+		return [
+			asm("mov", "a", "_%s" % self.port_name, comment="%s->a" % self.port_name),
+			asm("mov", "c", "acc.%i" % self.pin.index, comment="%s->carry" % self.name),
+		]
 
 	def carry_to_bit(self):
+		return [
+			asm("mov", "a", "_%s" % self.port_name, comment="%s->a" % self.port_name),
+			asm("mov", "acc.%i" % self.pin.index, "c", comment="carry->%s" % self.name),
+			asm("mov", "_%s" % self.port_name, "a", comment="a->%s" % self.port_name),
+		]
+
+	# Other
+	def setto(self, value_name):
+		raise NotImplementedError
+
+
+class OpenDrainInASM(BitBang):
+	"""
+	An open drain pin (like i2c's SCL and SDA) emulated by leaving the port
+	latch at 0 and only ever changing the OE bit. OE set pulls the line low,
+	OE clear lets the pull up (or another device) have it.
+
+	set() / clear() / toggle() change the OE register directly (3 cycles).
+	Moving the carry out goes through a proxy of the OE register in the bit
+	addressable space (like ByteAccessInASM), a carry of 1 in the proxy
+	pulling the line low. Reading the line needs a bit addressable pin.
+	"""
+
+	# OE proxy bytes live below the ByteAccessInASM port proxies, one per port.
+	PROXY_TOP = ByteAccessInASM.PROXY_TOP - 5
+
+	def __init__(self, name, pin, pointer="r0"):
+		"""
+		OpenDrainInASM("i2c_sda", pins.Pin("A", 3))
+		"""
+		assert pin.bit_accessible, "%r not bit accessible!" % pin
+		BitBang.__init__(self, name, pin, pins.PinDirection.bidirectional)
+		assert pointer in ("r0", "r1"), pointer
+
+		self.pointer = pointer
+		self.bit_name = self.pin.bit_name
+		self.port_name = self.pin.port_name
+		self.oe_name = self.pin.output_name
+		self.mask = self.pin.mask
+		self.nask = self.pin.nask
+
+		self.proxy = self.PROXY_TOP - "ABCDE".index(self.pin.port)
+		self.proxy_name = "%s_proxy" % self.oe_name.lower()
+		self.proxy_bit = (self.proxy - 0x20) * 8 + self.pin.index
+		self.proxy_bit_name = "%s_oe_proxy" % self.name
+
+	def defines(self):
 		return """\
-__asm__ ("mov	_%(bit_name)s,c");	/* carry->%(name)s */""" % self.__dict__
+#ifndef %(oe_name)s_PROXY
+#define %(oe_name)s_PROXY %(proxy)#04x
+__data __at (%(oe_name)s_PROXY) volatile BYTE %(proxy_name)s;
+#endif
+__bit __at (%(proxy_bit)#04x) %(proxy_bit_name)s;
+""" % self.__dict__
+
+	def symbols(self):
+		return {
+			"_" + self.proxy_name: self.proxy,
+			"_" + self.proxy_bit_name: self.proxy_bit,
+		}
+
+	def prologue(self):
+		return [
+			asm("anl", "_%s" % self.port_name, "#%#04x" % self.nask, comment="%s latch 0" % self.name),
+			asm("mov", self.pointer, "#_%s" % self.proxy_name, comment="%s->proxy" % self.pointer),
+			asm("mov", "@%s" % self.pointer, "_%s" % self.oe_name, comment="%s->proxy" % self.oe_name),
+		]
+
+	def flushed_by(self, other):
+		return (isinstance(other, OpenDrainInASM)
+			and (other.pin.port, other.pointer) == (self.pin.port, self.pointer))
+
+	def flush(self):
+		return [
+			asm("mov", "_%s" % self.oe_name, "@%s" % self.pointer, comment="proxy->%s" % self.oe_name),
+		]
+
+	# Simple bit operations
+	def set(self):
+		return [
+			asm("anl", "_%s" % self.oe_name, "#%#04x" % self.nask, comment="Release %s" % self.name),
+		]
+
+	def get(self):
+		raise NotImplementedError
+
+	def clear(self):
+		return [
+			asm("orl", "_%s" % self.oe_name, "#%#04x" % self.mask, comment="Pull %s low" % self.name),
+		]
+
+	def toggle(self):
+		return [
+			asm("xrl", "_%s" % self.oe_name, "#%#04x" % self.mask, comment="Toggle %s" % self.name),
+		]
+
+	# Direction set up, there is nothing to do
+	def _setup_input(self):
+		return []
+
+	def _setup_output(self):
+		return []
+
+	# To/From the carry bit
+	def bit_to_carry(self):
+		return [asm("mov", "c", "_%s" % self.bit_name, comment="%s->carry" % self.name)]
+
+	def carry_to_proxy(self):
+		"""Pull the line low on the next flush() if carry is 1, else release it."""
+		return [
+			asm("mov", "_%s" % self.proxy_bit_name, "c", comment="carry->%s low" % self.name),
+		]
+
+	def carry_to_bit(self):
+		"""Drive the line to carry, inverted in the proxy so carry is kept."""
+		return self.carry_to_proxy() + [
+			asm("cpl", "_%s" % self.proxy_bit_name, comment="1 releases %s" % self.name),
+		] + self.flush()
 
 	# Other
 	def setto(self, value_name):
@@ -537,6 +867,41 @@ inline void %(name)s_toggle() {
 	}
 
 
+def conflicts(bitbangs):
+	"""
+	Why the bitbangs can't be used together, None if they can. An output
+	written out through a proxy byte would put back what another output on
+	the same port last wrote without it, and RegisterAccessInASM writes back
+	an open drain line as it reads.
+	"""
+	for a, b in itertools.permutations([b for b in bitbangs if isinstance(b, BitBang)], 2):
+		if not isinstance(b, RegisterAccessInASM) or a.pin.port != b.pin.port:
+			continue
+		if b.direction == pins.PinDirection.input:
+			continue
+		if isinstance(a, ByteAccessInASM) and a.direction != pins.PinDirection.input:
+			return "%s goes through the port %s proxy byte but %s doesn't" % (a.name, a.pin.port, b.name)
+		if isinstance(a, OpenDrainInASM):
+			return "%s would write back open drain %s" % (b.name, a.name)
+	return None
+
+
+def bitbangs(name, pin, direction):
+	"""The BitBangs in assembler there are for a port pin."""
+	if pin.bit_accessible:
+		return [BitAccessInASM(name, pin, direction)]
+	return [ByteAccessInASM(name, pin, direction), RegisterAccessInASM(name, pin, direction)]
+
+
+def wirings(clk, din, dout, others=()):
+	"""
+	Every (clk, din, dout) out of the lists of BitBangs for each which can
+	be used together, and with the BitBangs in others. usart.fastest()
+	picks the quickest.
+	"""
+	return [w for w in itertools.product(clk, din, dout) if conflicts(list(w) + list(others)) is None]
+
+
 class ShiftOp(object):
 	class FirstBit(Enum):
 		"""
@@ -601,11 +966,38 @@ class ShiftOp(object):
 			raise ValueError("Invalid data direction %r" % direction)
 """
 
+	def used_pins(self):
+		return [p for p in (self.clk_pin, self.din_pin, self.dout_pin) if p]
+
+	def symbols(self):
+		symbols = {}
+		for p in self.used_pins():
+			symbols.update(p.symbols())
+		return symbols
+
+	def prologue(self):
+		"""The set up code of all the pins, each line once."""
+		lines = []
+		pointers = {}
+		conflict = conflicts(self.used_pins())
+		if conflict:
+			raise ValueError(conflict)
+		for p in self.used_pins():
+			pointer = getattr(p, 'pointer', None)
+			if pointer:
+				if pointers.setdefault(pointer, p.pin.port) != p.pin.port:
+					raise ValueError("%s used for the proxy of both port %s and %s" % (
+						pointer, pointers[pointer], p.pin.port))
+			for l in p.prologue():
+				if l not in lines:
+					lines.append(l)
+		return lines
+
 	def generate(self):
 		raise NotImplementedError()
 
 def asm_comment(s):
-	return '__asm__ ("	; %s");' % s.replace('\\', '\\\\')
+	return ir.Comment(s)
 
 class ShiftByte(ShiftOp):
 	"""
@@ -620,91 +1012,1099 @@ class ShiftByte(ShiftOp):
 
 	(1cy) RLC A - Rotate A left through carry
 	(1cy) RRC A - Rotate A right through carry
+
+	When the pins need A (RegisterAccessInASM) the data is kept in
+	DATA_REGISTER instead and each rotate loads and stores it.
 	"""
 
-	def generate(self, direction, read_on, write_on, pad=True):
+	# Where the data is kept while the pins use A. reverse_bits() only uses
+	# it before / after the shifting.
+	DATA_REGISTER = "r2"
+
+	def data_register(self, read_on=None, write_on=None):
+		"""
+		The register holding the data while shifting, None if it stays in A.
+		Without read_on / write_on it's for reading and writing.
+		"""
+		used = []
+		if read_on != ShiftOp.ClockMode.none:
+			used.append(self.din_pin)
+		if write_on != ShiftOp.ClockMode.none:
+			used.append(self.dout_pin)
+		if any(getattr(p, 'uses_a', False) for p in used):
+			return self.DATA_REGISTER
+		return None
+
+	@staticmethod
+	def on_data(lines, data):
+		"""lines working on the data in A, around the data register if there is one."""
+		if data is None:
+			return lines
+		return [asm("mov", "a", data, comment="%s->data" % data)] + lines + [
+			asm("mov", data, "a", comment="data->%s" % data)]
+
+	def ops(self, direction, read_on, write_on, stash=False, merge=False):
+		"""
+		The ops of shifting one bit, in program order, for the scheduler.
+
+		Data changes on the write_on edge, so for a write on the positive
+		edge the next bit has to be out before the negative edge. Reads
+		happen after the read_on edge.
+
+		Reading and writing both go through the carry, so normally the bit
+		read has to be rotated into A before the next bit can be written.
+		With stash (for reads and writes on the positive edge) the next bit
+		is rotated out and written first and the bit read is then put
+		straight into A (mov acc.n,c).
+
+		With merge (when the data and clock pins share a proxy byte) the
+		write only updates the proxy and the clock edge writes it out to the
+		pins. On the positive edge that has to be the next bit, so the rotate
+		and write run an iteration ahead, between the edges of the one before
+		(the first bit going out on its own before the clocking).
+		"""
 		assert isinstance(direction, ShiftOp.FirstBit)
 		assert isinstance(read_on, ShiftOp.ClockMode)
 		assert isinstance(write_on, ShiftOp.ClockMode)
 
-		read_ops = self.din_pin.bit_to_carry().splitlines()
-		write_ops = self.dout_pin.carry_to_bit().splitlines()
+		reading = read_on != ShiftOp.ClockMode.none
+		writing = write_on != ShiftOp.ClockMode.none
+		assert not stash or (read_on == write_on == ShiftOp.ClockMode.positive)
+
+		read_ops = self.din_pin.bit_to_carry()
+		write_ops = self.dout_pin.carry_to_bit()
+
+		assert not merge or self.dout_pin.flushed_by(self.clk_pin)
+		assert not merge or write_on == ShiftOp.ClockMode.negative or not reading
+		if merge:
+			write_ops = self.dout_pin.carry_to_proxy()
 
 		# Do we need to change directions between read/write?
 		if self.din_pin == self.dout_pin:
-			if write_on != ShiftOp.ClockMode.none and read_on != ShiftOp.ClockMode.none:
-				read_ops = self.din_pin.setup(pins.PinDirection.input).splitlines() + read_ops
-				write_ops = self.dout_pin.setup(pins.PinDirection.output).splitlines() + write_ops
-
-		# Collect instructions on negative edge
-		neg_edge = []
-		neg_edge.append(self.clk_pin.clear())
-		if write_on == ShiftOp.ClockMode.negative:
-			neg_edge += write_ops
+			if writing and reading:
+				read_ops = self.din_pin.setup(pins.PinDirection.input) + read_ops
+				write_ops = self.dout_pin.setup(pins.PinDirection.output) + write_ops
+
+		symbols = self.symbols()
+		read_ops, fetch_ops = self.split(read_ops, symbols)
+		data = self.data_register(read_on, write_on)
+		rotate = direction.value
+		neg = scheduler.Op("neg", self.clk_pin.clear(), edge='neg', symbols=symbols)
+		pos = scheduler.Op("pos", self.clk_pin.set(), edge='pos', symbols=symbols)
+		write = scheduler.Op("write", write_ops, symbols=symbols)
+
+		if merge and write_on == ShiftOp.ClockMode.positive:
+			return [neg,
+				scheduler.Op("rotate", self.on_data([asm(rotate, "a", comment="data->carry")], data),
+					first=-1, last=-1),
+				scheduler.Op("write", write_ops, first=-1, last=-1, symbols=symbols,
+					alone=self.dout_pin.carry_to_bit()),
+				pos]
+
+		ops = []
+		if reading and writing:
+			# The rotate storing the last bit read also fetches the next bit
+			# to write, so it runs once more after the last bit.
+			ops.append(scheduler.Op("rotate", self.on_data([asm(rotate, "a", comment="data->carry->data")], data), last=1))
+		elif writing:
+			ops.append(scheduler.Op("rotate", self.on_data([asm(rotate, "a", comment="data->carry")], data)))
+
+		if stash:
+			# Iteration i reads the bit clocked in by iteration i - 1
+			ops.append(write)
+			ops.append(scheduler.Op("read", read_ops, first=1, last=1, symbols=symbols))
+			if fetch_ops:
+				ops.append(scheduler.Op("fetch", fetch_ops, first=1, last=1, symbols=symbols))
+			ops.append(scheduler.Op("stash", self.on_data([
+				asm("mov", "acc.%i" % (0 if direction == ShiftOp.FirstBit.MSB else 7), "c", comment="carry->data")], data),
+				first=1, last=1))
+			ops += [neg, pos]
+			return ops
+
+		read = [scheduler.Op("read", read_ops, symbols=symbols)]
+		if fetch_ops:
+			read.append(scheduler.Op("fetch", fetch_ops, symbols=symbols))
+		if write_on == ShiftOp.ClockMode.positive or merge:
+			ops.append(write)
+		ops.append(neg)
+		if write_on == ShiftOp.ClockMode.negative and not merge:
+			ops.append(write)
 		if read_on == ShiftOp.ClockMode.negative:
-			neg_edge += read_ops
+			ops += read
+		ops.append(pos)
+		if read_on == ShiftOp.ClockMode.positive:
+			ops += read
 
-		# Collect instructions on positive edge
-		pos_edge = []
-		pos_edge.append(self.clk_pin.set())
+		if not writing:
+			ops.append(scheduler.Op("rotate", self.on_data([asm(rotate, "a", comment="carry->data")], data)))
+		return ops
+
+	@staticmethod
+	def split(lines, symbols=None):
+		"""
+		(the lines up to the last pin access, the lines after it) of a read.
+		The second only work on a proxy byte or A, so the scheduler can move
+		them past a clock edge, like the MOV C,bit after a port E read.
+		"""
+		pinned = [i for i, l in enumerate(lines) if scheduler.Op(l, [l], symbols=symbols).pinned]
+		cut = pinned[-1] + 1 if pinned else len(lines)
+		return lines[:cut], lines[cut:]
+
+	def generate(self, direction, read_on, write_on, pad=True, rate=None, speed=cycles.CPUSpeed.MHz48):
+		"""
+		Unrolled code shifting a byte, with the ops placed by the scheduler.
+		With rate (bits per second) the clock is slowed down to the nearest
+		rate there is with the CPU at speed, see timing().
+		"""
+		return self.prologue() + self.shift(direction, read_on, write_on, pad, rate, speed)
+
+	def options(self, read_on, write_on):
+		"""The ways of building the ops worth trying, as arguments to ops()."""
+		options = [{}]
+		if read_on == write_on == ShiftOp.ClockMode.positive:
+			options.append({'stash': True})
+		if self.dout_pin.flushed_by(self.clk_pin) and (
+				write_on == ShiftOp.ClockMode.negative
+				or write_on == ShiftOp.ClockMode.positive and read_on == ShiftOp.ClockMode.none):
+			options.append({'merge': True})
+		return options
+
+	def supports(self, direction, read_on, write_on):
+		"""Every combination can be bit banged."""
+		return True
+
+	def byte_cycles(self, direction, read_on, write_on):
+		"""Cycles of generate() at full speed, it runs straight through."""
+		return cycle_count(self.generate(direction, read_on, write_on))
+
+	# Stages the schedule can run ops in, see scheduler.schedule()
+	STAGES = scheduler.STAGES
+
+	def schedule(self, direction, read_on, write_on, stages=None):
+		"""The fastest schedule out of options()."""
+		stages = stages or self.STAGES
+		best = None
+		for kw in self.options(read_on, write_on):
+			s = scheduler.schedule(self.ops(direction, read_on, write_on, **kw), stages=stages)
+			if best is None or s.period < best.period:
+				best = s
+		return best
+
+	def timing(self, direction, read_on, write_on, rate, speed=cycles.CPUSpeed.MHz48):
+		"""
+		(period in cycles, rate, error) of the rate nearest to rate (in bits
+		per second) with the CPU at speed. Nothing is faster than the
+		schedule, every slower whole number of cycles is possible.
+		"""
+		fastest = self.schedule(direction, read_on, write_on).period
+		exact = speed.cycles_per_second / float(rate)
+		period = max(fastest, int(exact))
+		if period + 1 > fastest and abs(speed.cycles_per_second / float(period + 1) - rate) < abs(
+				speed.cycles_per_second / float(period) - rate):
+			period += 1
+		actual = speed.cycles_per_second / float(period)
+		return period, actual, (actual - rate) / rate
+
+	def shift(self, direction, read_on, write_on, pad=True, rate=None, speed=cycles.CPUSpeed.MHz48):
+		"""The code shifting a byte in A, without the pin set up."""
+		best = self.schedule(direction, read_on, write_on)
+		if rate is None:
+			body = best.render(count=8, pad=pad, comment=asm_comment)
+		else:
+			period, actual, error = self.timing(direction, read_on, write_on, rate, speed)
+			body = [self.rate_comment(rate, actual, error, speed)] + best.render(
+				count=8, comment=asm_comment, period=period, delay=delay)
+
+		data = self.data_register(read_on, write_on)
+		if data is None:
+			return body
+		if write_on != ShiftOp.ClockMode.none:
+			body = [asm("mov", data, "a", comment="data->%s" % data)] + body
+		if read_on != ShiftOp.ClockMode.none:
+			body = body + [asm("mov", "a", data, comment="%s->data" % data)]
+		return body
+
+	@staticmethod
+	def rate_comment(rate, actual, error, speed):
+		return asm_comment("%i bit/s asked for, %.0f bit/s (%+.2f%%) at %s, CPUCS.CLKSPD=%#04x" % (
+			rate, actual, error * 100, speed, speed.cpucs))
+
+
+class ShiftByteAdaptive(ShiftByte):
+	"""
+	ShiftByte with adaptive clocking (RTCK, MPSSE 0x96), after each clock
+	edge it waits for the target to echo it on rtck before going on.
+
+	Each wait spins on JB / JNB at most timeout (1 to 256) times round, then
+	sets F0 and carries on regardless, so a dead target can't hang the
+	firmware. The scheduled code is the same as ShiftByte's with the waits
+	put straight after the edges, see wait_cycles() for what they cost.
+	"""
+
+	# Set when a wait times out, the caller clears it
+	TIMEOUT_FLAG = "F0"
+	# Counts the times round a wait
+	COUNTER = "r3"
+
+	def __init__(self, clk_pin, din_pin, dout_pin, rtck_pin, timeout=256):
+		ShiftByte.__init__(self, clk_pin, din_pin, dout_pin)
+		assert isinstance(rtck_pin, BitAccessInASM), "JB / JNB need a bit addressable rtck"
+		assert rtck_pin.direction == pins.PinDirection.input
+		assert 1 <= timeout <= 256, timeout
+		self.rtck_pin = rtck_pin
+		self.timeout = timeout
+
+	def used_pins(self):
+		return ShiftByte.used_pins(self) + [self.rtck_pin]
+
+	def wait(self, level):
+		"""Wait for rtck to read level, or time out."""
+		return [
+			asm("mov", self.COUNTER, "#%i" % (self.timeout & 0xff)),
+			asm("jb" if level else "jnb", "_%s" % self.rtck_pin.bit_name, ".+7", comment="rtck"),
+			asm("djnz", self.COUNTER, ".-3"),
+			asm("setb", "_%s" % self.TIMEOUT_FLAG, comment="timed out"),
+		]
+
+	def wait_cycles(self, spins=0):
+		"""
+		Cycles a wait takes when rtck is wrong the first spins times it is
+		tested, 0 being the best case. From timeout on it gives up.
+		"""
+		mov, test, djnz, flag = [l.cycles for l in self.wait(1)]
+		if spins >= self.timeout:
+			return mov + self.timeout * (test + djnz) + flag
+		return mov + spins * (test + djnz) + test
+
+	def byte_cycles(self, direction, read_on, write_on, spins=0):
+		"""Cycles of generate() with every wait taking wait_cycles(spins)."""
+		lines = self.prologue() + self.start() + ShiftByte.shift(self, direction, read_on, write_on)
+		return cycle_count(lines) + 16 * self.wait_cycles(spins)
+
+	def start(self):
+		return [asm("clr", "_%s" % self.TIMEOUT_FLAG)]
+
+	def generate(self, direction, read_on, write_on, pad=True, rate=None, speed=cycles.CPUSpeed.MHz48):
+		"""As ShiftByte, rate being the fastest the clock goes."""
+		return self.prologue() + self.start() + self.shift(
+			direction, read_on, write_on, pad, rate, speed)
+
+	def shift(self, direction, read_on, write_on, pad=True, rate=None, speed=cycles.CPUSpeed.MHz48):
+		# The scheduler puts the lines of each edge straight after its
+		# ir.Edge, the waits go after the last of them. Matching the lines
+		# themselves would also catch a data write ending like the edge (the
+		# flush of a port E proxy byte).
+		edges = {
+			'neg': (len(self.clk_pin.clear()), 0),
+			'pos': (len(self.clk_pin.set()), 1),
+		}
+		body = ShiftByte.shift(self, direction, read_on, write_on, pad, rate, speed)
+		waits = {}	# index of the last line of an edge -> level
+		for i, l in enumerate(body):
+			if isinstance(l, ir.Edge):
+				length, level = edges[l.slot]
+				waits[i + length] = level
+		cmds = []
+		for i, l in enumerate(body):
+			cmds.append(l)
+			if i in waits:
+				cmds += self.wait(waits[i])
+		return cmds
+
+
+def rotate_left(count):
+	"""Rotate A left count bits with the fewest RL / RR / SWAPs."""
+	count %= 8
+	options = [["rl"] * count, ["rr"] * (8 - count)]
+	options.append(["swap"] + (["rl"] * (count - 4) if count >= 4 else ["rr"] * (4 - count)))
+	return [asm(op, "a") for op in min(options, key=len)]
+
+
+class ShiftLanes(object):
+	"""
+	Shifts the byte in A over 2 or 4 data lines at a time, taking 4 or 2
+	clocks instead of 8. For dual / quad SPI, or as many JTAG chains sharing
+	TCK with their data bit interleaved (clock k of each byte carries one
+	bit of every chain, lane n being chain n).
+
+	The lanes are consecutive pins of one port (lane n at pin base + n), in
+	on some and out on others or on the same ones (quad SPI's IO0-3), with
+	the clock on the same port. Each clock writes the whole port at once,
+	the data bits rotated into place from A and or'ed with the other pins
+	of the port as they were at the start, so the edge the data changes on
+	and the new data go out in one write.
+
+	MSB first the first clock carries the top bits of A, lane n getting
+	bit 8 - lanes + n (IO3 bit 7 for quad SPI). The clock isn't evened out,
+	each half lasts as long as its instructions.
+	"""
+
+	# The byte going out, the byte coming in and the other pins of the port
+	DATA = "r7"
+	TEMPLATE = "r6"
+	RESULT = "r5"
+
+	def __init__(self, clk, din, dout):
+		"""
+		ShiftLanes(pins.Pin("B", 7), [pins.Pin("B", 2), pins.Pin("B", 3)],
+			[pins.Pin("B", 0), pins.Pin("B", 1)])
+
+		din / dout being a list of pins.Pin, or empty.
+		"""
+		self.clk = clk
+		self.din = list(din)
+		self.dout = list(dout)
+		self.lanes = len(self.din or self.dout)
+		assert self.lanes in (2, 4), self.lanes
+		for lanes in (self.din, self.dout):
+			if not lanes:
+				continue
+			assert len(lanes) == self.lanes, (len(lanes), self.lanes)
+			assert [p.index for p in lanes] == list(range(lanes[0].index, lanes[0].index + self.lanes)), \
+				"lanes must be consecutive pins"
+			assert all(p.port == clk.port for p in lanes), "lanes must be on the clock's port"
+		self.shared = [(p.port, p.index) for p in self.din] == [(p.port, p.index) for p in self.dout]
+
+	def mask(self, lanes):
+		return sum(p.mask for p in lanes)
+
+	def symbols(self):
+		return {}
+
+	def supports(self, direction, read_on, write_on):
+		"""Reading needs din, writing dout. Shared lanes go one way at a time."""
+		reading = read_on != ShiftOp.ClockMode.none
+		writing = write_on != ShiftOp.ClockMode.none
+		if (reading and not self.din) or (writing and not self.dout):
+			return False
+		return not (reading and writing and self.shared)
+
+	def group(self, direction, k):
+		"""The lowest bit of A clock k carries."""
+		if direction == ShiftOp.FirstBit.MSB:
+			return 8 - self.lanes * (k + 1)
+		return self.lanes * k
+
+	def edge(self, level):
+		if self.clk.bit_accessible:
+			return asm("setb" if level else "clr", "_%s" % self.clk.bit_name, comment="clk")
+		if level:
+			return asm("orl", "_%s" % self.clk.port_name, "#%#04x" % self.clk.mask, comment="clk")
+		return asm("anl", "_%s" % self.clk.port_name, "#%#04x" % self.clk.nask, comment="clk")
+
+	def prologue(self, reading, writing):
+		lines = []
+		if self.shared:
+			# The lanes are turned round for the direction of the function
+			mask = self.mask(self.dout)
+			if writing:
+				lines.append(asm("orl", "_%s" % self.clk.output_name, "#%#04x" % mask, comment="lanes out"))
+			else:
+				lines.append(asm("anl", "_%s" % self.clk.output_name, "#%#04x" % (~mask & 0xff), comment="lanes in"))
+		if writing:
+			lines.append(asm("mov", self.DATA, "a"))
+		return lines
+
+	def template(self, write_on):
+		"""The other pins of the port, with the clock high when writing on +ve."""
+		used = self.mask(self.din) | self.mask(self.dout) | self.clk.mask
+		lines = [
+			asm("mov", "a", "_%s" % self.clk.port_name),
+			asm("anl", "a", "#%#04x" % (~used & 0xff)),
+		]
 		if write_on == ShiftOp.ClockMode.positive:
-			pos_edge += write_ops
-		if read_on == ShiftOp.ClockMode.positive:
-			pos_edge += read_ops
-
-		# Figure out how the rotate will work
-		rotate_tmpl = '__asm__ ("%s	a"); 		/* %%s */' % direction.value
-		rotate_op = ""
-		if write_on != ShiftOp.ClockMode.none and read_on != ShiftOp.ClockMode.none:
-			rotate_op = rotate_tmpl % "data->carry->data"
-		elif write_on != ShiftOp.ClockMode.none:
-			rotate_op = rotate_tmpl % "data->carry"
-		elif read_on != ShiftOp.ClockMode.none:
-			rotate_op = rotate_tmpl % "carry->data"
-
-		# Find were we want to put the rotate operation
-		if rotate_op:
-			if len(neg_edge) > len(pos_edge):
-				pos_edge.append(rotate_op)
-			elif len(neg_edge) < len(pos_edge):
-				neg_edge.append(rotate_op)
+			lines.append(asm("orl", "a", "#%#04x" % self.clk.mask))
+		return lines + [asm("mov", self.TEMPLATE, "a", comment="other pins")]
+
+	def write(self, direction, k):
+		"""Write the bits of clock k and the clock level of the template."""
+		base = self.dout[0].index
+		return [asm("mov", "a", self.DATA)] + rotate_left(base - self.group(direction, k)) + [
+			asm("anl", "a", "#%#04x" % self.mask(self.dout)),
+			asm("orl", "a", self.TEMPLATE),
+			asm("mov", "_%s" % self.clk.port_name, "a", comment="clock %i out" % k),
+		]
+
+	def read(self, direction, k):
+		"""Put the bits of clock k into RESULT."""
+		base = self.din[0].index
+		lines = [
+			asm("mov", "a", "_%s" % self.clk.port_name, comment="clock %i in" % k),
+			asm("anl", "a", "#%#04x" % self.mask(self.din)),
+		] + rotate_left(self.group(direction, k) - base)
+		if k:
+			lines.append(asm("orl", "a", self.RESULT))
+		return lines + [asm("mov", self.RESULT, "a")]
+
+	def generate(self, direction, read_on, write_on):
+		"""
+		Code shifting the byte in A, leaving the byte read in A. Each clock
+		is a -ve then a +ve edge, like ShiftByte.
+		"""
+		if not self.supports(direction, read_on, write_on):
+			raise ValueError("Can't read on %s and write on %s over these lanes" % (read_on, write_on))
+		reading = read_on != ShiftOp.ClockMode.none
+		writing = write_on != ShiftOp.ClockMode.none
+		clocks = 8 // self.lanes
+
+		lines = self.prologue(reading, writing)
+		if writing:
+			lines += self.template(write_on)
+		if write_on == ShiftOp.ClockMode.positive:
+			# The first bits go out before the first -ve edge
+			lines += self.write(direction, 0)
+		for k in range(clocks):
+			if write_on == ShiftOp.ClockMode.negative:
+				lines += self.write(direction, k)
 			else:
-				neg_edge.append(rotate_op)
-
-		# Pad the edges out to be symmetrical in cycle length
-		# FIXME: This won't work for the C versions...
-		neg_edge_instructions = cycles.parse("\n".join(neg_edge))
-		neg_edge_len = sum(i[0].cycles for i in neg_edge_instructions if i)
+				lines.append(self.edge(0))
+			if read_on == ShiftOp.ClockMode.negative:
+				lines += self.read(direction, k)
+			if write_on == ShiftOp.ClockMode.positive and k + 1 < clocks:
+				lines += self.write(direction, k + 1)
+			else:
+				lines.append(self.edge(1))
+			if read_on == ShiftOp.ClockMode.positive:
+				lines += self.read(direction, k)
+		if reading:
+			lines.append(asm("mov", "a", self.RESULT))
+		return lines
 
-		pos_edge_instructions = cycles.parse("\n".join(pos_edge))
-		pos_edge_len = sum(i[0].cycles for i in pos_edge_instructions if i)
+	def byte_cycles(self, direction, read_on, write_on):
+		"""Cycles of generate(), it runs straight through."""
+		return cycle_count(self.generate(direction, read_on, write_on))
 
-		longest = max(neg_edge_len, pos_edge_len)
 
-		if pad:
-			for i in range(0, longest - pos_edge_len):
-				pos_edge.append('__asm__ ("nop");')
-			for i in range(0, longest - neg_edge_len):
-				neg_edge.append('__asm__ ("nop");')
+class ShiftBits(ShiftByte):
+	"""
+	Shift length + 1 (1 to 8) bits, like the MPSSE bit commands.
+
+	The code for 8 bits is entered at bit 8 - N through a jump table indexed
+	by the length, so the edges have the same timing as for a whole byte.
+	The entry point for bit k is in front of the ops of bit k the schedule
+	runs in the periods before it (software pipelining), or when they
+	aren't all at the end of the previous period a stub with a copy of them
+	runs first (see scheduler.Schedule.entries). For that the schedule
+	isn't allowed to run an op a bit late.
+
+	MSB first the bits shifted out are the top N bits of data and the bits
+	read end up in the low N bits, LSB first the other way round, as on the
+	MPSSE.
+	"""
 
-			neg_edge_instructions = cycles.parse("\n".join(neg_edge))
-			pos_edge_instructions = cycles.parse("\n".join(pos_edge))
+	STAGES = (0, 1)
 
-		cmds = []
-		if write_on == ShiftOp.ClockMode.negative:
-			cmds.append(asm_comment("Before"))
-			cmds.append(rotate_tmpl % "data->carry")
+	# The most bits a command clocks, a longer length clocks this many
+	BITS = 8
 
-		for i in range(0, 8):
-			cmds.append(asm_comment("Bit %i" % i))
-			cmds.append("/* \_ (%s cycles) */" % neg_edge_len)
-			cmds += neg_edge
-			cmds.append("/* _/ (%s cycles) */" % pos_edge_len)
-			cmds += pos_edge
+	def options(self, read_on, write_on):
+		# Stashing runs the first read in the second period, merging a
+		# positive edge write the first write before the clocking
+		return [kw for kw in ShiftByte.options(self, read_on, write_on) if not kw.get('stash')
+			and not (kw.get('merge') and write_on == ShiftOp.ClockMode.positive)]
 
-		if read_on == ShiftOp.ClockMode.positive:
-			cmds.append(asm_comment("After)"))
-			cmds.append(rotate_tmpl % "carry->data")
+	@staticmethod
+	def parameters(read_on, write_on):
+		"""Names of the C arguments, in order."""
+		if write_on != ShiftOp.ClockMode.none:
+			return ["data", "length"]
+		return ["length"]
 
+	def generate(self, direction, read_on, write_on, name, pad=True, rate=None, speed=cycles.CPUSpeed.MHz48,
+			registers=False):
+		"""
+		The body of name(), which has the arguments given by parameters() and
+		leaves the data read in A. rate and speed are as for ShiftByte.
+		With registers the data comes in A and the length in r7 instead, see
+		calling.REGISTERS.
+		"""
+		writing = write_on != ShiftOp.ClockMode.none
+		labels = Labels()
+		if self.data_register(read_on, write_on):
+			raise ValueError("%s keeps the data in A, which the pins use" % self.__class__.__name__)
+
+		best = self.schedule(direction, read_on, write_on)
+		cmds = self.prologue()
+		if rate is None:
+			stubs, blocks = best.entries(count=8, pad=pad, comment=asm_comment)
+		else:
+			period, actual, error = self.timing(direction, read_on, write_on, rate, speed)
+			cmds.append(self.rate_comment(rate, actual, error, speed))
+			stubs, blocks = best.entries(count=8, comment=asm_comment, period=period, delay=delay)
+
+		if registers:
+			cmds.append(asm("xch", "a", "r7", comment="data<->length") if writing else asm("mov", "a", "r7", comment="length"))
+		elif writing:
+			cmds += [
+				asm("mov", "r7", "dpl", comment="data"),
+				asm("mov", "a", "_%s_PARM_2" % name, comment="length"),
+			]
+		else:
+			cmds.append(asm("mov", "a", "dpl", comment="length"))
+		table = labels()
+		cmds += [
+			asm("anl", "a", "#0x07"),
+			asm("rl", "a"),
+			asm("rl", "a", comment="4 bytes an entry"),
+			asm("mov", "dptr", "#%s" % table),
+			asm("jmp", "@a+dptr"),
+			ir.Label(table),
+		]
+
+		entry = [labels() for k in range(8)]
+		stub = [labels() if stubs[k] else entry[k] for k in range(8)]
+		for length in range(8):
+			bits = min(length + 1, self.BITS)
+			cmds += [
+				asm("mov", "a", "r7", comment="data") if writing else asm("clr", "a"),
+				asm("ljmp", stub[8 - bits], comment="%i bits" % bits),
+			]
+		# Iterations before 8 - BITS are never entered
+		entered = range(8 - self.BITS, 8)
+		for k in entered:
+			if stubs[k]:
+				cmds.append(ir.Label(stub[k]))
+				cmds += stubs[k]
+				cmds.append(asm("ljmp", entry[k]))
+		for k in entered:
+			cmds.append(ir.Label(entry[k]))
+			cmds += blocks[k]
 		return cmds
 
+
+class ShiftTMS(ShiftBits):
+	"""
+	Clock 1 to 7 bits out on TMS, like the MPSSE TMS commands (0x4a, 0x4b,
+	0x6a, 0x6b, 0x6e, 0x6f).
+
+	Bits 0 to 6 of data go out on TMS LSB first, through the same code as
+	ShiftBits so the edges have the same timing as the data shifters, while
+	bit 7 is held on TDI (dout) for the whole command. TDO (din) can be read
+	at the same time and ends up in the top bits, as for ShiftBits LSB first.
+	A length of 7 clocks 7 bits like 6 does, bit 7 isn't TMS's to send.
+	"""
+
+	BITS = 7
+
+	def __init__(self, clk_pin, din_pin, dout_pin, tms_pin):
+		ShiftBits.__init__(self, clk_pin, din_pin, tms_pin)
+		assert dout_pin.direction == pins.PinDirection.output
+		self.tdi_pin = dout_pin
+
+	def used_pins(self):
+		return ShiftBits.used_pins(self) + [self.tdi_pin]
+
+	def generate(self, read_on, write_on, name, pad=True, rate=None, speed=cycles.CPUSpeed.MHz48,
+			registers=False):
+		"""
+		The body of name(data, length), which leaves the data read in A.
+		registers is as for ShiftBits.generate().
+		"""
+		assert write_on != ShiftOp.ClockMode.none, "TMS is always written"
+		if registers:
+			# A has to be kept for ShiftBits
+			tdi = [asm("mov", "c", "acc.7", comment="bit 7->carry")]
+		else:
+			tdi = [
+				asm("mov", "a", "dpl", comment="data"),
+				asm("rlc", "a", comment="bit 7->carry"),
+			]
+		tdi += self.tdi_pin.carry_to_bit()
+
+		cmds = ShiftBits.generate(self, ShiftOp.FirstBit.LSB, read_on, write_on, name, pad, rate, speed,
+			registers)
+		prologue = len(self.prologue())
+		return cmds[:prologue] + tdi + cmds[prologue:]
+
+
+class ClockOnly(ShiftBits):
+	"""
+	Clock without any data, like the MPSSE clock only commands.
+
+	  bits()    1 to 8 clocks (0x8e), the ShiftBits code with no data ops
+	  bytes()   (length + 1) * 8 clocks (0x8f), 8 clocks unrolled a loop
+	  until()   clocks until gpio is high / low (0x94 / 0x95) or, given
+	            a length, at most (length + 1) * 8 clocks (0x9c / 0x9d)
+
+	cycles() gives the cycles each of them takes, checked against the
+	simulator by benchmark.py.
+	"""
+
+	def __init__(self, clk_pin, gpio_pin=None):
+		self.clk_pin = clk_pin
+		assert self.clk_pin.direction == pins.PinDirection.output, (self.clk_pin.direction, pins.PinDirection.output)
+		assert gpio_pin is None or gpio_pin.direction == pins.PinDirection.input
+		self.din_pin = gpio_pin
+		self.dout_pin = None
+
+	def options(self, read_on, write_on):
+		return [{}]
+
+	def ops(self, direction=None, read_on=None, write_on=None):
+		"""Just the two clock edges."""
+		symbols = self.symbols()
+		return [
+			scheduler.Op("neg", self.clk_pin.clear(), edge='neg', symbols=symbols),
+			scheduler.Op("pos", self.clk_pin.set(), edge='pos', symbols=symbols),
+		]
+
+	def pulses(self, count):
+		"""count clock pulses, as fast as they go."""
+		best = self.schedule(ShiftOp.FirstBit.MSB, ShiftOp.ClockMode.none, ShiftOp.ClockMode.none)
+		return best.render(count=count, comment=asm_comment)
+
+	def bits(self, name):
+		"""The body of name(length), length + 1 clocks."""
+		none = ShiftOp.ClockMode.none
+		return self.generate(ShiftOp.FirstBit.MSB, none, none, name)
+
+	def bytes(self, name):
+		"""The body of name(length), (length + 1) * 8 clocks."""
+		labels = Labels()
+		top = labels()
+		return self.prologue() + [
+			asm("mov", "r7", "dpl", comment="length (low)"),
+			asm("mov", "r6", "dph", comment="length (high)"),
+			# length + 1 bytes, as the low count then 256 times the high
+			asm("inc", "r7"),
+			asm("inc", "r6"),
+			ir.Label(top),
+		] + self.pulses(8) + [
+			asm("djnz", "r7", top),
+			asm("djnz", "r6", top),
+		]
+
+	def until(self, name, level, counted=False):
+		"""
+		The body of name() or, counted, name(length) clocking until the gpio
+		pin reads level just after a rising edge.
+		"""
+		assert self.din_pin is not None, "No gpio pin to wait on"
+		labels = Labels()
+		top, done = labels(), labels()
+		cmds = self.prologue()
+		if not counted:
+			return cmds + [ir.Label(top)] + self.pulses(1) + self.test(not level, top)
+
+		cmds += [
+			asm("mov", "r7", "dpl", comment="length (low)"),
+			asm("mov", "r6", "dph", comment="length (high)"),
+			asm("inc", "r7"),
+			asm("inc", "r6"),
+			ir.Label(top),
+		]
+		for i in range(8):
+			cmds += self.pulses(1) + self.test(level, done)
+		return cmds + [
+			asm("djnz", "r7", top),
+			asm("djnz", "r6", top),
+			ir.Label(done),
+		]
+
+	def test(self, level, label):
+		"""Jump to label if the gpio pin reads level."""
+		if isinstance(self.din_pin, BitAccessInASM):
+			return [asm("jb" if level else "jnb", "_%s" % self.din_pin.bit_name, label, comment="gpio")]
+		return self.din_pin.bit_to_carry() + [
+			asm("jc" if level else "jnc", label, comment="gpio")]
+
+	@staticmethod
+	def _cycles(lines):
+		return cycle_count(lines)
+
+	def cycles(self):
+		"""
+		{name: (cycles per clock, extra cycles per byte)} for bits(),
+		bytes() and until(), not counting the set up before the first clock.
+		"""
+		djnz = asm("djnz", "r7", "00000$").cycles
+		per_clock = self._cycles(self.pulses(8)) / 8.0
+		result = {
+			'bits': (per_clock, 0),
+			'bytes': (per_clock, djnz),
+		}
+		if self.din_pin is not None:
+			test = self._cycles(self.test(True, "00000$"))
+			result['until'] = (self._cycles(self.pulses(1)) + test, djnz)
+		return result
+
+
+def asm(mnemonic, *operands, comment=None):
+	"""An inline assembler statement, asm("mov", "a", "dpl"), see ir.Line."""
+	return ir.Line(mnemonic, operands, comment)
+
+# Registers the delay loops count down in
+DELAY_REGISTERS = ("r4", "r3")
+
+
+def delay(count, registers=DELAY_REGISTERS):
+	"""
+	Exactly count cycles of padding. NOPs for short delays, DJNZ loops on
+	registers (3 cycles a time round, nested for the longest) otherwise.
+	The loops jump relative to themselves, so they don't use up labels.
+	"""
+	inner, outer = registers
+	lines = []
+	# mov outer; (mov inner; 256 djnz inner; djnz outer) times m
+	while count >= 2 + 2 * (5 + 3 * 256):
+		m = min(256, (count - 2) // (5 + 3 * 256))
+		lines += [
+			asm("mov", outer, "#%i" % (m & 0xff)),
+			asm("mov", inner, "#0"),
+			asm("djnz", inner, ".", comment="256 times"),
+			asm("djnz", outer, ".-4", comment="%i times" % m),
+		]
+		count -= 2 + m * (5 + 3 * 256)
+	# mov inner; djnz inner n times
+	while count >= 8:
+		n = min(256, (count - 2) // 3)
+		lines += [
+			asm("mov", inner, "#%i" % (n & 0xff)),
+			asm("djnz", inner, ".", comment="%i times" % n),
+		]
+		count -= 2 + 3 * n
+	return lines + [scheduler.NOP] * count
+
+
+def reverse_bits(scratch="r2"):
+	"""
+	Reverse the bits of A (21 cycles), swapping neighbouring bits, then
+	pairs, then nibbles. scratch holds half of A while it goes.
+	"""
+	lines = []
+	for mask, shift in ((0x55, 1), (0x33, 2)):
+		lines += [asm("mov", scratch, "a")]
+		lines += [asm("anl", "a", "#%#04x" % mask)] + [asm("rl", "a")] * shift
+		lines += [asm("xch", "a", scratch)]
+		lines += [asm("anl", "a", "#%#04x" % (~mask & 0xff))] + [asm("rr", "a")] * shift
+		lines += [asm("orl", "a", scratch)]
+	return lines + [asm("swap", "a")]
+
+
+# The __code table reverse_table() makes
+REVERSE_TABLE = "bit_reverse"
+
+
+def reverse_table(name=REVERSE_TABLE):
+	"""C for the 256 byte __code table of every byte with its bits reversed."""
+	values = [sum(((i >> b) & 1) << (7 - b) for b in range(8)) for i in range(256)]
+	rows = []
+	for i in range(0, 256, 16):
+		rows.append("\t" + ", ".join("0x%02x" % v for v in values[i:i + 16]) + ",")
+	return "__code BYTE %s[256] = {\n%s\n};\n" % (name, "\n".join(rows))
+
+
+def reverse_lookup(name=REVERSE_TABLE):
+	"""Reverse the bits of A through reverse_table() (6 cycles), uses dptr."""
+	return [
+		asm("mov", "dptr", "#_%s" % name),
+		asm("movc", "a", "@a+dptr", comment="reversed"),
+	]
+
+
+def code_size(lines):
+	"""Bytes of code generated by lines."""
+	return sum(l.size for l in lines)
+
+
+def cycle_count(lines):
+	"""Cycles of lines run straight through, each instruction once."""
+	return sum(l.cycles for l in lines)
+
+class Labels(object):
+	"""
+	Local labels (nnnnn$) for the inline assembler of one function, sdcc
+	leaves 00000$ to 00099$ free for them.
+	"""
+
+	def __init__(self):
+		self.count = 0
+
+	def __call__(self):
+		assert self.count < 100, "Out of local labels"
+		self.count += 1
+		return "%05i$" % (self.count - 1)
+
+class ShiftBytes(ShiftByte):
+	"""
+	Shift length + 1 bytes (like the MPSSE length field) out of / into
+	buffers in xdata, with the shift byte code in a DJNZ loop unrolled
+	`unroll` times.
+
+	The first pointer comes in dptr. When shifting both ways the data in
+	comes from dptr and the data out goes through r1 + MPAGE (movx @r1).
+
+	The loop and pointer overhead runs between the last clock edge of a byte
+	and the first edge of the next, in place of the NOPs padding the end of
+	the byte. An "inc dptr" is moved into a run of padding NOPs inside the
+	byte when there is one. With unroll > 1 the odd bytes go through a single
+	copy of the byte code first.
+
+	So the clock period between bytes is longer than the one between bits
+	by the overhead. What of it comes before the first falling edge and
+	doesn't touch a pin is moved after it (see balance()), splitting it
+	between the high and the low half period, but a load feeding the first
+	bit out or a store of the last bit in has to stay in the high one: the
+	periods and the longest high and low times are in benchmark.json.
+
+	With autopointers the buffers (normally the endpoint buffers) are reached
+	through the FX2's auto incrementing pointers instead, AUTOPTR1 for the
+	data out and AUTOPTR2 for the data in. The bytes are then fetched with
+	"movx a,@r1" (MPAGE:r1 = XAUTODAT1) and stored with "movx @dptr,a"
+	(dptr = XAUTODAT2), 2 cycles each and no pointer to move on.
+	"""
+
+	PAGE_CARRY = asm("inc", "_MPAGE", comment="dst++ (high)")
+
+	# xdata addresses of the autopointer data registers
+	XAUTODAT1 = 0xE67B
+	XAUTODAT2 = 0xE67C
+
+	# AUTOPTRSETUP bits
+	APTREN = 0x01
+	APTR1INC = 0x02
+	APTR2INC = 0x04
+
+	def __init__(self, clk_pin, din_pin, dout_pin, unroll=1, autopointers=False):
+		ShiftByte.__init__(self, clk_pin, din_pin, dout_pin)
+		assert unroll in (1, 2, 4, 8), unroll
+		self.unroll = unroll
+		self.autopointers = autopointers
+
+	@staticmethod
+	def parameters(read_on, write_on):
+		"""Names of the C arguments, in order."""
+		params = []
+		if write_on != ShiftOp.ClockMode.none:
+			params.append("src")
+		if read_on != ShiftOp.ClockMode.none:
+			params.append("dst")
+		return params + ["length"]
+
+	def byte(self, direction, read_on, write_on, labels, pad=True, before=0):
+		"""
+		The code for one byte, loading and storing it and moving on the
+		pointers. before is the cycles of loop code run after the last byte
+		and before this one, the DJNZs at the end of the loop.
+		"""
+		reading = read_on != ShiftOp.ClockMode.none
+		writing = write_on != ShiftOp.ClockMode.none
+		symbols = self.symbols()
+
+		head, tail = [], []
+		if self.autopointers:
+			if writing:
+				head.append(asm("movx", "a", "@r1", comment="*src++->data"))
+			if reading:
+				tail.append(asm("movx", "@dptr", "a", comment="data->*dst++"))
+			body = self.shift(direction, read_on, write_on, pad)
+			body = scheduler.trim(body, self.run_cycles(head + tail), symbols=symbols)
+			return self.balance(head + body + tail, before)
+
+		if writing:
+			head.append(asm("movx", "a", "@dptr", comment="*src->data"))
+			advance = scheduler.Op("advance", [asm("inc", "dptr", comment="src++")])
+		else:
+			# The store pointer starts one back and moves on before the store
+			advance = scheduler.Op("advance", [asm("inc", "dptr", comment="dst++")])
+		if reading and writing:
+			skip = labels()
+			tail = [
+				asm("movx", "@r1", "a", comment="data->*dst"),
+				asm("inc", "r1", comment="dst++"),
+				asm("cjne", "r1", "#0", skip),
+				self.PAGE_CARRY,
+				ir.Label(skip),
+			]
+		elif reading:
+			tail.append(asm("movx", "@dptr", "a", comment="data->*dst"))
+
+		body = self.shift(direction, read_on, write_on, pad)
+		body = scheduler.trim(body, self.run_cycles(head + tail), symbols=symbols)
+		sunk = scheduler.sink(advance, body, symbols=symbols)
+		if sunk is None:
+			sunk = advance.lines + body
+		return self.balance(head + sunk + tail, before)
+
+	def balance(self, lines, before=0):
+		"""
+		Move the work in front of the first falling edge of the byte in lines
+		into the low half period after it, so the overhead between bytes
+		(which all falls in the high half period between the last rising edge
+		and the next falling one) is split between the two halves as evenly
+		as it can be. The period across the bytes stays the same.
+		"""
+		halves = {}
+		for l in lines:
+			if isinstance(l, ir.Edge):
+				halves.setdefault(l.slot, l.length)
+		if len(halves) < 2:
+			return lines
+		overhead = self.run_cycles(lines) + before - 8 * (halves['neg'] + halves['pos'])
+		high = halves['pos'] + overhead
+		return scheduler.defer(lines, (high - halves['neg']) / 2.0, symbols=self.symbols())
+
+	def run_cycles(self, lines):
+		"""Cycles to run lines, if the rare page carry is skipped."""
+		return sum(l.cycles for l in lines if l != self.PAGE_CARRY)
+
+	@staticmethod
+	def in_reach(lines, counters):
+		"""Can the DJNZs on counters after lines jump back to the start of lines."""
+		return code_size(lines) + 2 * len(counters) <= 128
+
+	@staticmethod
+	def loop(lines, counters, labels):
+		"""Run lines in a loop, going round again while DJNZ on any of counters jumps."""
+		top = labels()
+		code = [ir.Label(top)] + lines
+		if ShiftBytes.in_reach(lines, counters):
+			return code + [asm("djnz", c, top) for c in counters]
+		# Out of reach of a relative jump
+		near, out = labels(), labels()
+		code += [asm("djnz", c, near) for c in counters]
+		return code + [
+			asm("sjmp", out),
+			ir.Label(near),
+			asm("ljmp", top),
+			ir.Label(out),
+		]
+
+	def cycles_per_byte(self, direction, read_on, write_on):
+		"""
+		Cycles per byte in the main loop, including the loop and pointer
+		overhead but not the rare carry into the next page of the destination.
+		"""
+		labels = Labels()
+		lines = []
+		for i in range(self.unroll):
+			lines += self.byte(direction, read_on, write_on, labels)
+		back = asm("djnz", "r7", "00000$").cycles
+		if not self.in_reach(lines, ["r7", "r6"]):
+			back += asm("ljmp", "00000$").cycles
+		return (self.run_cycles(lines) + back) / self.unroll
+
+	def generate(self, direction, read_on, write_on, name, pad=True, registers=False):
+		"""
+		The body of name(), which has the arguments given by parameters().
+		With registers (autopointers only) the source and destination are
+		already in AUTOPTR1 / AUTOPTR2 and the length in r6:r7, see
+		calling.REGISTERS.
+		"""
+		reading = read_on != ShiftOp.ClockMode.none
+		writing = write_on != ShiftOp.ClockMode.none
+		labels = Labels()
+		assert self.autopointers or not registers, "registers needs the autopointers"
+
+		params = self.parameters(read_on, write_on)
+		parm = dict((p, "_%s_PARM_%i" % (name, i + 1)) for i, p in enumerate(params))
+		length = parm["length"]
+
+		def argument(p):
+			"""The (low, high) bytes of argument p."""
+			if p == params[0]:
+				return "dpl", "dph"
+			return parm[p], "(%s+1)" % parm[p]
+
+		cmds = self.prologue()
+		if self.autopointers:
+			if writing and any(getattr(p, 'pointer', None) == "r1" for p in self.used_pins()):
+				raise ValueError("r1 is needed for the source pointer")
+			setup = self.APTREN
+			if writing:
+				setup |= self.APTR1INC
+				if not registers:
+					low, high = argument("src")
+					cmds += [
+						asm("mov", "_AUTOPTRL1", low, comment="src (low)"),
+						asm("mov", "_AUTOPTRH1", high, comment="src (high)"),
+					]
+				cmds += [
+					asm("push", "_MPAGE"),
+					asm("mov", "_MPAGE", "#0x%02x" % (self.XAUTODAT1 >> 8)),
+					asm("mov", "r1", "#0x%02x" % (self.XAUTODAT1 & 0xff), comment="XAUTODAT1"),
+				]
+			if reading:
+				setup |= self.APTR2INC
+				if not registers:
+					low, high = argument("dst")
+					cmds += [
+						asm("mov", "_AUTOPTRL2", low, comment="dst (low)"),
+						asm("mov", "_AUTOPTRH2", high, comment="dst (high)"),
+					]
+				cmds.append(asm("mov", "dptr", "#0x%04x" % self.XAUTODAT2, comment="XAUTODAT2"))
+			cmds.append(asm("orl", "_AUTOPTRSETUP", "#0x%02x" % setup))
+		elif reading and writing:
+			if any(getattr(p, 'pointer', None) == "r1" for p in self.used_pins()):
+				raise ValueError("r1 is needed for the destination pointer")
+			cmds += [
+				asm("push", "_MPAGE"),
+				asm("mov", "r1", parm["dst"], comment="dst (low)"),
+				asm("mov", "_MPAGE", "(%s+1)" % parm["dst"], comment="dst (high)"),
+			]
+		elif reading:
+			cmds += [
+				asm("mov", "a", "dpl"),
+				asm("add", "a", "#0xff"),
+				asm("mov", "dpl", "a"),
+				asm("mov", "a", "dph"),
+				asm("addc", "a", "#0xff"),
+				asm("mov", "dph", "a", comment="dst--"),
+			]
+		if not registers:
+			cmds += [
+				asm("mov", "r7", length, comment="length (low)"),
+				asm("mov", "r6", "(%s+1)" % length, comment="length (high)"),
+			]
+
+		def byte(counters=()):
+			before = len(counters) and asm("djnz", counters[0], "00000$").cycles
+			return self.byte(direction, read_on, write_on, labels, pad, before)
+
+		if self.unroll == 1:
+			# length + 1 bytes, as the low count then 256 times the high
+			cmds += [asm("inc", "r7"), asm("inc", "r6")]
+			cmds += self.loop(byte(["r7"]), ["r7", "r6"], labels)
+		else:
+			done, main, low = labels(), labels(), labels()
+			# (length % unroll) + 1 single bytes...
+			cmds += [
+				asm("mov", "a", "r7"),
+				asm("anl", "a", "#%i" % (self.unroll - 1)),
+				asm("inc", "a"),
+				asm("mov", "r5", "a"),
+			]
+			# ...then length / unroll times round the unrolled loop
+			for i in range(self.unroll.bit_length() - 1):
+				cmds += [
+					asm("clr", "c"),
+					asm("mov", "a", "r6"),
+					asm("rrc", "a"),
+					asm("mov", "r6", "a"),
+					asm("mov", "a", "r7"),
+					asm("rrc", "a"),
+					asm("mov", "r7", "a"),
+				]
+			cmds += [asm_comment("Odd bytes")]
+			cmds += self.loop(byte(["r5"]), ["r5"], labels)
+			cmds += [
+				asm("mov", "a", "r7"),
+				asm("orl", "a", "r6"),
+				asm("jnz", main),
+				asm("ljmp", done),
+				ir.Label(main),
+				asm("mov", "a", "r7"),
+				asm("jz", low),
+				asm("inc", "r6"),
+				ir.Label(low),
+			]
+			cmds += [asm_comment("Unrolled bytes")]
+			lines = byte(["r7"])
+			for i in range(1, self.unroll):
+				lines += byte()
+			cmds += self.loop(lines, ["r7", "r6"], labels)
+			cmds.append(ir.Label(done))
+
+		if writing and (reading or self.autopointers):
+			cmds.append(asm("pop", "_MPAGE"))
+		return cmds
@@ -0,0 +1,179 @@
+"""
+MPSSE byte shifting through USART0 of the 100 pin FX2 in mode 0.
+
+In mode 0 the serial port is a synchronous shift register, TXD0 is the
+clock and RXD0 the data, shifting 8 bits LSB first at CLKOUT/4 (a bit every
+cycle, SCON0.SM2 set) or CLKOUT/12. The data changes while the clock is low
+and is sampled on the rising edge, and RXD0 only goes one way at a time, so
+only writes out on -ve and reads in on +ve can be done. MSB first bytes are
+turned round with software.reverse_bits(), or through the table from
+software.reverse_table() when there is one.
+
+fastest() picks between this and software.ShiftByte for the ways a board
+has the MPSSE clock / in / out wired, by the cycles a byte takes.
+"""
+
+import math
+
+import pins
+import software as sw
+import calling
+from software import asm
+
+
+class ShiftByteUSART(object):
+	"""
+	Shifts the byte in A through USART0, like ShiftByte.generate(). A write
+	loads SBUF0 and waits for TI, a read sets REN (with RI clear) and waits
+	for RI. The SCON0 write at the start clears the flag the last byte left.
+
+	The byte is taken as taking 8 bits from the SBUF0 / SCON0 write to TI /
+	RI being set, see byte_cycles().
+	"""
+
+	# SCON0 bits in mode 0
+	SM2 = 0x20
+	REN = 0x10
+
+	DIVIDERS = (4, 12)
+
+	def __init__(self, divider=4, scratch="r2", table=None):
+		"""
+		ShiftByteUSART(12, table=software.REVERSE_TABLE) reverses through
+		the table, leaving scratch alone but using dptr.
+		"""
+		assert divider in self.DIVIDERS, divider
+		self.divider = divider
+		self.scratch = scratch
+		self.table = table
+		self.clk_pin = pins.TXD0
+		self.din_pin = pins.RXD0
+		self.dout_pin = pins.RXD0
+
+	def symbols(self):
+		return {}
+
+	def supports(self, direction, read_on, write_on):
+		"""Writes out on -ve or reads in on +ve, not both."""
+		none = sw.ShiftOp.ClockMode.none
+		return (read_on, write_on) in (
+			(none, sw.ShiftOp.ClockMode.negative), (sw.ShiftOp.ClockMode.positive, none))
+
+	def mode(self, reading):
+		"""SCON0 for mode 0 at the divider, receiving when reading."""
+		return (self.SM2 if self.divider == 4 else 0) | (self.REN if reading else 0)
+
+	def bit_cycles(self):
+		"""Cycles a bit takes, CLKOUT being 4 clocks a cycle."""
+		return self.divider // 4
+
+	def generate(self, direction, read_on, write_on):
+		if not self.supports(direction, read_on, write_on):
+			raise ValueError("USART0 mode 0 can't read on %s and write on %s" % (read_on, write_on))
+		reverse = []
+		if direction == sw.ShiftOp.FirstBit.MSB and self.table:
+			reverse = sw.reverse_lookup(self.table)
+		elif direction == sw.ShiftOp.FirstBit.MSB:
+			reverse = sw.reverse_bits(self.scratch)
+
+		if read_on == sw.ShiftOp.ClockMode.none:
+			return [asm("mov", "_SCON0", "#%#04x" % self.mode(False), comment="mode 0, clears TI")] + reverse + [
+				asm("mov", "_SBUF0", "a", comment="starts shifting"),
+				asm("jnb", "_TI", ".", comment="8 bits"),
+			]
+		return [
+			asm("mov", "_SCON0", "#%#04x" % self.mode(True), comment="mode 0, REN with RI clear starts shifting"),
+			asm("jnb", "_RI", ".", comment="8 bits"),
+			asm("mov", "a", "_SBUF0"),
+		] + reverse
+
+	def wait_cycles(self):
+		"""Cycles spinning on TI / RI, the 8 bits rounded up to whole JNBs."""
+		jnb = asm("jnb", "_TI", ".").cycles
+		return jnb * int(math.ceil(8.0 * self.bit_cycles() / jnb))
+
+	def byte_cycles(self, direction, read_on, write_on):
+		"""Cycles of generate(), comparable with ShiftByte.byte_cycles()."""
+		lines = self.generate(direction, read_on, write_on)
+		jnb = asm("jnb", "_TI", ".").cycles
+		return sw.cycle_count(lines) - jnb + self.wait_cycles()
+
+
+def shifter(clk, din, dout, divider=4, table=None):
+	"""
+	The shifter for one wiring of the MPSSE pins, ShiftByteUSART when
+	they're USART0's (pins.TXD0 / pins.RXD0), otherwise ShiftByte bit
+	banging them.
+	"""
+	usart = (pins.TXD0, pins.RXD0)
+	if clk is pins.TXD0 and din is pins.RXD0 and dout is pins.RXD0:
+		return ShiftByteUSART(divider, table=table)
+	if clk in usart or din in usart or dout in usart:
+		raise ValueError("USART0 needs the clock on TXD0 and both data on RXD0")
+	return sw.ShiftByte(clk, din, dout)
+
+
+def fastest(wirings, direction, read_on, write_on, table=None):
+	"""
+	(shifter, cycles) for the wiring of (clk, din, dout) out of wirings
+	shifting a byte in the fewest cycles. ValueError when none of them can
+	do the combination.
+	"""
+	best = None
+	for clk, din, dout in wirings:
+		s = shifter(clk, din, dout, table=table)
+		if not s.supports(direction, read_on, write_on):
+			continue
+		cycles = s.byte_cycles(direction, read_on, write_on)
+		if best is None or cycles < best[1]:
+			best = (s, cycles)
+	if best is None:
+		raise ValueError("No wiring can read on %s and write on %s" % (read_on, write_on))
+	return best
+
+
+def main():
+	import mpsse
+
+	# A board with the JTAG pins on both port A and USART0
+	wirings = [
+		(mpsse.clock, mpsse.data_in, mpsse.data_out),
+		(pins.TXD0, pins.RXD0, pins.RXD0),
+	]
+	banged = shifter(*wirings[0])
+	usart = shifter(*wirings[1])
+	lookup = shifter(*wirings[1], table=sw.REVERSE_TABLE)
+
+	print("""\
+/* Generated file from usart.py */
+
+#include "fx2regs.h"
+#include "fx2types.h"
+
+""")
+	print("/* %-40s %9s %8s %8s  %s */" % ("cycles a byte", "ShiftByte", "USART0", "(table)", "fastest"))
+	for d, read_on, write_on in mpsse.combos:
+		picked, cycles = fastest(wirings, d, read_on, write_on)
+		supported = usart.supports(d, read_on, write_on)
+		print("/* %-40s %9i %8s %8s  %s */" % (
+			mpsse.function_name(d, read_on, write_on),
+			banged.byte_cycles(d, read_on, write_on),
+			usart.byte_cycles(d, read_on, write_on) if supported else "-",
+			lookup.byte_cycles(d, read_on, write_on) if supported else "-",
+			"USART0" if isinstance(picked, ShiftByteUSART) else "ShiftByte"))
+	print()
+
+	for divider, prefix in ((4, "ShiftByteUSART"), (12, "ShiftByteUSART12")):
+		s = ShiftByteUSART(divider)
+		for d, read_on, write_on in mpsse.combos:
+			if not s.supports(d, read_on, write_on):
+				continue
+			print(calling.generate(
+				name=mpsse.function_name(d, read_on, write_on, prefix),
+				read_on=read_on,
+				write_on=write_on,
+				body=s.generate(d, read_on, write_on)))
+
+
+if __name__ == "__main__":
+	main()